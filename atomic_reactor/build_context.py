@@ -0,0 +1,503 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Preparation of docker build contexts.
+
+Files are copied by the cheapest means the filesystem offers: a reflink
+(copy-on-write clone), in-kernel copy_file_range() or, as the last resort,
+read/write in chunks; several files are copied at once. Files excluded by
+.dockerignore are left out only when the tar stream is generated.
+
+Build contexts are sent to docker daemon as a tar stream generated on the
+fly, chunk by chunk, so memory use doesn't depend on size of the context.
+The stream can be gzip-compressed and kept in a cache: when nothing in the
+directory changed, the cached tar is sent instead of building it again.
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+import hashlib
+import io
+import logging
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import shutil
+import sys
+import tarfile
+import uuid
+import zlib
+
+from atomic_reactor.constants import DOCKERFILE_FILENAME
+
+
+logger = logging.getLogger(__name__)
+
+DOCKERIGNORE_FILENAME = '.dockerignore'
+
+# ioctl cloning whole file on copy-on-write filesystems (btrfs, xfs), linux/fs.h
+FICLONE = 0x40049409
+
+CHUNK_SIZE = 1024**2  # 1 MB chunk size for reading/writing
+
+MAX_COPY_THREADS = 8
+
+# directory to keep tars of build contexts in, there's no cache when not set
+BUILD_CONTEXT_CACHE_ENV = 'ATOMIC_REACTOR_BUILD_CONTEXT_CACHE'
+
+# file names which aren't valid UTF-8 survive encoding on Python 3
+FS_ENCODE_ERRORS = 'surrogateescape' if sys.version_info[0] >= 3 else 'strict'
+
+
+class DockerIgnore(object):
+    """
+    Patterns from .dockerignore, matched the same way docker does it: a path is
+    excluded when the last pattern matching it or any of its parent directories
+    is not an exception (starting with '!'); '*' and '?' don't match '/',
+    '**' matches any number of directories. Dockerfile and .dockerignore itself
+    are never excluded.
+    """
+
+    def __init__(self, patterns):
+        """
+        :param patterns: list of str, patterns as written in .dockerignore
+        """
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            exception = pattern.startswith('!')
+            if exception:
+                pattern = pattern[1:].strip()
+            pattern = os.path.normpath(pattern).lstrip('/')
+            if not pattern or pattern == '.':
+                continue
+            self.rules.append((self._compile(pattern), exception))
+        self.has_exceptions = any(exception for _, exception in self.rules)
+
+    @classmethod
+    def from_dir(cls, context_dir):
+        """
+        :param context_dir: str, build context directory
+        :return: DockerIgnore instance, without any patterns when there's no .dockerignore
+        """
+        try:
+            with open(os.path.join(context_dir, DOCKERIGNORE_FILENAME)) as f:
+                patterns = f.read().splitlines()
+        except IOError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            patterns = []
+        return cls(patterns)
+
+    @staticmethod
+    def _compile(pattern):
+        regex = ''
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if pattern.startswith('**', i):
+                i += 2
+                if pattern.startswith('/', i):
+                    # '**/' matches also no directory at all
+                    regex += '(?:.*/)?'
+                    i += 1
+                else:
+                    regex += '.*'
+                continue
+            elif char == '*':
+                regex += '[^/]*'
+            elif char == '?':
+                regex += '[^/]'
+            elif char == '[':
+                end = pattern.find(']', i + 1)
+                if end == -1:
+                    regex += re.escape(char)
+                else:
+                    body = pattern[i + 1:end].replace('\\', '\\\\')
+                    if body.startswith('!'):
+                        body = '^' + body[1:]
+                    regex += '[' + body + ']'
+                    i = end
+            elif char == '\\' and i + 1 < len(pattern):
+                i += 1
+                regex += re.escape(pattern[i])
+            else:
+                regex += re.escape(char)
+            i += 1
+        return re.compile(regex + r'\Z')
+
+    def excludes(self, path):
+        """
+        :param path: str, path relative to the build context directory
+        :return: bool, whether path is not part of build context
+        """
+        path = os.path.normpath(path)
+        if not self.rules:
+            return False
+        if path in (DOCKERFILE_FILENAME, DOCKERIGNORE_FILENAME):
+            return False
+
+        parents = []
+        parent = path
+        while parent:
+            parents.append(parent)
+            parent = os.path.dirname(parent)
+
+        excluded = False
+        for regex, exception in self.rules:
+            if any(regex.match(candidate) for candidate in parents):
+                excluded = not exception
+        return excluded
+
+    def excludes_dir(self, path):
+        """
+        :param path: str, path of directory relative to the build context directory
+        :return: bool, whether nothing inside the directory is part of build context
+        """
+        # an exception may bring back anything under an excluded directory
+        return not self.has_exceptions and self.excludes(path)
+
+
+def _reflink(src_fd, dst_fd):
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is None:
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            count = copy_file_range(src_fd, dst_fd, min(size - copied, 1024**3))
+            if count == 0:
+                break
+            copied += count
+    except OSError:
+        if copied:
+            raise
+        return False
+    return True
+
+
+def _copy_chunks(src_fd, dst_fd):
+    while True:
+        chunk = os.read(src_fd, CHUNK_SIZE)
+        if not chunk:
+            break
+        while chunk:
+            chunk = chunk[os.write(dst_fd, chunk):]
+
+
+def copy_file(src, dst, hardlink=False):
+    """
+    copy file with its permissions and modification time
+
+    :param src: str, path of the copied file
+    :param dst: str, path of the copy, replaced if it exists
+    :param hardlink: bool, hardlink the file when possible; the copy then shares
+                     data with the original, so writing to one changes both
+    :return: str, method used: 'hardlink', 'reflink', 'copy_file_range' or 'chunks'
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            if _reflink(src_fd, dst_fd):
+                method = 'reflink'
+            elif _copy_file_range(src_fd, dst_fd, os.fstat(src_fd).st_size):
+                method = 'copy_file_range'
+            else:
+                _copy_chunks(src_fd, dst_fd)
+                method = 'chunks'
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    shutil.copystat(src, dst)
+    return method
+
+
+def copy_tree(src, dst, hardlink=False, threads=None):
+    """
+    copy content of directory src into directory dst, symlinks are copied as
+    they are
+
+    :param src: str, directory to copy
+    :param dst: str, target directory, created if it doesn't exist
+    :param hardlink: bool, see copy_file()
+    :param threads: int, number of files copied at once, None for all cores
+    :return: list of str, paths of copied files relative to src
+    """
+    if threads is None:
+        try:
+            threads = min(cpu_count(), MAX_COPY_THREADS)
+        except NotImplementedError:
+            threads = 1
+
+    to_copy = []
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        if rel_root == os.curdir:
+            rel_root = ''
+        dst_root = os.path.join(dst, rel_root)
+        if not os.path.isdir(dst_root):
+            os.makedirs(dst_root)
+
+        kept_dirs = []
+        for name in sorted(dirs):
+            if os.path.islink(os.path.join(root, name)):
+                # os.walk doesn't descend into symlinks, copy them as they are
+                files.append(name)
+            else:
+                kept_dirs.append(name)
+        dirs[:] = kept_dirs
+
+        for name in sorted(files):
+            src_path = os.path.join(root, name)
+            if os.path.islink(src_path):
+                os.symlink(os.readlink(src_path), os.path.join(dst_root, name))
+                continue
+            to_copy.append(os.path.join(rel_root, name))
+
+    def copy(rel_path):
+        return copy_file(os.path.join(src, rel_path), os.path.join(dst, rel_path),
+                         hardlink=hardlink)
+
+    if len(to_copy) > 1 and threads > 1:
+        pool = ThreadPool(min(threads, len(to_copy)))
+        try:
+            methods = pool.map(copy, to_copy)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        methods = [copy(rel_path) for rel_path in to_copy]
+
+    if to_copy:
+        logger.debug("copied %d files from %s to %s using %s", len(to_copy), src, dst,
+                     ', '.join(sorted(set(methods))))
+    return to_copy
+
+
+class BuildContext(object):
+    """
+    Build context directory as an iterable of chunks of its tar; only a single
+    chunk is held in memory at a time
+
+    Usage:
+        context = BuildContext(df_dir, compression='gzip')
+        docker_client.build(fileobj=iter(context), custom_context=True,
+                            encoding=context.encoding, ...)
+    """
+
+    def __init__(self, path, compression=None, level=6, cache_dir=None,
+                 chunk_size=CHUNK_SIZE):
+        """
+        :param path: str, build context directory
+        :param compression: str, None or 'gzip'
+        :param level: int, gzip compression level
+        :param cache_dir: str, directory to keep tars of build contexts in; by
+                          default it's taken from $ATOMIC_REACTOR_BUILD_CONTEXT_CACHE,
+                          empty string disables it
+        :param chunk_size: int, size of chunks the tar is produced in
+        """
+        if compression not in (None, 'gzip'):
+            raise RuntimeError('Unsupported compression format {0}'.format(compression))
+        if cache_dir is None:
+            cache_dir = os.environ.get(BUILD_CONTEXT_CACHE_ENV)
+        self.path = os.path.abspath(path)
+        self.compression = compression
+        self.level = level
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+
+    @property
+    def encoding(self):
+        """
+        Content-Encoding of the stream, None when it's not compressed
+        """
+        return self.compression
+
+    def get_members(self):
+        """
+        :return: list of str, paths relative to the context directory which are
+                 put into the tar, in order
+        """
+        dockerignore = DockerIgnore.from_dir(self.path)
+        members = []
+        for root, dirs, files in os.walk(self.path):
+            rel_root = os.path.relpath(root, self.path)
+            if rel_root == os.curdir:
+                rel_root = ''
+            kept_dirs = []
+            for name in sorted(dirs):
+                rel_path = os.path.join(rel_root, name)
+                if os.path.islink(os.path.join(root, name)):
+                    files.append(name)
+                elif not dockerignore.excludes_dir(rel_path):
+                    kept_dirs.append(name)
+                    if not dockerignore.excludes(rel_path):
+                        members.append(rel_path)
+            dirs[:] = kept_dirs
+            members.extend(os.path.join(rel_root, name) for name in sorted(files)
+                           if not dockerignore.excludes(os.path.join(rel_root, name)))
+        return members
+
+    def get_fingerprint(self, members):
+        """
+        :param members: list of str, see get_members()
+        :return: str, hex digest identifying the content of the tar
+        """
+        fingerprint = hashlib.sha256()
+        fingerprint.update('{0}:{1}\n'.format(self.compression, self.level).encode('utf-8'))
+        for name in members:
+            st = os.lstat(os.path.join(self.path, name))
+            line = '{0}\0{1}:{2}:{3}:{4}:{5}:{6}\n'.format(
+                name, st.st_mode, st.st_size, st.st_mtime, st.st_ino, st.st_uid, st.st_gid)
+            fingerprint.update(line.encode('utf-8', FS_ENCODE_ERRORS))
+        return fingerprint.hexdigest()
+
+    def get_cache_path(self, fingerprint):
+        """
+        :param fingerprint: str, see get_fingerprint()
+        :return: str, path of the cached tar, None when there's no cache
+        """
+        if not self.cache_dir:
+            return None
+        dir_hash = hashlib.sha256(self.path.encode('utf-8', FS_ENCODE_ERRORS)).hexdigest()
+        extension = '.tar.gz' if self.compression else '.tar'
+        return os.path.join(self.cache_dir, '{0}-{1}{2}'.format(dir_hash, fingerprint,
+                                                                extension))
+
+    def _generate_tar(self, members):
+        tar = tarfile.open(fileobj=io.BytesIO(), mode='w')
+        size = 0
+        for name in members:
+            tarinfo = tar.gettarinfo(os.path.join(self.path, name), arcname=name)
+            header = tarinfo.tobuf(tarfile.GNU_FORMAT, 'utf-8', FS_ENCODE_ERRORS)
+            size += len(header)
+            yield header
+            if not tarinfo.isreg():
+                continue
+
+            remaining = tarinfo.size
+            with open(os.path.join(self.path, name), 'rb') as f:
+                while remaining:
+                    data = f.read(min(remaining, self.chunk_size))
+                    if not data:
+                        raise IOError('{0} got shorter while being read'.format(name))
+                    remaining -= len(data)
+                    yield data
+            padding = -tarinfo.size % tarfile.BLOCKSIZE
+            size += tarinfo.size + padding
+            yield b'\0' * padding
+
+        # end-of-archive marker, padded to full record like tarfile does it
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(size + end) % tarfile.RECORDSIZE
+        yield b'\0' * end
+
+    def _generate_chunks(self, members):
+        compressor = None
+        if self.compression == 'gzip':
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        buffered = []
+        buffered_size = 0
+        for data in self._generate_tar(members):
+            if compressor:
+                data = compressor.compress(data)
+            if not data:
+                continue
+            buffered.append(data)
+            buffered_size += len(data)
+            if buffered_size >= self.chunk_size:
+                yield b''.join(buffered)
+                buffered = []
+                buffered_size = 0
+
+        if compressor:
+            buffered.append(compressor.flush())
+        chunk = b''.join(buffered)
+        if chunk:
+            yield chunk
+
+    def _read_cached(self, cache_path):
+        with open(cache_path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _generate_and_cache(self, members, cache_path):
+        # write under a unique name first, so that a tar in cache is always complete
+        tmp_path = '{0}.{1}.tmp'.format(cache_path, uuid.uuid4().hex)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            cache_file = open(tmp_path, 'wb')
+        except (IOError, OSError) as ex:
+            logger.warning('failed to cache build context of %s: %s', self.path, ex)
+            cache_file = None
+
+        try:
+            for chunk in self._generate_chunks(members):
+                if cache_file:
+                    cache_file.write(chunk)
+                yield chunk
+            if cache_file:
+                cache_file.close()
+                self._remove_stale_cache(cache_path)
+                os.rename(tmp_path, cache_path)
+        finally:
+            if cache_file:
+                cache_file.close()
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _remove_stale_cache(self, cache_path):
+        # only the latest tar of each directory is kept
+        prefix = os.path.basename(cache_path).split('-', 1)[0] + '-'
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix) and not name.endswith('.tmp'):
+                try:
+                    os.unlink(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def __iter__(self):
+        members = self.get_members()
+        if self.cache_dir:
+            cache_path = self.get_cache_path(self.get_fingerprint(members))
+            if os.path.isfile(cache_path):
+                logger.debug('using cached build context %s', cache_path)
+                return self._read_cached(cache_path)
+            return self._generate_and_cache(members, cache_path)
+        return self._generate_chunks(members)
@@ -0,0 +1,366 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Compression of exported images.
+
+Data are compressed in a single pass: the size and checksums of both the
+uncompressed input and the compressed output are computed on the way, so
+none of the files has to be read again to describe it.
+
+With more than one thread, the input is split into blocks which are
+compressed independently on a thread pool (zlib, lzma and zstd release the
+GIL while compressing) and written out in order, each block as a separate
+gzip member, xz stream or zstd frame. Standard tools decompress such
+concatenations transparently, the same way they handle output of pigz.
+"""
+
+from __future__ import unicode_literals
+
+import bz2
+from collections import deque
+import gzip
+try:
+    # if we import "lzma" first, we get pyliblzma on Py2, but we want backports.lzma
+    #  so first try to import backports.lzma on Py2 and then 'lzma' on Py3
+    from backports import lzma
+except ImportError:
+    import lzma
+import logging
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import os
+import tarfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from atomic_reactor.constants import EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE
+from atomic_reactor.util import ChecksumWriter, get_checksum_cache
+
+
+logger = logging.getLogger(__name__)
+
+# compression method -> file extension
+COMPRESSION_EXTENSIONS = {
+    'gzip': 'gz',
+    'lzma': 'xz',
+    'zstd': 'zst',
+}
+
+# compression method -> level used when none is specified
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'lzma': 6,
+    'zstd': 3,
+}
+
+# compression method -> size of blocks compressed independently when using
+# more threads; bigger blocks compress better, lzma needs the biggest ones
+BLOCK_SIZES = {
+    'gzip': 1024**2,
+    'lzma': 8 * 1024**2,
+    'zstd': 4 * 1024**2,
+}
+
+CHUNK_SIZE = 1024**2  # 1 MB chunk size for reading/writing
+
+
+def get_compressed_image_path(workdir, method):
+    """
+    :param workdir: str, directory to place the compressed image in
+    :param method: str, compression method, see COMPRESSION_EXTENSIONS
+    :return: str, path of the compressed image
+    """
+    try:
+        extension = COMPRESSION_EXTENSIONS[method]
+    except KeyError:
+        raise RuntimeError('Unsupported compression format {0}'.format(method))
+
+    return os.path.join(workdir, EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE.format(extension))
+
+
+def get_compression_threads(threads=None):
+    """
+    :param threads: int, requested number of threads, None for all available cores
+    :return: int
+    """
+    if threads is None:
+        try:
+            threads = cpu_count()
+        except NotImplementedError:
+            threads = 1
+
+    return max(1, int(threads))
+
+
+def _check_method(method):
+    if method not in COMPRESSION_EXTENSIONS:
+        raise RuntimeError('Unsupported compression format {0}'.format(method))
+    if method == 'zstd' and zstandard is None:
+        raise RuntimeError('zstd compression requires the zstandard module')
+
+
+def open_compressor(fileobj, method, filename=None, level=None, threads=1, block_size=None):
+    """
+    :param fileobj: file-like object to write compressed data to
+    :param method: str, compression method, see COMPRESSION_EXTENSIONS
+    :param filename: str, name of the compressed file (stored in gzip header)
+    :param level: int, compression level, see DEFAULT_LEVELS
+    :param threads: int, number of threads to compress with, None for all cores
+    :param block_size: int, size of independently compressed blocks when using
+                       more threads, see BLOCK_SIZES
+    :return: writable file-like object, has to be closed to write all data
+    """
+    _check_method(method)
+    if level is None:
+        level = DEFAULT_LEVELS[method]
+
+    threads = get_compression_threads(threads)
+    if threads > 1:
+        return BlockCompressor(fileobj, method, level=level, threads=threads,
+                               block_size=block_size)
+    elif method == 'gzip':
+        return gzip.GzipFile(filename=filename, mode='wb', compresslevel=level, fileobj=fileobj)
+    elif method == 'lzma':
+        return lzma.LZMAFile(fileobj, 'wb', preset=level)
+    else:
+        return ZstdWriter(fileobj, level)
+
+
+class ZstdWriter(object):
+    """
+    Writable file-like object compressing data written to it into a single
+    zstd frame; unlike GzipFile and LZMAFile, it never closes fileobj
+    """
+
+    def __init__(self, fileobj, level):
+        self.fileobj = fileobj
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.compress(data))
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+
+
+def compress_block(data, method, level=None):
+    """
+    compress data into a self-contained gzip member, xz stream or zstd frame
+
+    :param data: bytes, data to compress
+    :param method: str, compression method, see COMPRESSION_EXTENSIONS
+    :param level: int, compression level, see DEFAULT_LEVELS
+    :return: bytes
+    """
+    _check_method(method)
+    if level is None:
+        level = DEFAULT_LEVELS[method]
+
+    if method == 'gzip':
+        # wbits > 16 makes zlib emit gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    elif method == 'lzma':
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+    else:
+        return zstandard.ZstdCompressor(level=level, write_content_size=True).compress(data)
+
+
+class BlockCompressor(object):
+    """
+    Writable file-like object splitting data written to it into blocks,
+    which are compressed on a thread pool and written to fileobj in order
+    """
+
+    def __init__(self, fileobj, method, level=None, threads=None, block_size=None):
+        """
+        :param fileobj: file-like object to write compressed data to
+        :param method: str, compression method, see COMPRESSION_EXTENSIONS
+        :param level: int, compression level, see DEFAULT_LEVELS
+        :param threads: int, number of threads to compress with, None for all cores
+        :param block_size: int, size of independently compressed blocks, see BLOCK_SIZES
+        """
+        _check_method(method)
+        self.fileobj = fileobj
+        self.method = method
+        self.level = level
+        self.block_size = block_size or BLOCK_SIZES[method]
+        threads = get_compression_threads(threads)
+        # keep a bounded number of blocks in flight so memory usage doesn't
+        # depend on the size of the input
+        self.max_pending = 2 * threads
+        self.pending = deque()
+        self.buffer = []
+        self.buffered = 0
+        self.pool = ThreadPool(threads)
+
+    def _submit(self, block):
+        self.pending.append(self.pool.apply_async(compress_block,
+                                                  (block, self.method, self.level)))
+        while len(self.pending) >= self.max_pending:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            data = b''.join(self.buffer)
+            offset = 0
+            while len(data) - offset >= self.block_size:
+                self._submit(data[offset:offset + self.block_size])
+                offset += self.block_size
+            self.buffer = [data[offset:]]
+            self.buffered = len(data) - offset
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        if self.pool is None:
+            return
+
+        try:
+            if self.buffered:
+                self._submit(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().get())
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def compress_stream(stream, outfile, method, chunk_size=CHUNK_SIZE, threads=1,
+                    level=None, block_size=None):
+    """
+    compress data read from stream into outfile
+
+    :param stream: file-like object to read uncompressed data from
+    :param outfile: str, path of the compressed file
+    :param method: str, compression method, see COMPRESSION_EXTENSIONS
+    :param chunk_size: int, how much data to read at once
+    :param threads: int, number of threads to compress with, None for all cores
+    :param level: int, compression level, see DEFAULT_LEVELS
+    :param block_size: int, size of independently compressed blocks when using
+                       more threads, see BLOCK_SIZES
+    :return: dict, metadata of outfile in the format of exported_image_sequence,
+             including 'uncompressed_size'
+    """
+    _check_method(method)
+    threads = get_compression_threads(threads)
+    logger.info('compressing to %s using %s method, %d thread(s)', outfile, method, threads)
+
+    uncompressed_size = 0
+    with open(outfile, 'wb') as raw_fp:
+        writer = ChecksumWriter(raw_fp)
+        fp = open_compressor(writer, method, filename=outfile, level=level,
+                             threads=threads, block_size=block_size)
+        try:
+            data = stream.read(chunk_size)
+            while data:
+                uncompressed_size += len(data)
+                fp.write(data)
+                data = stream.read(chunk_size)
+        finally:
+            fp.close()
+
+    metadata = {
+        'path': outfile,
+        'size': writer.tell(),
+        'uncompressed_size': uncompressed_size,
+    }
+    metadata.update(writer.checksums)
+    get_checksum_cache().update(outfile, writer.checksums)
+    logger.debug('compressed %d bytes to %d bytes', uncompressed_size, metadata['size'])
+    return metadata
+
+
+def open_decompressor(path):
+    """
+    open possibly compressed file for reading, compression is guessed from
+    file extension
+
+    :param path: str, path to .tar, .tar.gz, .tar.xz, .tar.bz2 or .tar.zst file
+    :return: readable file-like object with uncompressed data
+    """
+    _, extension = os.path.splitext(path)
+    if extension == '.tar':
+        return open(path, 'rb')
+    elif extension == '.gz':
+        return gzip.open(path, 'rb')
+    elif extension == '.xz':
+        return lzma.open(path, 'rb')
+    elif extension == '.bz2':
+        return bz2.BZ2File(path, 'rb')
+    elif extension == '.zst' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                          read_across_frames=True)
+
+    raise RuntimeError('Unknown tarball format: {0}'.format(path))
+
+
+def filter_tar(source, outfile, exclude, method='gzip', threads=1, level=None):
+    """
+    copy tar archive leaving out some of its members, reading the source and
+    writing the compressed output in a single pass
+
+    :param source: str, path to the tar archive, possibly compressed (see open_decompressor)
+    :param outfile: str, path of the compressed output archive
+    :param exclude: iterable of str, names of members to leave out
+    :param method: str, compression method, see COMPRESSION_EXTENSIONS
+    :param threads: int, number of threads to compress with, None for all cores
+    :param level: int, compression level, see DEFAULT_LEVELS
+    :return: dict, metadata of outfile in the format of exported_image_sequence,
+             plus list of 'removed' member names
+    """
+    exclude = set(os.path.normpath(name) for name in exclude)
+    removed = []
+    logger.info('copying %s to %s without %d member(s)', source, outfile, len(exclude))
+    with open_decompressor(source) as source_fp, open(outfile, 'wb') as raw_fp:
+        writer = ChecksumWriter(raw_fp)
+        fp = open_compressor(writer, method, filename=outfile, level=level,
+                             threads=threads)
+        try:
+            # stream modes: members are processed one by one, in order
+            source_tar = tarfile.open(fileobj=source_fp, mode='r|')
+            output_tar = tarfile.open(fileobj=fp, mode='w|', format=tarfile.PAX_FORMAT)
+            for member in source_tar:
+                if os.path.normpath(member.name) in exclude:
+                    logger.debug('leaving out %s', member.name)
+                    removed.append(member.name)
+                    continue
+
+                if member.isfile():
+                    output_tar.addfile(member, source_tar.extractfile(member))
+                else:
+                    output_tar.addfile(member)
+            output_tar.close()
+            source_tar.close()
+        finally:
+            fp.close()
+
+    metadata = {
+        'path': outfile,
+        'size': writer.tell(),
+        'removed': removed,
+    }
+    metadata.update(writer.checksums)
+    get_checksum_cache().update(outfile, writer.checksums)
+    return metadata
@@ -22,10 +22,12 @@ I've tried to be as much consistent (man pages were source) with docker as possi
 
 
 """
+import copy
 import os
 import shutil
 import logging
 import tempfile
+import threading
 import json
 import requests
 
@@ -33,15 +35,44 @@ import docker
 from docker.errors import APIError
 from docker.utils import create_host_config
 
+from atomic_reactor.build_context import BuildContext
 from atomic_reactor.constants import CONTAINER_SHARE_PATH, CONTAINER_SHARE_SOURCE_SUBDIR,\
         BUILD_JSON, DOCKER_SOCKET_PATH
 from atomic_reactor.source import get_source_instance_for
 from atomic_reactor.util import (
-    ImageName, wait_for_command, clone_git_repo, figure_out_dockerfile, Dockercfg)
+    ImageName, wait_for_command, clone_git_repo, figure_out_dockerfile, Dockercfg,
+    StreamChecksums, get_checksum_cache)
 
 
 logger = logging.getLogger(__name__)
 
+# when set (to anything but empty string), all DockerTasker instances of the process
+# connecting to the same docker daemon share one client and its keep-alive connections
+SHARED_DOCKER_CLIENT_ENV = 'ATOMIC_REACTOR_SHARED_DOCKER_CLIENT'
+
+# fields of `docker info` describing the host and daemon, as opposed to counters
+# of containers and images, clock, etc.; see DockerTasker.get_static_info
+DOCKER_INFO_STATIC_FIELDS = ('Architecture', 'DockerRootDir', 'Driver', 'ID',
+                             'IndexServerAddress', 'KernelVersion', 'MemTotal', 'NCPU',
+                             'Name', 'OSType', 'OperatingSystem', 'ServerVersion')
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_docker_client(**client_kwargs):
+    """
+    get docker client shared by the whole process, one per set of arguments
+
+    :param client_kwargs: arguments of docker.Client
+    :return: docker.Client instance
+    """
+    key = tuple(sorted(client_kwargs.items()))
+    with _shared_clients_lock:
+        if key not in _shared_clients:
+            _shared_clients[key] = docker.Client(**client_kwargs)
+        return _shared_clients[key]
+
 
 class LastLogger(object):
     """
@@ -215,16 +246,21 @@ class BuildContainerFactory(object):
 
 
 class DockerTasker(LastLogger):
-    def __init__(self, base_url=None, timeout=120, **kwargs):
+    def __init__(self, base_url=None, timeout=120, cache=True, shared_client=None, **kwargs):
         """
         Constructor
 
         :param base_url: str, docker connection URL
         :param timeout: int, timeout for docker client
+        :param cache: bool, remember results of inspect_image, get_static_info and
+                      get_version; entries of images are dropped when this instance
+                      tags, pulls, commits or removes them
+        :param shared_client: bool, use docker client shared by all instances in the
+                              process; None to take it from ATOMIC_REACTOR_SHARED_DOCKER_CLIENT
         """
         super(DockerTasker, self).__init__(**kwargs)
 
-        client_kwargs = {}
+        client_kwargs = {'timeout': timeout}
         if base_url:
             client_kwargs['base_url'] = base_url
         elif os.environ.get('DOCKER_CONNECTION'):
@@ -233,30 +269,97 @@ class DockerTasker(LastLogger):
         if hasattr(docker, 'AutoVersionClient'):
             client_kwargs['version'] = 'auto'
 
-        self.d = docker.Client(timeout=timeout, **client_kwargs)
+        if shared_client is None:
+            shared_client = bool(os.environ.get(SHARED_DOCKER_CLIENT_ENV))
+
+        if shared_client:
+            self.d = get_shared_docker_client(**client_kwargs)
+        else:
+            self.d = docker.Client(**client_kwargs)
+
+        self.cache = cache
+        self._cache_lock = threading.Lock()
+        self._inspect_cache = {}
+        self._info = None
+        self._version = None
+
+    def _get_cached(self, key, compute):
+        if not self.cache:
+            return compute()
+
+        with self._cache_lock:
+            value = self._inspect_cache.get(key)
+        if value is None:
+            value = compute()
+            if value is None:
+                return value
+            with self._cache_lock:
+                self._inspect_cache[key] = value
+        else:
+            logger.debug("using cached inspection of '%s'", key)
+        return copy.deepcopy(value)
+
+    def invalidate_images(self, *images):
+        """
+        forget cached inspections of provided images, under any of their names
+
+        :param images: str or ImageName, ids or names of images
+        """
+        names = set()
+        for image in images:
+            if not isinstance(image, ImageName):
+                image = ImageName.parse(image)
+            names.add(image.to_str())
+            names.add(image.to_str(explicit_tag=True))
+
+        with self._cache_lock:
+            matching = [key for key, value in self._inspect_cache.items()
+                        if key in names or value.get('Id') in names or
+                        names.intersection(value.get('RepoTags') or [])]
+            ids = set(self._inspect_cache[key].get('Id') for key in matching)
+            for key, value in list(self._inspect_cache.items()):
+                if key in matching or value.get('Id') in ids:
+                    logger.debug("forgetting cached inspection of '%s'", key)
+                    del self._inspect_cache[key]
 
-    def build_image_from_path(self, path, image, stream=False, use_cache=False, remove_im=True):
+    def build_image_from_path(self, path, image, stream=False, use_cache=False, remove_im=True,
+                              compression=None):
         """
         build image from provided path and tag it
 
         this operation is asynchronous and you should consume returned generator in order to wait
         for build to finish
 
+        the build context is streamed to docker daemon in chunks, excluding files
+        matched by .dockerignore, see atomic_reactor.build_context.BuildContext
+
         :param path: str
         :param image: ImageName, name of the resulting image
         :param stream: bool, True returns generator, False returns str
         :param use_cache: bool, True if you want to use cache
         :param remove_im: bool, remove intermediate containers produced during docker build
+        :param compression: str, None or 'gzip', compression of the uploaded build context
         :return: generator
         """
         logger.info("building image '%s' from path '%s'", image, path)
+        context = BuildContext(path, compression=compression)
+        build_kwargs = {
+            'fileobj': iter(context),
+            'custom_context': True,
+            'encoding': context.encoding,
+            'tag': image.to_str(),
+            'stream': stream,
+            'nocache': not use_cache,
+            'rm': remove_im,
+            'forcerm': True,
+        }
         try:
-            response = self.d.build(path=path, tag=image.to_str(), stream=stream, nocache=not use_cache,
-                                    rm=remove_im, forcerm=True, pull=False)  # returns generator
+            response = self.d.build(pull=False, **build_kwargs)  # returns generator
         except TypeError:
             # because changing api is fun
-            response = self.d.build(path=path, tag=image.to_str(), stream=stream, nocache=not use_cache,
-                                    rm=remove_im, forcerm=True,)  # returns generator
+            response = self.d.build(**build_kwargs)  # returns generator
+        # the name will belong to the new image
+        self.invalidate_images(image)
         return response
 
     def build_image_from_git(self, url, image, git_path=None, git_commit=None, copy_dockerfile_to=None,
@@ -335,11 +438,14 @@ class DockerTasker(LastLogger):
         logger.debug("container_id = '%s', image = '%s', message = '%s'",
                      container_id, image, message)
         tag = None
+        repository = None
         if image:
             tag = image.tag
-            image = image.to_str(tag=False)
-        response = self.d.commit(container_id, repository=image, tag=tag, message=message)
+            repository = image.to_str(tag=False)
+        response = self.d.commit(container_id, repository=repository, tag=tag, message=message)
         logger.debug("response = '%s'", response)
+        if image:
+            self.invalidate_images(image)
         try:
             return response['Id']
         except KeyError:
@@ -348,28 +454,36 @@ class DockerTasker(LastLogger):
 
     def get_image_info_by_image_id(self, image_id):
         """
-        using `docker images`, provide information about an image
+        using `docker inspect`, provide information about an image in the format
+        of `docker images`
 
         :param image_id: str, hash of image to get info
-        :return: str or None
+        :return: dict or None
         """
         logger.info("getting info about provided image specified by image_id '%s'", image_id)
         logger.debug("image_id = '%s'", image_id)
-        # returns list of
-        # {u'Created': 1414577076,
+        try:
+            inspect = self.inspect_image(image_id)
+        except docker.errors.NotFound:
+            inspect = None
+        if not inspect or inspect.get('Id') != image_id:
+            logger.info("image not found")
+            return None
+
+        # {u'Created': u'2014-10-29T10:04:36.123456789Z',
         #  u'Id': u'3ab9a7ed8a169ab89b09fb3e12a14a390d3c662703b65b4541c0c7bde0ee97eb',
         #  u'ParentId': u'a79ad4dac406fcf85b9c7315fe08de5b620c1f7a12f45c8185c843f4b4a49c4e',
         #  u'RepoTags': [u'buildroot-fedora:latest'],
         #  u'Size': 0,
         #  u'VirtualSize': 856564160}
-        images = self.d.images()
-        try:
-            image_dict = [i for i in images if i['Id'] == image_id][0]
-        except IndexError:
-            logger.info("image not found")
-            return None
-        else:
-            return image_dict
+        return {
+            'Created': inspect.get('Created'),
+            'Id': inspect['Id'],
+            'ParentId': inspect.get('Parent'),
+            'RepoTags': inspect.get('RepoTags'),
+            'Size': inspect.get('Size'),
+            'VirtualSize': inspect.get('VirtualSize'),
+        }
 
     def get_image_info_by_image_name(self, image, exact_tag=True):
         """
@@ -419,6 +533,7 @@ class DockerTasker(LastLogger):
             logs_gen = self.d.pull(image.to_str(tag=False), tag=image.tag, stream=True)
         command_result = wait_for_command(logs_gen)
         self.last_logs = command_result.logs
+        self.invalidate_images(image)
         return image.to_str()
 
     def tag_image(self, image, target_image, force=False):
@@ -441,6 +556,8 @@ class DockerTasker(LastLogger):
                 target_image.to_str(tag=False),
                 tag=target_image.tag,
                 force=force)  # returns True/False
+            # tags of both images change, the one which had the name and the tagged one
+            self.invalidate_images(image, target_image)
             if not response:
                 logger.error("failed to tag image")
                 raise RuntimeError("Failed to tag image '%s': target_image = '%s'" %
@@ -527,9 +644,65 @@ class DockerTasker(LastLogger):
         logger.debug("image_id = '%s'", image_id)
         if isinstance(image_id, ImageName):
             image_id = image_id.to_str()
-        image_metadata = self.d.inspect_image(image_id)
+        image_metadata = self._get_cached(image_id, lambda: self.d.inspect_image(image_id))
         return image_metadata
 
+    def get_image(self, image):
+        """
+        get stream with 'docker save' output of provided image; the stream
+        should be used as a context manager and read in chunks, the image
+        may be too big to fit in memory
+
+        :param image: str or ImageName, id or name of the image
+        :return: file-like object
+        """
+        logger.info("exporting image '%s'", image)
+        if isinstance(image, ImageName):
+            image = image.to_str()
+        return self.d.get_image(image)
+
+    def save_image_to(self, image, path_or_fileobj, chunk_size=1024**2,
+                      algorithms=('md5', 'sha256')):
+        """
+        save provided image as 'docker save' tarball, streaming it in chunks
+        so memory usage doesn't depend on the size of the image
+
+        :param image: str or ImageName, id or name of the image
+        :param path_or_fileobj: str, path of the file to write,
+                                or writable file-like object
+        :param chunk_size: int, how much data to read at once
+        :param algorithms: list of str, checksums to compute while streaming
+        :return: dict, 'size' of the tarball and its checksums (e.g. 'md5sum'),
+                 and 'path' if path_or_fileobj is a path
+        """
+        metadata = {}
+        if hasattr(path_or_fileobj, 'write'):
+            fileobj = path_or_fileobj
+        else:
+            metadata['path'] = path_or_fileobj
+            fileobj = open(path_or_fileobj, 'wb')
+
+        stream_checksums = StreamChecksums(algorithms)
+        try:
+            with self.get_image(image) as image_stream:
+                data = image_stream.read(chunk_size)
+                while data:
+                    stream_checksums.update(data)
+                    fileobj.write(data)
+                    data = image_stream.read(chunk_size)
+            fileobj.flush()
+        finally:
+            if 'path' in metadata:
+                fileobj.close()
+
+        if 'path' in metadata:
+            get_checksum_cache().update(metadata['path'], stream_checksums.checksums)
+
+        metadata['size'] = stream_checksums.size
+        metadata.update(stream_checksums.checksums)
+        logger.debug("image '%s' saved: %s", image, metadata)
+        return metadata
+
     def remove_image(self, image_id, force=False, noprune=False):
         """
         remove provided image from filesystem
@@ -544,6 +717,7 @@ class DockerTasker(LastLogger):
         if isinstance(image_id, ImageName):
             image_id = image_id.to_str()
         self.d.remove_image(image_id, force=force, noprune=noprune)  # returns None
+        self.invalidate_images(image_id)
 
     def remove_container(self, container_id, force=False):
         """
@@ -615,13 +789,27 @@ class DockerTasker(LastLogger):
         """
         return self.d.info()
 
+    def get_static_info(self):
+        """
+        get info about used docker environment which doesn't change while the
+        daemon runs, see DOCKER_INFO_STATIC_FIELDS
+
+        :return: dict, subset of json output of `docker info`
+        """
+        if self._info is None or not self.cache:
+            self._info = dict((key, value) for key, value in self.d.info().items()
+                              if key in DOCKER_INFO_STATIC_FIELDS)
+        return copy.deepcopy(self._info)
+
     def get_version(self):
         """
         get version of used docker environment
 
         :return: dict, json output of `docker version`
         """
-        return self.d.version()
+        if self._version is None or not self.cache:
+            self._version = self.d.version()
+        return copy.deepcopy(self._version)
 
     def get_volumes_for_container(self, container_id, skip_empty_source=True):
         """
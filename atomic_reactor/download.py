@@ -0,0 +1,306 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Downloading files with known checksums.
+
+Files are streamed to disk in big chunks over pooled connections and their
+checksums are verified on the way. Interrupted transfers are resumed using
+HTTP Range requests. Verified files may be kept in a content-addressed cache
+directory; files found there are copied (reflinked where the filesystem
+allows it) and verified instead of downloaded again. The least recently used
+files are evicted from the cache once it outgrows its size limit.
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import hashlib
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from atomic_reactor.build_context import copy_file
+from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+# directory to keep downloaded files in, there's no cache when not set
+DOWNLOAD_CACHE_ENV = 'ATOMIC_REACTOR_DOWNLOAD_CACHE'
+
+# subdirectory of the cache directory keeping downloaded files, other users of
+# the directory (e.g. koji_util.stream_task_output) have their own
+DOWNLOAD_CACHE_SUBDIR = 'downloads'
+
+# checksum algorithms used as cache keys, most preferred first
+CACHE_KEY_ALGORITHMS = ('sha256', 'sha1', 'md5')
+
+DEFAULT_DOWNLOAD_CACHE_SIZE = 20 * 1024**3  # 20 GiB
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+
+def evict_cache(cache_dir, max_size, keep=()):
+    """
+    remove the least recently used files from cache directory until total
+    size of the files left doesn't exceed max_size
+
+    :param cache_dir: str, cache directory
+    :param max_size: int, disk budget in bytes
+    :param keep: iterable of str, paths of files which must not be removed
+    :return: list of str, paths of removed files
+    """
+    entries = []
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for name in filenames:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by someone else meanwhile
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        if path in keep:
+            continue
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total_size -= size
+        removed.append(path)
+
+    if removed:
+        logger.debug('%d files evicted from cache %s', len(removed), cache_dir)
+    return removed
+
+
+class Downloader(object):
+    """
+    Download files, possibly many at once, verifying their checksums
+    """
+
+    def __init__(self, cache_dir=None, max_parallel=1, chunk_size=DEFAULT_DOWNLOAD_BLOCK_SIZE,
+                 retries=3, retry_delay=1, timeout=None,
+                 max_cache_size=DEFAULT_DOWNLOAD_CACHE_SIZE):
+        """
+        :param cache_dir: str, directory of the content-addressed cache; by default
+                          it's taken from $ATOMIC_REACTOR_DOWNLOAD_CACHE, empty
+                          string disables it
+        :param max_parallel: int, how many files to download at once
+        :param chunk_size: int, how much data to read at once
+        :param retries: int, how many times to resume an interrupted download
+        :param retry_delay: int, seconds to wait before the first retry, the
+                            delay grows with each retry
+        :param timeout: float, timeout of connecting and reading, in seconds
+        :param max_cache_size: int, disk budget of downloaded files in the cache in
+                               bytes, the least recently used ones are evicted when
+                               it's exceeded
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get(DOWNLOAD_CACHE_ENV)
+        self.cache_dir = cache_dir
+        self.max_parallel = max(1, max_parallel)
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.max_cache_size = max_cache_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_parallel,
+                              pool_maxsize=self.max_parallel)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_cache_path(self, checksums):
+        """
+        :param checksums: dict, algorithm name -> expected lowercase hex digest
+        :return: str, path of the file in cache, None when it can't be cached
+        """
+        if not self.cache_dir:
+            return None
+
+        for algo in CACHE_KEY_ALGORITHMS:
+            if algo in checksums:
+                digest = checksums[algo]
+                return os.path.join(self.cache_dir, DOWNLOAD_CACHE_SUBDIR, algo, digest[:2],
+                                    digest)
+
+        return None
+
+    def _verify(self, path, checksums):
+        hashes = dict((algo, hashlib.new(algo)) for algo in checksums)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                for checksum in hashes.values():
+                    checksum.update(chunk)
+
+        return all(checksum.hexdigest() == checksums[algo]
+                   for algo, checksum in hashes.items())
+
+    def _copy_from_cache(self, cache_path, dest, checksums):
+        if not cache_path or not os.path.isfile(cache_path):
+            return False
+
+        copy_file(cache_path, dest)
+        # the copy is verified, a corrupted cache entry must not get into the build
+        if not self._verify(dest, checksums):
+            logger.warning('%s does not match its checksums, removing it from cache',
+                           cache_path)
+            os.unlink(dest)
+            try:
+                os.unlink(cache_path)
+            except OSError:
+                pass
+            return False
+
+        # modification time of a cache entry is its last use
+        os.utime(cache_path, None)
+        return True
+
+    def _store_in_cache(self, dest, cache_path):
+        # copy under a unique name first, so that a file in cache is always complete;
+        # the cache entry doesn't share data with dest, which may be modified later
+        tmp_path = '{0}.{1}.tmp'.format(cache_path, uuid.uuid4().hex)
+        try:
+            _makedirs(os.path.dirname(cache_path))
+            copy_file(dest, tmp_path)
+            os.utime(tmp_path, None)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError) as ex:
+            logger.warning('failed to store %s in cache: %s', dest, ex)
+            if os.path.lexists(tmp_path):
+                os.unlink(tmp_path)
+            return
+
+        evict_cache(os.path.join(self.cache_dir, DOWNLOAD_CACHE_SUBDIR), self.max_cache_size,
+                    keep=(cache_path, ))
+
+    def _fetch(self, url, dest, checksums):
+        hashes = dict((algo, hashlib.new(algo)) for algo in checksums)
+        size = 0
+        attempt = 0
+        with open(dest, 'wb') as f:
+            while True:
+                headers = {}
+                if size:
+                    headers['Range'] = 'bytes={0}-'.format(size)
+                try:
+                    response = self.session.get(url, stream=True, headers=headers,
+                                                timeout=self.timeout)
+                    try:
+                        response.raise_for_status()
+                        if size and response.status_code != requests.codes.partial_content:
+                            logger.debug('%s cannot be resumed, downloading it again', url)
+                            f.seek(0)
+                            f.truncate()
+                            hashes = dict((algo, hashlib.new(algo)) for algo in checksums)
+                            size = 0
+
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            f.write(chunk)
+                            size += len(chunk)
+                            for checksum in hashes.values():
+                                checksum.update(chunk)
+                    finally:
+                        response.close()
+                    break
+                except requests.exceptions.HTTPError as ex:
+                    # client errors won't go away by retrying
+                    if ex.response is None or ex.response.status_code < 500:
+                        raise
+                    error = ex
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout) as ex:
+                    error = ex
+
+                attempt += 1
+                if attempt > self.retries:
+                    raise error
+                logger.warning('downloading %s interrupted after %d bytes (%s), retrying',
+                               url, size, error)
+                time.sleep(self.retry_delay * attempt)
+
+        for algo, checksum in hashes.items():
+            if checksum.hexdigest() != checksums[algo]:
+                raise ValueError(
+                    'Computed {} checksum, {}, does not match expected checksum, {}'
+                    .format(algo, checksum.hexdigest(), checksums[algo]))
+
+        return size
+
+    def download(self, url, dest, checksums):
+        """
+        download url to dest, or copy it from cache
+
+        :param url: str, URL to download
+        :param dest: str, path to store the file at, its directory has to exist
+        :param checksums: dict, algorithm name -> expected hex digest
+        :return: dict, 'size' of the file, whether it was 'cached' and 'duration'
+        """
+        start_time = time.time()
+        checksums = dict((algo, digest.lower()) for algo, digest in checksums.items())
+        cache_path = self.get_cache_path(checksums)
+        if self._copy_from_cache(cache_path, dest, checksums):
+            logger.debug('%s found in cache', url)
+            return {
+                'size': os.path.getsize(dest),
+                'cached': True,
+                'duration': time.time() - start_time,
+            }
+
+        logger.debug('downloading %s', url)
+        size = self._fetch(url, dest, checksums)
+        if cache_path:
+            self._store_in_cache(dest, cache_path)
+
+        return {
+            'size': size,
+            'cached': False,
+            'duration': time.time() - start_time,
+        }
+
+    def download_all(self, downloads):
+        """
+        download files, up to max_parallel of them at once
+
+        :param downloads: list of (url, dest, checksums) tuples, see download()
+        :return: list of dicts, see download()
+        """
+        for _, dest, _ in downloads:
+            _makedirs(os.path.dirname(dest))
+
+        if self.max_parallel == 1 or len(downloads) <= 1:
+            return [self.download(*download) for download in downloads]
+
+        pool = ThreadPool(min(self.max_parallel, len(downloads)))
+        try:
+            return pool.map(lambda download: self.download(*download), downloads)
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,210 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Retention of pulled base images on the docker host.
+
+Instead of removing base images after each build, they are recorded in a
+state file shared by all builds running against the same docker daemon.
+The least recently used images are removed only once the images kept
+exceed the disk budget, so that subsequent builds can reuse them without
+pulling them again.
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+from contextlib import contextmanager
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# directory to keep state of retained images in, images aren't retained when not set
+IMAGE_CACHE_ENV = 'ATOMIC_REACTOR_IMAGE_CACHE'
+
+DEFAULT_IMAGE_CACHE_SIZE = 20 * 1024**3  # 20 GiB
+# retained images are used without asking the registry only this long after they were pulled
+DEFAULT_IMAGE_CACHE_TTL = 0
+
+IMAGE_CACHE_FILE = 'base-images.json'
+IMAGE_CACHE_LOCK = 'base-images.lock'
+
+
+class ImageCache(object):
+    """
+    Record of base images kept on the docker host, with their size and the
+    time of their last use; images are identified by name and grouped by ID,
+    so that an image tagged under several names is accounted for once
+    """
+
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: str, directory holding the state file, it's shared
+                          between builds using the same docker daemon
+        """
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, IMAGE_CACHE_FILE)
+        self.lock_path = os.path.join(cache_dir, IMAGE_CACHE_LOCK)
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """
+        hold the lock of the state file; other builds may be modifying it as well
+        """
+        with self._thread_lock:
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError) as ex:
+            if getattr(ex, 'errno', None) != errno.ENOENT:
+                logger.warning("can't load image cache from %s: %r", self.path, ex)
+            return {}
+
+    def _save(self, entries):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.base-images-')
+        try:
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def get(self, name):
+        """
+        :param name: str, name of the image
+        :return: dict with 'id', 'size' and 'last_used' of the image, None if not retained
+        """
+        with self._locked():
+            return self._load().get(name)
+
+    def record(self, name, image_id, size):
+        """
+        record that image was pulled and is kept on the host; when the name
+        referred to a different image, that one stays accounted for under its
+        ID until it's removed
+
+        :param name: str, name of the image
+        :param image_id: str, ID of the image
+        :param size: int, size of the image in bytes
+        :return: str, ID of the image the name referred to before, None if
+                 there's none or it's still retained under another name
+        """
+        now = time.time()
+        with self._locked():
+            entries = self._load()
+            previous = entries.get(name)
+            entries[name] = {'id': image_id, 'size': size, 'last_used': now, 'pulled': now}
+            replaced = None
+            if previous and previous['id'] != image_id:
+                if not any(entry['id'] == previous['id'] for entry in entries.values()):
+                    replaced = previous['id']
+                    entries[replaced] = previous
+            self._save(entries)
+            return replaced
+
+    def touch(self, name):
+        """
+        note that a retained image was used just now
+
+        :param name: str, name of the image
+        :return: bool, whether the image is retained
+        """
+        with self._locked():
+            entries = self._load()
+            if name not in entries:
+                return False
+            entries[name]['last_used'] = time.time()
+            self._save(entries)
+            return True
+
+    def forget(self, names):
+        """
+        :param names: iterable of str, names of images which are not kept anymore
+        """
+        with self._locked():
+            entries = self._load()
+            for name in names:
+                entries.pop(name, None)
+            self._save(entries)
+
+    def get_evictions(self, max_size, keep=()):
+        """
+        choose the least recently used images to remove so that the size of
+        the images kept doesn't exceed max_size
+
+        :param max_size: int, disk budget in bytes
+        :param keep: iterable of str, names of images which must not be evicted
+        :return: list of str, names of the images to remove
+        """
+        with self._locked():
+            entries = self._load()
+
+        images = {}
+        for name, entry in entries.items():
+            image = images.setdefault(entry['id'], {'names': [], 'size': 0, 'last_used': 0})
+            image['names'].append(name)
+            image['size'] = max(image['size'], entry['size'])
+            image['last_used'] = max(image['last_used'], entry['last_used'])
+
+        keep = set(keep)
+        total_size = sum(image['size'] for image in images.values())
+        evictions = []
+        for image in sorted(images.values(), key=lambda image: image['last_used']):
+            if total_size <= max_size:
+                break
+            if keep.intersection(image['names']):
+                continue
+            evictions.extend(sorted(image['names']))
+            total_size -= image['size']
+
+        return evictions
+
+
+_image_caches = {}
+_image_caches_lock = threading.Lock()
+
+
+def get_image_cache(cache_dir=None):
+    """
+    get process-wide record of retained base images
+
+    :param cache_dir: str, directory with the state of retained images; by
+                      default it's taken from $ATOMIC_REACTOR_IMAGE_CACHE
+    :return: ImageCache instance, None when images aren't retained
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(IMAGE_CACHE_ENV)
+    if not cache_dir:
+        return None
+
+    with _image_caches_lock:
+        if cache_dir not in _image_caches:
+            _image_caches[cache_dir] = ImageCache(cache_dir)
+        return _image_caches[cache_dir]
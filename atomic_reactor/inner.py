@@ -13,6 +13,7 @@ import json
 import logging
 import tempfile
 import signal
+import threading
 import docker
 
 from atomic_reactor.build import InsideBuilder
@@ -28,7 +29,7 @@ from atomic_reactor.plugin import (
     PrePublishPluginsRunner,
 )
 from atomic_reactor.source import get_source_instance_for
-from atomic_reactor.util import ImageName
+from atomic_reactor.util import ImageName, CachedDockerfileParser, get_parent_env
 from atomic_reactor.build import BuildResult
 
 
@@ -250,7 +251,7 @@ class DockerBuildWorkflow(object):
     def __init__(self, source, image, prebuild_plugins=None, prepublish_plugins=None,
                  postbuild_plugins=None, exit_plugins=None, plugin_files=None,
                  openshift_build_selflink=None, client_version=None,
-                 buildstep_plugins=None, **kwargs):
+                 buildstep_plugins=None, max_parallel_plugins=None, **kwargs):
         """
         :param source: dict, where/how to get source code to put in image
         :param image: str, tag for built image ([registry/]image_name[:tag])
@@ -262,6 +263,8 @@ class DockerBuildWorkflow(object):
             on openshift) without the actual hostname/IP address
         :param client_version: str, osbs-client version used to render build json
         :param buildstep_plugins: dict, arguments for build-step plugins
+        :param max_parallel_plugins: int, how many non-conflicting plugins of one
+            phase may run at the same time; default 1, i.e. one by one
         """
         self.source = get_source_instance_for(source, tmpdir=tempfile.mkdtemp())
         self.image = image
@@ -285,6 +288,7 @@ class DockerBuildWorkflow(object):
         self.build_canceled = False
         self.plugin_failed = False
         self.plugin_files = plugin_files
+        self.max_parallel_plugins = max_parallel_plugins
 
         self.kwargs = kwargs
 
@@ -292,6 +296,12 @@ class DockerBuildWorkflow(object):
         self.built_image_inspect = None
         self._base_image_inspect = None
 
+        # Dockerfile parser shared by all plugins, see get_df_parser()
+        self._df_parser = None
+        self._df_parser_path = None
+        self._df_parser_base_image_inspect = None
+        self._df_parser_lock = threading.Lock()
+
         self.pulled_base_images = set()
 
         # When an image is exported into tarball, it can then be processed by various plugins.
@@ -337,6 +347,36 @@ class DockerBuildWorkflow(object):
                 raise KeyError("Unprocessed base image Dockerfile cannot be inspected")
         return self._base_image_inspect
 
+    def get_df_parser(self, df_path):
+        """
+        Dockerfile parser shared by all plugins of this workflow
+
+        Dockerfile is read and parsed again only when it changes; parent ENV
+        is taken from base image inspection, and updated when the base image
+        is inspected again.
+
+        :param df_path: string, path to Dockerfile or to directory with Dockerfile
+        :return: CachedDockerfileParser instance
+        """
+        try:
+            base_image_inspect = self.base_image_inspect
+        except (AttributeError, TypeError, KeyError):
+            logger.debug("base image unable to be inspected")
+            base_image_inspect = None
+
+        with self._df_parser_lock:
+            parser = self._df_parser
+            if parser is None or self._df_parser_path != df_path:
+                parser = CachedDockerfileParser(df_path)
+                self._df_parser = parser
+                self._df_parser_path = df_path
+                self._df_parser_base_image_inspect = None
+            if (base_image_inspect is not None and
+                    base_image_inspect is not self._df_parser_base_image_inspect):
+                parser.parent_env = get_parent_env(base_image_inspect)
+                self._df_parser_base_image_inspect = base_image_inspect
+            return parser
+
     def throw_canceled_build_exception(self, *args, **kwargs):
         self.build_canceled = True
         raise BuildCanceledException("Build was canceled")
@@ -353,7 +393,8 @@ class DockerBuildWorkflow(object):
             # time to run pre-build plugins, so they can access cloned repo
             logger.info("running pre-build plugins")
             prebuild_runner = PreBuildPluginsRunner(self.builder.tasker, self, self.prebuild_plugins_conf,
-                                                    plugin_files=self.plugin_files)
+                                                    plugin_files=self.plugin_files,
+                                                    max_parallel_plugins=self.max_parallel_plugins)
             try:
                 prebuild_runner.run()
             except PluginFailedException as ex:
@@ -384,16 +425,18 @@ class DockerBuildWorkflow(object):
                 self.built_image_inspect = self.builder.inspect_built_image()
 
             # run prepublish plugins
-            prepublish_runner = PrePublishPluginsRunner(self.builder.tasker, self, self.prepublish_plugins_conf,
-                                                        plugin_files=self.plugin_files)
+            prepublish_runner = PrePublishPluginsRunner(
+                self.builder.tasker, self, self.prepublish_plugins_conf,
+                plugin_files=self.plugin_files, max_parallel_plugins=self.max_parallel_plugins)
             try:
                 prepublish_runner.run()
             except PluginFailedException as ex:
                 logger.error("one or more prepublish plugins failed: %s", ex)
                 raise
 
-            postbuild_runner = PostBuildPluginsRunner(self.builder.tasker, self, self.postbuild_plugins_conf,
-                                                      plugin_files=self.plugin_files)
+            postbuild_runner = PostBuildPluginsRunner(
+                self.builder.tasker, self, self.postbuild_plugins_conf,
+                plugin_files=self.plugin_files, max_parallel_plugins=self.max_parallel_plugins)
             try:
                 postbuild_runner.run()
             except PluginFailedException as ex:
@@ -409,7 +452,8 @@ class DockerBuildWorkflow(object):
             signal.signal(signal.SIGTERM, lambda *args: None)
             exit_runner = ExitPluginsRunner(self.builder.tasker, self,
                                             self.exit_plugins_conf,
-                                            plugin_files=self.plugin_files)
+                                            plugin_files=self.plugin_files,
+                                            max_parallel_plugins=self.max_parallel_plugins)
             try:
                 exit_runner.run(keep_going=True)
             except PluginFailedException as ex:
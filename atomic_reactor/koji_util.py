@@ -9,16 +9,36 @@ of the BSD license. See the LICENSE file for details.
 from __future__ import print_function
 
 
+import base64
+import errno
+import hashlib
+import json
 import koji
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import tempfile
+import threading
 import time
+import uuid
+import weakref
 
 from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE
+from atomic_reactor.download import DEFAULT_DOWNLOAD_CACHE_SIZE, evict_cache
+from atomic_reactor.version import __version__ as atomic_reactor_version
 
 
 logger = logging.getLogger(__name__)
 
+# maximum number of calls made in a single multicall request
+DEFAULT_MULTICALL_BATCH_SIZE = 100
+
+# file in the buildroot to keep buildroot metadata in, there's no cache when not set
+BUILDROOT_CACHE_ENV = 'ATOMIC_REACTOR_BUILDROOT_CACHE'
+
+# subdirectory of the download cache directory keeping local copies of task outputs
+TASK_OUTPUT_CACHE_SUBDIR = 'koji-task-output'
+
 
 def koji_login(session,
                proxyuser=None,
@@ -80,19 +100,179 @@ def create_koji_session(hub_url, auth_info=None):
     return session
 
 
+class KojiSessionPool(object):
+    """
+    Koji sessions shared by plugins of one build, so that each hub is logged
+    in to only once for each set of credentials.
+
+    Sessions which were not handed out for check_interval seconds are checked
+    before being handed out again; expired ones are replaced by new sessions.
+    Koji sessions are not thread-safe, so each thread gets sessions of its own.
+    """
+
+    def __init__(self, check_interval=600):
+        """
+        :param check_interval: int, seconds after which a session is checked
+        """
+        self.check_interval = check_interval
+        self.local = threading.local()
+
+    @property
+    def sessions(self):
+        """
+        sessions of the current thread,
+        (hub URL, auth info) -> [session, time it was last handed out]
+        """
+        if not hasattr(self.local, 'sessions'):
+            self.local.sessions = {}
+        return self.local.sessions
+
+    @staticmethod
+    def _is_logged_in(session):
+        try:
+            return bool(session.getLoggedInUser())
+        except koji.AuthExpired:
+            return False
+
+    def get_session(self, hub_url, auth_info=None):
+        """
+        :param hub_url: str, Koji hub URL
+        :param auth_info: dict, authentication parameters used for koji_login,
+                          None for an anonymous session
+        :return: koji.ClientSession instance
+        """
+        key = (hub_url, None if auth_info is None else frozenset(auth_info.items()))
+        sessions = self.sessions
+        entry = sessions.get(key)
+        now = time.time()
+        if entry is not None:
+            session, last_used = entry
+            if (auth_info is not None and now - last_used > self.check_interval and
+                    not self._is_logged_in(session)):
+                logger.info('Koji session for %s expired, logging in again', hub_url)
+                entry = None
+            else:
+                logger.debug('Reusing Koji session for %s', hub_url)
+
+        if entry is None:
+            session = create_koji_session(hub_url, auth_info)
+
+        sessions[key] = [session, now]
+        return session
+
+
+_session_pools = weakref.WeakKeyDictionary()
+_session_pools_lock = threading.Lock()
+
+
+def get_koji_session(workflow, hub_url, auth_info=None):
+    """
+    Returns a Koji session shared by plugins of workflow running in the
+    current thread, creating it (and logging in) the first time it's
+    requested; see KojiSessionPool.
+
+    :param workflow: DockerBuildWorkflow instance
+    :param hub_url: str, Koji hub URL
+    :param auth_info: dict, authentication parameters used for koji_login
+    :return: koji.ClientSession instance
+    """
+    with _session_pools_lock:
+        pool = _session_pools.get(workflow)
+        if pool is None:
+            pool = _session_pools[workflow] = KojiSessionPool()
+
+    return pool.get_session(hub_url, auth_info)
+
+
+def koji_multicall(session, calls, batch_size=DEFAULT_MULTICALL_BATCH_SIZE):
+    """
+    Make several koji calls in as few requests as possible, using koji's
+    multicall support.
+
+    :param session: koji.ClientSession instance
+    :param calls: list of (method name, args, kwargs) tuples
+    :param batch_size: int, maximum number of calls made in one request
+    :return: list of results, in the order of calls
+    """
+    results = []
+    for start in range(0, len(calls), batch_size):
+        batch = calls[start:start + batch_size]
+        logger.debug('making %d koji calls in one request', len(batch))
+        session.multicall = True
+        try:
+            for method, args, kwargs in batch:
+                getattr(session, method)(*args, **kwargs)
+        except Exception:
+            session.multicall = False
+            raise
+
+        # strict: raise the first fault instead of returning it
+        for result in session.multiCall(strict=True):
+            results.append(result[0])
+
+    return results
+
+
 class TaskWatcher(object):
-    def __init__(self, session, task_id, poll_interval=5):
+    """
+    Wait for a koji task to finish.
+
+    Polling is adaptive: the first polls come soon after the task was created,
+    so short tasks are noticed quickly, and the interval then grows by
+    BACKOFF_FACTOR with each poll up to max_poll_interval, so long tasks don't
+    put needless load on the hub.
+    """
+
+    BACKOFF_FACTOR = 2
+
+    def __init__(self, session, task_id, poll_interval=5, min_poll_interval=None,
+                 max_poll_interval=None):
+        """
+        :param session: koji.ClientSession instance
+        :param task_id: int, koji task ID
+        :param poll_interval: float, typical number of seconds between polls,
+                              used to derive the defaults of the following
+        :param min_poll_interval: float, seconds before the first poll,
+                                  poll_interval / 5 by default
+        :param max_poll_interval: float, maximum seconds between polls,
+                                  poll_interval * 12 by default
+        """
         self.session = session
         self.task_id = task_id
         self.poll_interval = poll_interval
+        if min_poll_interval is None:
+            min_poll_interval = poll_interval / 5.0
+        if max_poll_interval is None:
+            max_poll_interval = poll_interval * 12
+        self.min_poll_interval = min(min_poll_interval, max_poll_interval)
+        self.max_poll_interval = max_poll_interval
         self.state = 'CANCELED'
+        self.polls = 0
+        self.wait_time = 0
+
+    def poll_intervals(self):
+        """
+        :return: generator of seconds to sleep between polls
+        """
+        interval = self.min_poll_interval
+        while True:
+            yield interval
+            interval = min(interval * self.BACKOFF_FACTOR, self.max_poll_interval)
 
     def wait(self):
         logger.debug("waiting for koji task %r to finish", self.task_id)
-        while not self.session.taskFinished(self.task_id):
-            time.sleep(self.poll_interval)
-
-        logger.debug("koji task is finished, getting info")
+        start_time = time.time()
+        intervals = self.poll_intervals()
+        try:
+            while True:
+                self.polls += 1
+                if self.session.taskFinished(self.task_id):
+                    break
+                time.sleep(next(intervals))
+        finally:
+            self.wait_time = time.time() - start_time
+
+        logger.debug("koji task is finished after %d polls, getting info", self.polls)
         task_info = self.session.getTaskInfo(self.task_id, request=True)
         self.state = koji.TASK_STATES[task_info['state']]
         return self.state
@@ -100,14 +280,71 @@ class TaskWatcher(object):
     def failed(self):
         return self.state in ['CANCELED', 'FAILED']
 
+    @property
+    def stats(self):
+        """
+        :return: dict, statistics of waiting for the task
+        """
+        return {
+            'task_id': self.task_id,
+            'state': self.state,
+            'polls': self.polls,
+            'wait_time': self.wait_time,
+        }
 
-def stream_task_output(session, task_id, file_name,
-                       blocksize=DEFAULT_DOWNLOAD_BLOCK_SIZE):
+
+def wait_tasks(watchers):
     """
-    Generator to download file from task without loading the whole
-    file into memory.
+    Wait for several koji tasks to finish, polling all of them with a single
+    multicall request; see TaskWatcher.
+
+    :param watchers: list of TaskWatcher instances sharing one session
+    :return: list of str, final states of the tasks
     """
-    logger.debug('Streaming {} from task {}'.format(file_name, task_id))
+    if not watchers:
+        return []
+
+    session = watchers[0].session
+    logger.debug("waiting for koji tasks %r to finish",
+                 [watcher.task_id for watcher in watchers])
+    start_time = time.time()
+    intervals = watchers[0].poll_intervals()
+    pending = list(watchers)
+    while True:
+        results = koji_multicall(session, [('taskFinished', (watcher.task_id, ), {})
+                                           for watcher in pending])
+        for watcher, finished in zip(list(pending), results):
+            watcher.polls += 1
+            if finished:
+                watcher.wait_time = time.time() - start_time
+                pending.remove(watcher)
+
+        if not pending:
+            break
+        time.sleep(next(intervals))
+
+    task_infos = koji_multicall(session, [('getTaskInfo', (watcher.task_id, ), {'request': True})
+                                          for watcher in watchers])
+    for watcher, task_info in zip(watchers, task_infos):
+        watcher.state = koji.TASK_STATES[task_info['state']]
+
+    return [watcher.state for watcher in watchers]
+
+
+def get_task_output_cache_path(cache_dir, hub_url, task_id, file_name):
+    """
+    :param cache_dir: str, directory keeping local copies of task outputs
+    :param hub_url: str, Koji hub URL
+    :param task_id: int, ID of a finished koji task
+    :param file_name: str, name of the task output
+    :return: str, path of the local copy of the task output
+    """
+    key = hashlib.sha256('{0}\n{1}\n{2}'.format(hub_url, task_id, file_name)
+                         .encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, TASK_OUTPUT_CACHE_SUBDIR, key[:2], key)
+
+
+def _download_task_output(session, task_id, file_name, blocksize):
     offset = 0
     contents = '[PLACEHOLDER]'
     while contents:
@@ -117,6 +354,105 @@ def stream_task_output(session, task_id, file_name,
         if contents:
             yield contents
 
+
+def _prefetch_task_output(session, task_id, file_name, blocksize, prefetch):
+    def fetch(offset):
+        # ClientSession.downloadTaskOutput decodes the result itself, which
+        # doesn't work with multicall
+        results = koji_multicall(session, [
+            ('callMethod', ('downloadTaskOutput', task_id, file_name),
+             {'offset': offset + index * blocksize, 'size': blocksize})
+            for index in range(prefetch)
+        ])
+        return [base64.b64decode(result) for result in results]
+
+    # the next batch of blocks is downloaded while the current one is consumed
+    pool = ThreadPool(1)
+    try:
+        offset = 0
+        batch = pool.apply_async(fetch, (offset, ))
+        while True:
+            blocks = batch.get()
+            # a block shorter than blocksize is the last one
+            last = any(len(block) < blocksize for block in blocks)
+            if not last:
+                offset += prefetch * blocksize
+                batch = pool.apply_async(fetch, (offset, ))
+
+            for block in blocks:
+                if block:
+                    yield block
+                if len(block) < blocksize:
+                    return
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def stream_task_output(session, task_id, file_name,
+                       blocksize=DEFAULT_DOWNLOAD_BLOCK_SIZE, prefetch=1,
+                       cache_path=None, max_cache_size=DEFAULT_DOWNLOAD_CACHE_SIZE):
+    """
+    Generator to download file from task without loading the whole
+    file into memory.
+
+    With prefetch greater than 1, blocks are downloaded in batches of
+    prefetch blocks per multicall request, and the next batch is downloaded
+    while the current one is being consumed; at most 2 * prefetch blocks
+    are kept in memory.
+
+    :param session: koji.ClientSession instance
+    :param task_id: int, ID of a finished koji task
+    :param file_name: str, name of the task output
+    :param blocksize: int, size of downloaded blocks
+    :param prefetch: int, number of blocks to download in one request
+    :param cache_path: str, local copy of the file (see get_task_output_cache_path);
+                       it's read instead of downloading the file if it exists,
+                       otherwise it's written while the file is downloaded
+    :param max_cache_size: int, disk budget of the local copies of task outputs
+                           in bytes, the least recently used ones are evicted when
+                           it's exceeded
+    """
+    if cache_path and os.path.isfile(cache_path):
+        logger.debug('Reading {} of task {} from {}'.format(file_name, task_id, cache_path))
+        # modification time of a local copy is its last use
+        os.utime(cache_path, None)
+        with open(cache_path, 'rb') as f:
+            for contents in iter(lambda: f.read(blocksize), b''):
+                yield contents
+        return
+
+    logger.debug('Streaming {} from task {}'.format(file_name, task_id))
+    if prefetch > 1:
+        blocks = _prefetch_task_output(session, task_id, file_name, blocksize, prefetch)
+    else:
+        blocks = _download_task_output(session, task_id, file_name, blocksize)
+
+    if not cache_path:
+        for contents in blocks:
+            yield contents
+    else:
+        try:
+            os.makedirs(os.path.dirname(cache_path))
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        tmp_path = '{0}.{1}.tmp'.format(cache_path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for contents in blocks:
+                    f.write(contents)
+                    yield contents
+            os.rename(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        # local copies of task outputs have their own budget, apart from other files
+        # in the cache directory; see get_task_output_cache_path
+        evict_cache(os.path.dirname(os.path.dirname(cache_path)), max_cache_size,
+                    keep=(cache_path, ))
+
     logger.debug('Finished streaming {} from task {}'.format(file_name, task_id))
 
 
@@ -129,7 +465,84 @@ def tag_koji_build(session, build_id, target, poll_interval=5):
 
     task = TaskWatcher(session, task_id, poll_interval=poll_interval)
     task.wait()
+    logger.debug('Tagging task %s took %.1fs, %d polls', task_id, task.wait_time, task.polls)
     if task.failed():
         raise RuntimeError('Task %s failed to tag koji build' % task_id)
 
     return build_tag
+
+
+class BuildrootCache(object):
+    """
+    Parts of the Koji buildroot metadata which are fixed for the builder
+    image, e.g. its installed rpms and versions of tools, kept in a JSON file
+    within the buildroot. The file may be shipped in the builder image or is
+    generated by the first build using it.
+
+    Entries are valid for the builder image ID and atomic-reactor version they
+    were stored for; other entries are dropped. The image is identified by its
+    ID rather than by its name, a tag may be moved to another image.
+    """
+
+    def __init__(self, builder_image_id, path=None):
+        """
+        :param builder_image_id: str, ID (or digest) of the builder image the
+                                 entries are valid for; when it's not known,
+                                 entries aren't loaded nor saved
+        :param path: str, JSON file to keep the cache in; by default it's taken
+                     from $ATOMIC_REACTOR_BUILDROOT_CACHE, empty string disables it
+        """
+        if path is None:
+            path = os.environ.get(BUILDROOT_CACHE_ENV)
+        if not builder_image_id:
+            path = ''
+        self.path = path
+        self.key = '{0}#{1}'.format(builder_image_id, atomic_reactor_version)
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as cache_file:
+                    content = json.load(cache_file)
+            except (IOError, OSError, ValueError) as ex:
+                logger.warning("can't load buildroot cache from %s: %r", path, ex)
+            else:
+                if content.get('key') == self.key:
+                    self._entries = content.get('entries', {})
+                else:
+                    logger.debug("buildroot cache %s is for %s, ignoring it",
+                                 path, content.get('key'))
+
+    def get(self, name, compute):
+        """
+        :param name: str, name of the entry
+        :param compute: callable, computes the value when it's not cached; values
+                        which are None aren't cached
+        :return: cached or computed value
+        """
+        with self._lock:
+            if name in self._entries:
+                logger.debug("using cached buildroot %s", name)
+                return self._entries[name]
+
+        value = compute()
+        if value is not None:
+            with self._lock:
+                self._entries[name] = value
+                self._save()
+        return value
+
+    def _save(self):
+        if not self.path:
+            return
+
+        try:
+            cache_dir = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.buildroot-')
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump({'key': self.key, 'entries': self._entries}, cache_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as ex:
+            logger.warning("can't save buildroot cache to %s: %r", self.path, ex)
@@ -10,19 +10,40 @@ definition of plugin system
 
 plugins are supposed to be run when image is built and we need to extract some information
 """
+import ast
 import copy
+import json
 import logging
 import os
+import sys
+import threading
 import traceback
 import imp
 import datetime
+from multiprocessing.pool import ThreadPool
 import inspect
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+from importlib import import_module
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+try:
+    from queue import Empty, Queue
+except ImportError:
+    from Queue import Empty, Queue
 
 from atomic_reactor.build import BuildResult
 from atomic_reactor.util import process_substitutions
 from dockerfile_parse import DockerfileParser
 
 MODULE_EXTENSIONS = ('.py', '.pyc', '.pyo')
+PLUGINS_DIR = os.path.join(os.path.dirname(__file__), 'plugins')
+PLUGIN_INDEX_ENV = 'ATOMIC_REACTOR_PLUGIN_INDEX'
+PLUGIN_INDEX_VERSION = 1
 logger = logging.getLogger(__name__)
 
 
@@ -48,6 +69,10 @@ class InappropriateBuildStepError(Exception):
     """Requested build step is not appropriate"""
 
 
+# pseudo-attribute for Plugin.reads/writes: koji sessions shared by plugins of a build
+KOJI_SESSION = 'koji_session'
+
+
 class Plugin(object):
     """ abstract plugin class """
 
@@ -57,6 +82,19 @@ class Plugin(object):
     key = None
     # by default, if plugin fails (raises exc), execution continues
     is_allowed_to_fail = True
+    # names of DockerBuildWorkflow attributes (e.g. 'tag_conf', 'push_conf',
+    # 'exported_image_sequence', 'files', 'dockerfile' for the Dockerfile
+    # itself) and keys of other plugins whose results this plugin reads or
+    # changes; plugins which don't conflict may be run concurrently (see
+    # BuildPluginsRunner), None means "anything", i.e. never run concurrently;
+    # resources shared by plugins which aren't thread-safe are named here as
+    # well, e.g. KOJI_SESSION for plugins using koji_util.get_koji_session
+    reads = None
+    writes = None
+    # whether the plugin reacts to BuildCanceledException, which is raised by
+    # the SIGTERM handler in the main thread; when plugins run concurrently,
+    # such plugins are run on the main thread while no other plugin is running
+    handles_cancel = False
 
     def __init__(self, *args, **kwargs):
         """
@@ -105,6 +143,409 @@ class BuildPlugin(Plugin):
         super(BuildPlugin, self).__init__(*args, **kwargs)
 
 
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+def _get_base_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _get_literal_string(node):
+    try:
+        value = ast.literal_eval(node)
+    except ValueError:
+        return None
+    return value if isinstance(value, string_types) else None
+
+
+def scan_plugin_file(path):
+    """
+    find plugin classes defined in provided file without importing it
+
+    Keys defined as string literals, module-level string constants, constants
+    imported from already loaded modules and references to the key of another
+    class in the same module are understood; anything else is recorded with
+    key None and the module has to be imported to find out.
+
+    :param path: str, path to python source file
+    :return: list of dicts, [{"name": "MyPlugin", "key": "my_plugin",
+                              "bases": ["PreBuildPlugin"]}, ...]
+    """
+    with open(path) as fp:
+        tree = ast.parse(fp.read(), path)
+
+    names = {}
+    classes = []
+    local_classes = {}
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module:
+            # only consult modules which are already loaded, don't import anything
+            module = sys.modules.get(node.module)
+            for alias in node.names:
+                value = getattr(module, alias.name, None)
+                if isinstance(value, string_types):
+                    names[alias.asname or alias.name] = value
+        elif isinstance(node, ast.Assign):
+            value = _get_literal_string(node.value)
+            for target in node.targets:
+                if isinstance(target, ast.Name) and value is not None:
+                    names[target.id] = value
+        elif isinstance(node, ast.ClassDef):
+            klass = {
+                'name': node.name,
+                'bases': [_get_base_name(base) for base in node.bases],
+                'key_node': None,
+            }
+            for stmt in node.body:
+                if not isinstance(stmt, ast.Assign):
+                    continue
+                if any(isinstance(t, ast.Name) and t.id == 'key' for t in stmt.targets):
+                    klass['key_node'] = stmt.value
+            classes.append(klass)
+            local_classes[node.name] = klass
+
+    def resolve_key(klass, seen=()):
+        if klass['name'] in seen:
+            return None
+        seen += (klass['name'], )
+        node = klass['key_node']
+        if node is None:
+            # inherited from a class defined in this module?
+            for base in klass['bases']:
+                if base in local_classes:
+                    return resolve_key(local_classes[base], seen)
+            return None
+        if isinstance(node, ast.Name):
+            return names.get(node.id)
+        if (isinstance(node, ast.Attribute) and node.attr == 'key' and
+                isinstance(node.value, ast.Name) and node.value.id in local_classes):
+            return resolve_key(local_classes[node.value.id], seen)
+        return _get_literal_string(node)
+
+    def resolve_bases(klass, seen=()):
+        if klass['name'] in seen:
+            return []
+        seen += (klass['name'], )
+        bases = []
+        for base in klass['bases']:
+            if base in local_classes:
+                bases.extend(resolve_bases(local_classes[base], seen))
+            else:
+                bases.append(base)
+        return bases
+
+    return [{'name': klass['name'],
+             'key': resolve_key(klass),
+             'bases': resolve_bases(klass)}
+            for klass in classes]
+
+
+def find_plugin_classes(module, plugin_class):
+    """
+    find all subclasses of plugin_class in provided module
+
+    :param module: module object
+    :param plugin_class: class, base class of plugins (e.g. PreBuildPlugin)
+    :return: dict, plugin key -> plugin class
+    """
+    plugin_classes = {}
+    for name in dir(module):
+        binding = getattr(module, name, None)
+        try:
+            # if you try to compare binding and PostBuildPlugin, python won't match them if you call
+            # this script directly b/c:
+            # ! <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class '__main__.PostBuildPlugin'>
+            # but
+            # <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class 'atomic_reactor.plugin.PostBuildPlugin'>
+            is_sub = issubclass(binding, plugin_class)
+        except TypeError:
+            is_sub = False
+        if binding and is_sub and plugin_class.__name__ != binding.__name__:
+            plugin_classes[binding.key] = binding
+    return plugin_classes
+
+
+class PluginRegistry(object):
+    """
+    process-wide index of available plugins
+
+    Plugin files are inspected statically (see scan_plugin_file) or the
+    result is read from a precomputed index file, so a module is imported
+    only once a plugin it provides is requested -- and then only once per
+    process, no matter how many runners ask for it.
+
+    A precomputed index can be generated with
+
+        PluginRegistry().write_index(path)
+
+    and is picked up from $ATOMIC_REACTOR_PLUGIN_INDEX; entries for files
+    which changed since the index was written are ignored.
+    """
+
+    def __init__(self, index_path=None):
+        """
+        constructor
+
+        :param index_path: str, path to precomputed plugin index
+        """
+        self._lock = threading.RLock()
+        self._builtin_files = None
+        # path -> list of classes, as returned by scan_plugin_file
+        self._files = {}
+        # path -> module, None for modules which failed to load
+        self._modules = {}
+        self._index = {}
+        if index_path:
+            self._index = self._read_index(index_path)
+
+    @staticmethod
+    def _get_file_id(path):
+        st = os.stat(path)
+        return [st.st_mtime, st.st_size]
+
+    def _read_index(self, index_path):
+        try:
+            with open(index_path) as fp:
+                index = json.load(fp)
+        except (IOError, OSError, ValueError) as ex:
+            logger.warning("can't read plugin index '%s': %r", index_path, ex)
+            return {}
+
+        if index.get('version') != PLUGIN_INDEX_VERSION:
+            logger.warning("ignoring plugin index '%s' with unknown version %r",
+                           index_path, index.get('version'))
+            return {}
+
+        logger.debug("using plugin index '%s'", index_path)
+        return index['files']
+
+    def write_index(self, index_path, plugin_files=None):
+        """
+        write index of builtin plugins (and plugin_files) for later use
+
+        :param index_path: str, where to write the index
+        :param plugin_files: list of str, additional plugin files to index
+        """
+        files = {}
+        for path in self.get_builtin_files() + list(plugin_files or []):
+            classes = self.get_file_classes(path)
+            if classes is not None:
+                files[path] = {'id': self._get_file_id(path), 'classes': classes}
+
+        with open(index_path, 'w') as fp:
+            json.dump({'version': PLUGIN_INDEX_VERSION, 'files': files}, fp,
+                      indent=2, sort_keys=True)
+
+    def get_builtin_files(self):
+        with self._lock:
+            if self._builtin_files is None:
+                logger.debug("loading plugins from dir '%s'", PLUGINS_DIR)
+                self._builtin_files = sorted(os.path.join(PLUGINS_DIR, f)
+                                             for f in os.listdir(PLUGINS_DIR)
+                                             if f.endswith(".py"))
+            return list(self._builtin_files)
+
+    def get_file_classes(self, path):
+        """
+        get classes defined in plugin file, without importing it
+
+        :param path: str, path to plugin file
+        :return: list of dicts (see scan_plugin_file), None if file can't be read
+        """
+        with self._lock:
+            if path in self._files:
+                return self._files[path]
+
+            classes = None
+            try:
+                entry = self._index.get(path)
+                if entry and entry['id'] == self._get_file_id(path):
+                    classes = entry['classes']
+                else:
+                    classes = scan_plugin_file(path)
+            except (IOError, OSError, SyntaxError, TypeError, ValueError) as ex:
+                logger.warning("can't inspect module '%s': %r", path, ex)
+
+            self._files[path] = classes
+            return classes
+
+    def load_module(self, path):
+        """
+        import plugin module, at most once per process
+
+        :param path: str, path to plugin file
+        :return: module, None if it can't be loaded
+        """
+        with self._lock:
+            if path in self._modules:
+                return self._modules[path]
+
+            logger.debug("load file '%s'", path)
+            module_name = os.path.basename(path).rsplit('.', 1)[0]
+            try:
+                if os.path.dirname(os.path.abspath(path)) == os.path.abspath(PLUGINS_DIR):
+                    module = import_module('atomic_reactor.plugins.' + module_name)
+                else:
+                    module = imp.load_source(module_name, path)
+            except (IOError, OSError, ImportError, SyntaxError) as ex:
+                logger.warning("can't load module '%s': %r", path, ex)
+                module = None
+
+            self._modules[path] = module
+            return module
+
+    def get_plugin_classes(self, plugin_class, plugin_files=None):
+        """
+        get lazy mapping of plugin keys to subclasses of plugin_class
+
+        :param plugin_class: class, base class of plugins (e.g. PreBuildPlugin)
+        :param plugin_files: list of str, load plugins also from these files
+        :return: LazyPluginClasses instance
+        """
+        files = self.get_builtin_files()
+        if plugin_files:
+            logger.debug("loading additional plugins from files '%s'", plugin_files)
+            files += plugin_files
+
+        namespaces = (sys.modules[__name__], builtins)
+        candidates = {}
+        unresolved = []
+        for order, path in enumerate(files):
+            classes = self.get_file_classes(path)
+            if classes is None:
+                # let the import report what's wrong
+                unresolved.append((order, path))
+                continue
+
+            for klass in classes:
+                bases = [next((getattr(ns, base) for ns in namespaces
+                               if hasattr(ns, base or '')), None)
+                         for base in klass['bases']]
+                if not all(inspect.isclass(base) for base in bases):
+                    # base class defined elsewhere, import to find out
+                    if (order, path) not in unresolved:
+                        unresolved.append((order, path))
+                    continue
+
+                if (not any(issubclass(base, plugin_class) for base in bases) or
+                        klass['name'] == plugin_class.__name__):
+                    continue
+
+                if klass['key'] is None:
+                    if (order, path) not in unresolved:
+                        unresolved.append((order, path))
+                else:
+                    candidates[klass['key']] = (order, path, klass['name'])
+
+        return LazyPluginClasses(self, plugin_class, candidates, unresolved)
+
+
+class LazyPluginClasses(Mapping):
+    """
+    mapping of plugin keys to plugin classes, importing modules on demand
+    """
+
+    def __init__(self, registry, plugin_class, candidates, unresolved):
+        """
+        constructor
+
+        :param registry: PluginRegistry instance
+        :param plugin_class: class, base class of plugins (e.g. PreBuildPlugin)
+        :param candidates: dict, plugin key -> (order, path, class name)
+        :param unresolved: list of (order, path) tuples, files which need to
+                           be imported to learn which plugins they provide;
+                           when several files provide the same key, the one
+                           with highest order wins
+        """
+        self._registry = registry
+        self._plugin_class = plugin_class
+        self._candidates = candidates
+        self._unresolved = list(unresolved)
+        self._classes = {}
+
+        # plugin key -> (order, class)
+        self._found = {}
+
+    def _load_unresolved(self, after=-1):
+        for order, path in list(self._unresolved):
+            if order <= after:
+                continue
+            self._unresolved.remove((order, path))
+            module = self._registry.load_module(path)
+            if module is None:
+                continue
+            for key, binding in find_plugin_classes(module, self._plugin_class).items():
+                if order >= self._found.get(key, (-1, None))[0]:
+                    self._found[key] = (order, binding)
+
+    def __getitem__(self, key):
+        if key in self._classes:
+            return self._classes[key]
+
+        order = -1
+        if key in self._candidates:
+            order, path, class_name = self._candidates[key]
+            module = self._registry.load_module(path)
+            binding = getattr(module, class_name, None)
+            if getattr(binding, 'key', None) != key and module is not None:
+                logger.debug("plugin '%s' not found where expected, "
+                             "inspecting '%s'", key, path)
+                binding = find_plugin_classes(module, self._plugin_class).get(key)
+            if binding is not None and order >= self._found.get(key, (-1, None))[0]:
+                self._found[key] = (order, binding)
+
+        # files which couldn't be inspected may still override the plugin
+        self._load_unresolved(after=order)
+        self._classes[key] = self._found[key][1]
+        return self._classes[key]
+
+    def _all_keys(self):
+        self._load_unresolved()
+        return set(self._candidates) | set(self._found)
+
+    def __iter__(self):
+        for key in sorted(self._all_keys(), key=str):
+            try:
+                self[key]
+            except KeyError:
+                continue
+            yield key
+
+    def __len__(self):
+        return len(self._all_keys())
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+
+_plugin_registry = None
+_plugin_registry_lock = threading.Lock()
+
+
+def get_plugin_registry():
+    """
+    get PluginRegistry shared by the whole process
+
+    :return: PluginRegistry instance
+    """
+    global _plugin_registry
+    with _plugin_registry_lock:
+        if _plugin_registry is None:
+            _plugin_registry = PluginRegistry(os.environ.get(PLUGIN_INDEX_ENV))
+        return _plugin_registry
+
+
 class PluginsRunner(object):
 
     def __init__(self, plugin_class_name, plugins_conf, *args, **kwargs):
@@ -121,41 +562,12 @@ class PluginsRunner(object):
 
     def load_plugins(self, plugin_class_name):
         """
-        load all available plugins
-        """
-        # imp.findmodule('atomic_reactor') doesn't work
-        plugins_dir = os.path.join(os.path.dirname(__file__), 'plugins')
-        logger.debug("loading plugins from dir '%s'", plugins_dir)
-        files = [os.path.join(plugins_dir, f) \
-                 for f in os.listdir(plugins_dir) \
-                 if f.endswith(".py")]
-        if self.plugin_files:
-            logger.debug("loading additional plugins from files '%s'", self.plugin_files)
-            files += self.plugin_files
+        get mapping of all available plugins; modules are imported lazily,
+        when a plugin is actually requested
+        """
         plugin_class = globals()[plugin_class_name]
-        plugin_classes = {}
-        for f in files:
-            logger.debug("load file '%s'", f)
-            module_name = os.path.basename(f).rsplit('.', 1)[0]
-            try:
-                f_module = imp.load_source(module_name, f)
-            except (IOError, OSError, ImportError, SyntaxError) as ex:
-                logger.warning("can't load module '%s': %r", f, ex)
-                continue
-            for name in dir(f_module):
-                binding = getattr(f_module, name, None)
-                try:
-                    # if you try to compare binding and PostBuildPlugin, python won't match them if you call
-                    # this script directly b/c:
-                    # ! <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class '__main__.PostBuildPlugin'>
-                    # but
-                    # <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class 'atomic_reactor.plugin.PostBuildPlugin'>
-                    is_sub = issubclass(binding, plugin_class)
-                except TypeError:
-                    is_sub = False
-                if binding and is_sub and plugin_class.__name__ != binding.__name__:
-                    plugin_classes[binding.key] = binding
-        return plugin_classes
+        return get_plugin_registry().get_plugin_classes(plugin_class,
+                                                        plugin_files=self.plugin_files)
 
     def create_instance_from_plugin(self, plugin_class, plugin_conf):
         """
@@ -177,6 +589,93 @@ class PluginsRunner(object):
     def save_plugin_duration(self, plugin, duration):
         pass
 
+    def _resolve_plugin_request(self, plugin_request, keep_going):
+        """
+        find plugin class for provided request
+
+        :param plugin_request: dict, item of plugins_conf
+        :param keep_going: bool, whether to keep going after unexpected failure
+        :return: tuple, (plugin name, plugin class, plugin configuration,
+                         whether plugin is allowed to fail);
+                 None if the request should be skipped
+        """
+        try:
+            plugin_name = plugin_request['name']
+        except (TypeError, KeyError):
+            msg = "invalid plugin request, no key 'name': %s" % plugin_request
+            exc = None if keep_going else PluginFailedException(msg)
+            self.on_plugin_failed('?', exc)
+            logger.error(msg)
+            if keep_going:
+                return None
+
+            raise exc
+
+        plugin_conf = plugin_request.get("args", {})
+        try:
+            plugin_class = self.plugin_classes[plugin_name]
+        except KeyError:
+            if plugin_request.get('required', True):
+                msg = ("no such plugin: '%s', did you set "
+                       "the correct plugin type?") %  plugin_name
+                exc = None if keep_going else PluginFailedException(msg)
+                self.on_plugin_failed(plugin_name, exc)
+                logger.error(msg)
+                if keep_going:
+                    return None
+
+                raise exc
+            else:
+                # This plugin is marked as not being required
+                logger.warning("plugin '%s' requested but not available",
+                               plugin_name)
+                return None
+        try:
+            plugin_is_allowed_to_fail = plugin_request['is_allowed_to_fail']
+        except (TypeError, KeyError):
+            plugin_is_allowed_to_fail = getattr(plugin_class, "is_allowed_to_fail", True)
+
+        return plugin_name, plugin_class, plugin_conf, plugin_is_allowed_to_fail
+
+    def _handle_plugin_exception(self, plugin_key, ex, plugin_is_allowed_to_fail,
+                                 keep_going, failed_msgs, tb=None):
+        """
+        log exception raised by a plugin and decide whether it is fatal
+
+        :raises PluginFailedException: when the build can't continue
+        """
+        msg = "plugin '%s' raised an exception: %r" % (plugin_key, ex)
+        logger.debug(tb or traceback.format_exc())
+        if not plugin_is_allowed_to_fail:
+            self.on_plugin_failed(plugin_key, ex)
+
+        if plugin_is_allowed_to_fail or keep_going:
+            logger.warning(msg)
+            logger.info("error is not fatal, continuing...")
+            if not plugin_is_allowed_to_fail:
+                failed_msgs.append(msg)
+        else:
+            logger.error(msg)
+            raise PluginFailedException(msg)
+
+    def _save_duration(self, plugin_name, plugin_key, start_time):
+        try:
+            if start_time:
+                finish_time = datetime.datetime.now()
+                duration = finish_time - start_time
+                seconds = duration.total_seconds()
+                logger.debug("plugin '%s' finished in %ds", plugin_name, seconds)
+                self.save_plugin_duration(plugin_key, seconds)
+        except Exception:
+            logger.exception("failed to save plugin duration")
+
+    @staticmethod
+    def _raise_failed_msgs(failed_msgs):
+        if len(failed_msgs) == 1:
+            raise PluginFailedException(failed_msgs[0])
+        elif len(failed_msgs) > 1:
+            raise PluginFailedException("Multiple plugins raised an exception: " + str(failed_msgs))
+
     def run(self, keep_going=False, buildstep_phase=False):
         """
         run all requested plugins
@@ -192,41 +691,11 @@ class PluginsRunner(object):
         plugin_response = None
         for plugin_request in self.plugins_conf:
             plugin_successful = False
-            try:
-                plugin_name = plugin_request['name']
-            except (TypeError, KeyError):
-                msg = "invalid plugin request, no key 'name': %s" % plugin_request
-                exc = None if keep_going else PluginFailedException(msg)
-                self.on_plugin_failed('?', exc)
-                logger.error(msg)
-                if keep_going:
-                    continue
-
-                raise exc
-
-            plugin_conf = plugin_request.get("args", {})
-            try:
-                plugin_class = self.plugin_classes[plugin_name]
-            except KeyError:
-                if plugin_request.get('required', True):
-                    msg = ("no such plugin: '%s', did you set "
-                           "the correct plugin type?") %  plugin_name
-                    exc = None if keep_going else PluginFailedException(msg)
-                    self.on_plugin_failed(plugin_name, exc)
-                    logger.error(msg)
-                    if keep_going:
-                        continue
+            plugin = self._resolve_plugin_request(plugin_request, keep_going)
+            if plugin is None:
+                continue
 
-                    raise exc
-                else:
-                    # This plugin is marked as not being required
-                    logger.warning("plugin '%s' requested but not available",
-                                   plugin_name)
-                    continue
-            try:
-                plugin_is_allowed_to_fail = plugin_request['is_allowed_to_fail']
-            except (TypeError, KeyError):
-                plugin_is_allowed_to_fail = getattr(plugin_class, "is_allowed_to_fail", True)
+            plugin_name, plugin_class, plugin_conf, plugin_is_allowed_to_fail = plugin
 
             logger.debug("running plugin '%s'", plugin_name)
             start_time = datetime.datetime.now()
@@ -264,31 +733,11 @@ class PluginsRunner(object):
                 if not buildstep_phase:
                     raise
             except Exception as ex:
-                msg = "plugin '%s' raised an exception: %r" % (plugin_class.key, ex)
-                logger.debug(traceback.format_exc())
-                if not plugin_is_allowed_to_fail:
-                    self.on_plugin_failed(plugin_class.key, ex)
-
-                if plugin_is_allowed_to_fail or keep_going:
-                    logger.warning(msg)
-                    logger.info("error is not fatal, continuing...")
-                    if not plugin_is_allowed_to_fail:
-                        failed_msgs.append(msg)
-                else:
-                    logger.error(msg)
-                    raise PluginFailedException(msg)
-
+                self._handle_plugin_exception(plugin_class.key, ex, plugin_is_allowed_to_fail,
+                                              keep_going, failed_msgs)
                 plugin_response = ex
 
-            try:
-                if start_time:
-                    finish_time = datetime.datetime.now()
-                    duration = finish_time - start_time
-                    seconds = duration.total_seconds()
-                    logger.debug("plugin '%s' finished in %ds", plugin_name, seconds)
-                    self.save_plugin_duration(plugin_class.key, seconds)
-            except Exception:
-                logger.exception("failed to save plugin duration")
+            self._save_duration(plugin_name, plugin_class.key, start_time)
 
             if not skip_response:
                 self.plugins_results[plugin_class.key] = plugin_response
@@ -298,10 +747,7 @@ class PluginsRunner(object):
                              'after first successful plugin')
                 break
 
-        if len(failed_msgs) == 1:
-            raise PluginFailedException(failed_msgs[0])
-        elif len(failed_msgs) > 1:
-            raise PluginFailedException("Multiple plugins raised an exception: " + str(failed_msgs))
+        self._raise_failed_msgs(failed_msgs)
 
         if not plugin_successful and buildstep_phase and not plugin_response:
             self.on_plugin_failed("BuildStepPlugin", "No appropriate build step")
@@ -319,11 +765,197 @@ class BuildPluginsRunner(PluginsRunner):
         :param workflow: DockerBuildWorkflow instance
         :param plugin_class_name: str, name of plugin class to filter (e.g. 'PreBuildPlugin')
         :param plugins_conf: dict, configuration for plugins
+        :param max_parallel_plugins: int, how many plugins may run at once; plugins
+                                     run concurrently only when they declare
+                                     (Plugin.reads, Plugin.writes) they don't
+                                     conflict
         """
         self.dt = dt
         self.workflow = workflow
+        self.max_parallel_plugins = kwargs.pop('max_parallel_plugins', None) or 1
         super(BuildPluginsRunner, self).__init__(plugin_class_name, plugins_conf, *args, **kwargs)
 
+    def run(self, keep_going=False, buildstep_phase=False):
+        if buildstep_phase or self.max_parallel_plugins <= 1:
+            return super(BuildPluginsRunner, self).run(keep_going=keep_going,
+                                                       buildstep_phase=buildstep_phase)
+
+        return self._run_concurrently(keep_going=keep_going)
+
+    def _get_plugin_access(self, plugin_request):
+        """
+        :return: tuple, (set of resources read, set of resources written),
+                 (None, None) if unknown
+        """
+        try:
+            plugin_class = self.plugin_classes.get(plugin_request['name'])
+        except (TypeError, KeyError):
+            plugin_class = None
+
+        reads = getattr(plugin_class, 'reads', None)
+        writes = getattr(plugin_class, 'writes', None)
+        if reads is None or writes is None:
+            return None, None
+
+        # results of the plugin are a resource as well
+        return set(reads), set(writes) | set([plugin_class.key])
+
+    def _get_plugin_handles_cancel(self, plugin_request):
+        """
+        :return: bool, whether the plugin handles cancellation of the build
+        """
+        try:
+            plugin_class = self.plugin_classes.get(plugin_request['name'])
+        except (TypeError, KeyError):
+            plugin_class = None
+
+        return getattr(plugin_class, 'handles_cancel', False)
+
+    @staticmethod
+    def _plugins_conflict(access1, access2):
+        reads1, writes1 = access1
+        reads2, writes2 = access2
+        if writes1 is None or writes2 is None:
+            return True
+
+        return bool(writes1 & (reads2 | writes2) or writes2 & reads1)
+
+    def _call_plugin(self, index, plugin_class, plugin_conf):
+        """
+        create plugin instance and run it, in a worker thread
+
+        :return: tuple, (index, plugin response, exception, formatted traceback)
+        """
+        try:
+            plugin_instance = self.create_instance_from_plugin(plugin_class, plugin_conf)
+            return index, plugin_instance.run(), None, None
+        except BaseException as ex:
+            # anything escaping would leave the runner waiting for the plugin forever
+            return index, None, ex, traceback.format_exc()
+
+    @staticmethod
+    def _wait_for_plugin(finished):
+        # waiting without a timeout can't be interrupted by signals on python 2
+        while True:
+            try:
+                return finished.get(timeout=1)
+            except Empty:
+                pass
+
+    def _run_concurrently(self, keep_going=False):
+        """
+        run requested plugins on a thread pool
+
+        Each plugin waits for all plugins configured before it which it
+        conflicts with (see Plugin.reads and Plugin.writes); plugins with
+        unknown requirements wait for everything before them and everything
+        after them waits for them. When a plugin fails fatally no more plugins
+        are started, plugins already running are waited for and the failure
+        is raised, the same way as when running plugins one by one.
+
+        Plugins which handle cancellation of the build (see
+        Plugin.handles_cancel) are run on the main thread, alone. When the
+        build is canceled while waiting for other plugins, no more plugins
+        are started and BuildCanceledException is raised once the running
+        ones finish.
+        """
+        accesses = [self._get_plugin_access(plugin_request)
+                    for plugin_request in self.plugins_conf]
+        dependencies = [set(before for before in range(index)
+                            if self._plugins_conflict(accesses[before], access))
+                        for index, access in enumerate(accesses)]
+        handles_cancel = [self._get_plugin_handles_cancel(plugin_request)
+                          for plugin_request in self.plugins_conf]
+
+        failed_msgs = []
+        error = None
+        pending = list(range(len(self.plugins_conf)))
+        running = {}
+        done = set()
+        finished = Queue()
+        pool = ThreadPool(self.max_parallel_plugins)
+        try:
+            while pending or running:
+                started = True
+                while started and error is None:
+                    started = False
+                    for index in pending:
+                        if len(running) >= self.max_parallel_plugins:
+                            break
+                        if dependencies[index] - done:
+                            continue
+                        main_thread = handles_cancel[index]
+                        if main_thread and running:
+                            # later plugins don't overtake it
+                            break
+
+                        pending.remove(index)
+                        started = True
+                        try:
+                            plugin = self._resolve_plugin_request(self.plugins_conf[index],
+                                                                  keep_going)
+                        except Exception as ex:
+                            error = ex
+                            break
+
+                        if plugin is None:
+                            done.add(index)
+                            break
+
+                        plugin_name, plugin_class, plugin_conf, _ = plugin
+                        logger.debug("running plugin '%s'", plugin_name)
+                        start_time = datetime.datetime.now()
+                        self.save_plugin_timestamp(plugin_class.key, start_time)
+                        running[index] = plugin + (start_time, )
+                        if main_thread:
+                            finished.put(self._call_plugin(index, plugin_class, plugin_conf))
+                        else:
+                            pool.apply_async(self._call_plugin,
+                                             (index, plugin_class, plugin_conf),
+                                             callback=finished.put)
+                        break
+
+                if not running:
+                    if error is None and pending:
+                        # can't happen, dependencies only point backwards
+                        raise RuntimeError("plugins %s can't be scheduled" % pending)
+                    break
+
+                try:
+                    index, plugin_response, ex, tb = self._wait_for_plugin(finished)
+                except BuildCanceledException as canceled:
+                    error = error or canceled
+                    continue
+                (plugin_name, plugin_class, plugin_conf, plugin_is_allowed_to_fail,
+                 start_time) = running.pop(index)
+                done.add(index)
+                if isinstance(ex, (AutoRebuildCanceledException, InappropriateBuildStepError)):
+                    if isinstance(ex, InappropriateBuildStepError):
+                        logger.debug('Build step %s is not appropriate', plugin_class.key)
+                    error = error or ex
+                    continue
+                elif ex is not None:
+                    try:
+                        self._handle_plugin_exception(plugin_class.key, ex,
+                                                      plugin_is_allowed_to_fail,
+                                                      keep_going, failed_msgs, tb=tb)
+                    except PluginFailedException as failed:
+                        error = error or failed
+                        continue
+                    plugin_response = ex
+
+                self._save_duration(plugin_name, plugin_class.key, start_time)
+                self.plugins_results[plugin_class.key] = plugin_response
+        finally:
+            pool.close()
+            pool.join()
+
+        if error is not None:
+            raise error
+
+        self._raise_failed_msgs(failed_msgs)
+        return self.plugins_results
+
     def on_plugin_failed(self, plugin=None, exception=None):
         self.workflow.plugin_failed = True
         if plugin and exception:
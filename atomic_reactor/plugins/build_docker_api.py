@@ -20,6 +20,19 @@ class DockerApiPlugin(BuildStepPlugin):
 
     key = 'docker_api'
 
+    def __init__(self, tasker, workflow, context_compression=None):
+        """
+        constructor
+
+        :param tasker: DockerTasker instance
+        :param workflow: DockerBuildWorkflow instance
+        :param context_compression: str, None or 'gzip', compression of the build
+                                    context uploaded to docker daemon; it's worth
+                                    it when the daemon is remote
+        """
+        super(DockerApiPlugin, self).__init__(tasker, workflow)
+        self.context_compression = context_compression
+
     def run(self):
         """
         build image inside current environment;
@@ -38,7 +51,8 @@ class DockerApiPlugin(BuildStepPlugin):
         builder = self.workflow.builder
 
         logs_gen = self.tasker.build_image_from_path(builder.df_dir,
-                                                     builder.image)
+                                                     builder.image,
+                                                     compression=self.context_compression)
 
         self.log.debug('build is submitted, waiting for it to finish')
         command_result = wait_for_command(logs_gen)
@@ -13,6 +13,8 @@ from multiprocessing.pool import ThreadPool
 
 import json
 import os
+import threading
+import time
 
 from atomic_reactor.build import BuildResult
 from atomic_reactor.plugin import BuildStepPlugin
@@ -129,6 +131,9 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
 
     key = 'orchestrate_build'
 
+    # how long (in seconds) the number of active builds in a cluster is trusted
+    CLUSTER_LOAD_TTL = 30
+
     def __init__(self, tasker, workflow, platforms, build_kwargs,
                  osbs_client_config=None, worker_build_image=None,
                  config_kwargs=None):
@@ -156,6 +161,12 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
 
         self.worker_builds = []
 
+        self._lock = threading.Lock()
+        # cluster name -> OSBS instance
+        self._osbs_clients = {}
+        # cluster name -> (timestamp, number of active builds)
+        self._cluster_builds = {}
+
     def get_excluded_platforms(self):
         df_dir = self.workflow.source.get_dockerfile_path()[1]
         exclude_platforms = set()
@@ -178,20 +189,69 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
                                    for status in BUILD_FINISHED_STATES])
         return len(osbs.list_builds(field_selector=field_selector))
 
+    def get_cluster_osbs(self, cluster):
+        """
+        get OSBS client for cluster, one client is created per cluster
+        """
+        with self._lock:
+            osbs = self._osbs_clients.get(cluster.name)
+            if osbs is None:
+                kwargs = deepcopy(self.config_kwargs)
+                kwargs['conf_section'] = cluster.name
+                if self.osbs_client_config:
+                    kwargs['conf_file'] = os.path.join(self.osbs_client_config, 'osbs.conf')
+
+                conf = Configuration(**kwargs)
+                osbs = OSBS(conf, conf)
+                self._osbs_clients[cluster.name] = osbs
+
+        return osbs
+
+    def get_cluster_current_builds(self, cluster):
+        """
+        get number of active builds in cluster; the number is cached for
+        CLUSTER_LOAD_TTL seconds, so clusters used for more platforms are
+        queried once
+        """
+        with self._lock:
+            cached = self._cluster_builds.get(cluster.name)
+        if cached is not None and time.time() - cached[0] < self.CLUSTER_LOAD_TTL:
+            return cached[1]
+
+        current_builds = self.get_current_builds(self.get_cluster_osbs(cluster))
+        with self._lock:
+            self._cluster_builds[cluster.name] = (time.time(), current_builds)
+        return current_builds
+
     def get_cluster_info(self, cluster, platform):
-        kwargs = deepcopy(self.config_kwargs)
-        kwargs['conf_section'] = cluster.name
-        if self.osbs_client_config:
-            kwargs['conf_file'] = os.path.join(self.osbs_client_config, 'osbs.conf')
-
-        conf = Configuration(**kwargs)
-        osbs = OSBS(conf, conf)
-        current_builds = self.get_current_builds(osbs)
+        osbs = self.get_cluster_osbs(cluster)
+        current_builds = self.get_cluster_current_builds(cluster)
         load = current_builds / cluster.max_concurrent_builds
         self.log.debug('enabled cluster %s for platform %s has load %s and active builds %s/%s',
                        cluster.name, platform, load, current_builds, cluster.max_concurrent_builds)
         return ClusterInfo(cluster, platform, osbs, load)
 
+    def probe_clusters(self, platforms):
+        """
+        query load of all clusters enabled for platforms at once
+        """
+        config = get_config(self.workflow)
+        clusters = {}
+        for platform in platforms:
+            for cluster in config.get_enabled_clusters_for_platform(platform):
+                clusters.setdefault(cluster.name, cluster)
+
+        if not clusters:
+            return
+
+        self.log.debug('probing clusters %s', sorted(clusters))
+        thread_pool = ThreadPool(len(clusters))
+        try:
+            thread_pool.map(self.get_cluster_current_builds, clusters.values())
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+
     def choose_cluster(self, platform):
         config = get_config(self.workflow)
         clusters = [self.get_cluster_info(cluster, platform) for cluster in
@@ -306,10 +366,13 @@ class OrchestrateBuildPlugin(BuildStepPlugin):
         platforms = self.get_platforms()
         task_id = self.get_fs_task_id()
 
+        self.probe_clusters(platforms)
+        cluster_infos = [self.choose_cluster(platform) for platform in platforms]
+
         thread_pool = ThreadPool(len(platforms))
         result = thread_pool.map_async(
             lambda cluster_info: self.do_worker_build(release, cluster_info, task_id),
-            [self.choose_cluster(platform) for platform in platforms]
+            cluster_infos
         )
 
         try:
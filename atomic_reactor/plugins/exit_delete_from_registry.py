@@ -10,14 +10,13 @@ from __future__ import unicode_literals
 
 from copy import deepcopy
 import requests
-import requests.auth
 try:
     from urlparse import urlparse
 except ImportError:
     from urllib.parse import urlparse
 
 from atomic_reactor.plugin import ExitPlugin, PluginFailedException
-from atomic_reactor.util import Dockercfg
+from atomic_reactor.util import get_registry_session
 
 class DeleteFromRegistryPlugin(ExitPlugin):
     """
@@ -50,21 +49,9 @@ class DeleteFromRegistryPlugin(ExitPlugin):
 
             registry_noschema = urlparse(registry).netloc
 
-            auth = None
             secret_path = registry_conf.get('secret')
             if secret_path:
                 self.log.debug("registry %s secret %s", registry_noschema, secret_path)
-                dockercfg = Dockercfg(secret_path).get_credentials(registry_noschema)
-                try:
-                    username = dockercfg['username']
-                    password = dockercfg['password']
-                except KeyError:
-                    self.log.error("credentials for registry %s not found in %s",
-                                   registry_noschema, secret_path)
-                else:
-                    self.log.debug("found user %s for registry %s", username, registry_noschema)
-                    auth = requests.auth.HTTPBasicAuth(username, password)
-
             for push_conf_registry in self.workflow.push_conf.docker_registries:
                 if push_conf_registry.uri == registry_noschema:
                     break
@@ -73,6 +60,12 @@ class DeleteFromRegistryPlugin(ExitPlugin):
                                  registry_noschema)
                 continue
 
+            session = get_registry_session(registry, insecure=push_conf_registry.insecure,
+                                           dockercfg_path=secret_path)
+            if secret_path and session.auth is None:
+                self.log.error("credentials for registry %s not found in %s",
+                               registry_noschema, secret_path)
+
             for tag, digests in push_conf_registry.digests.items():
                 digest = digests.default
                 if digest in deleted_digests:
@@ -82,9 +75,8 @@ class DeleteFromRegistryPlugin(ExitPlugin):
                     continue
 
                 repo = tag.split(':')[0]
-                url = registry + "/v2/" + repo + "/manifests/" + digest
-                insecure = push_conf_registry.insecure
-                response = requests.delete(url, verify=not insecure, auth=auth)
+                response = session.delete("/v2/" + repo + "/manifests/" + digest,
+                                          repository=repo)
 
                 if response.status_code == requests.codes.ACCEPTED:
                     self.log.info("deleted manifest %s/%s@%s", registry_noschema, repo, digest)
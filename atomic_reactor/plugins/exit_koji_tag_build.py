@@ -9,7 +9,7 @@ of the BSD license. See the LICENSE file for details.
 from __future__ import unicode_literals
 
 from atomic_reactor.constants import PLUGIN_KOJI_TAG_BUILD_KEY
-from atomic_reactor.koji_util import create_koji_session, tag_koji_build
+from atomic_reactor.koji_util import get_koji_session, tag_koji_build
 from atomic_reactor.plugin import ExitPlugin
 from atomic_reactor.plugins.exit_koji_promote import KojiPromotePlugin
 
@@ -81,7 +81,7 @@ class KojiTagBuildPlugin(ExitPlugin):
             self.log.info('No koji build from %s', KojiPromotePlugin.key)
             return
 
-        session = create_koji_session(self.kojihub, self.koji_auth)
+        session = get_koji_session(self.workflow, self.kojihub, self.koji_auth)
         build_tag = tag_koji_build(session, build_id, self.target,
                                    poll_interval=self.poll_interval)
 
@@ -8,6 +8,7 @@ of the BSD license. See the LICENSE file for details.
 
 Remove built image (this only makes sense if you store the image in some registry first)
 """
+from atomic_reactor.image_cache import get_image_cache, DEFAULT_IMAGE_CACHE_SIZE
 from atomic_reactor.plugin import ExitPlugin
 
 from docker.errors import APIError
@@ -26,17 +27,27 @@ def defer_removal(workflow, image):
 class GarbageCollectionPlugin(ExitPlugin):
     key = "remove_built_image"
 
-    def __init__(self, tasker, workflow, remove_pulled_base_image=True):
+    def __init__(self, tasker, workflow, remove_pulled_base_image=True,
+                 base_image_cache_dir=None, base_image_cache_size=DEFAULT_IMAGE_CACHE_SIZE):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param remove_pulled_base_image: bool, remove also base image? default=True
+        :param base_image_cache_dir: str, directory with the state of base images
+                                     retained on the docker host; by default it's
+                                     taken from $ATOMIC_REACTOR_IMAGE_CACHE, empty
+                                     string disables retention
+        :param base_image_cache_size: int, disk budget for retained base images in
+                                      bytes, least recently used ones are removed
+                                      when it's exceeded
         """
         # call parent constructor
         super(GarbageCollectionPlugin, self).__init__(tasker, workflow)
         self.remove_base_image = remove_pulled_base_image
+        self.base_image_cache = get_image_cache(base_image_cache_dir)
+        self.base_image_cache_size = base_image_cache_size
 
     def run(self):
         image = self.workflow.builder.image_id
@@ -44,25 +55,67 @@ class GarbageCollectionPlugin(ExitPlugin):
             self.remove_image(image, force=True)
 
         if self.remove_base_image and self.workflow.pulled_base_images:
-            # FIXME: we may need to add force here, let's try it like this for now
-            # FIXME: when ID of pulled img matches an ID of an image already present, don't remove
-            for base_image_tag in self.workflow.pulled_base_images:
-                self.remove_image(base_image_tag, force=False)
+            if self.base_image_cache is not None:
+                self.retain_base_images()
+            else:
+                # FIXME: we may need to add force here, let's try it like this for now
+                # FIXME: when ID of pulled img matches an ID of an image already present,
+                #        don't remove
+                for base_image_tag in self.workflow.pulled_base_images:
+                    self.remove_image(base_image_tag, force=False)
 
         workspace = self.workflow.plugin_workspace.get(self.key, {})
         images_to_remove = workspace.get('images_to_remove', [])
         for image in images_to_remove:
             self.remove_image(image, force=True)
 
+    def retain_base_images(self):
+        """
+        record pulled base images as retained and remove the least recently
+        used ones over the disk budget
+        """
+        for base_image_tag in self.workflow.pulled_base_images:
+            try:
+                image_info = self.tasker.inspect_image(base_image_tag)
+            except APIError as ex:
+                self.log.warning("failed to inspect image %s (%s), not retaining it",
+                                 base_image_tag, ex)
+                continue
+            replaced = self.base_image_cache.record(base_image_tag, image_info['Id'],
+                                                    image_info.get('VirtualSize') or
+                                                    image_info.get('Size') or 0)
+            self.log.debug("retaining base image %s", base_image_tag)
+            if replaced and self.remove_image(replaced, force=False):
+                # the name was pulled again and refers to a newer image now
+                self.log.info("removed previous image %s of %s", replaced, base_image_tag)
+                self.base_image_cache.forget([replaced])
+
+        evictions = self.base_image_cache.get_evictions(self.base_image_cache_size,
+                                                        keep=self.workflow.pulled_base_images)
+        removed = [base_image_tag for base_image_tag in evictions
+                   if self.remove_image(base_image_tag, force=False)]
+        if removed:
+            self.log.info("removed least recently used base images: %s", ', '.join(removed))
+        self.base_image_cache.forget(removed)
+
     def remove_image(self, image, force=False):
+        """
+        :return: bool, whether the image was removed
+        """
         try:
             self.tasker.remove_image(image, force=force)
         except APIError as ex:
             if ex.is_client_error():
                 self.log.warning("failed to remove image %s (%s: %s), ignoring",
                                  image, ex.response.status_code, ex.response.reason)
+                if ex.response.status_code == 404:
+                    # it's gone already
+                    return True
+                return False
             else:
                 raise
         except Exception as ex:
             self.log.warning("exception while removing image %s: %r, ignoring",
                              image, ex)
+            return False
+        return True
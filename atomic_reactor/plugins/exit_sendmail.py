@@ -17,7 +17,7 @@ except ImportError:
 from atomic_reactor.plugin import ExitPlugin, PluginFailedException
 from atomic_reactor.plugins.pre_check_and_set_rebuild import is_rebuild
 from atomic_reactor.plugins.exit_koji_promote import KojiPromotePlugin
-from atomic_reactor.koji_util import create_koji_session
+from atomic_reactor.koji_util import get_koji_session
 from atomic_reactor.util import get_build_json
 
 
@@ -131,7 +131,8 @@ class SendMailPlugin(ExitPlugin):
             self.log.info("Koji build ID: %s", self.koji_build_id)
 
         try:
-            self.session = create_koji_session(self.koji_hub, self.koji_auth_info)
+            self.session = get_koji_session(self.workflow, self.koji_hub,
+                                            self.koji_auth_info)
         except Exception:
             self.log.exception("Failed to connect to koji")
             self.session = None
@@ -6,18 +6,12 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
-import gzip
-try:
-    # if we import "lzma" first, we get pyliblzma on Py2, but we want backports.lzma
-    #  so first try to import backports.lzma on Py2 and then 'lzma' on Py3
-    from backports import lzma
-except ImportError:
-    import lzma
-import os
+import time
 
-from atomic_reactor.constants import EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE
+from atomic_reactor.compression import (compress_stream, get_compressed_image_path,
+                                        get_compression_threads, DEFAULT_LEVELS)
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.util import get_exported_image_metadata, human_size
+from atomic_reactor.util import human_size
 
 
 class CompressPlugin(PostBuildPlugin):
@@ -27,53 +21,58 @@ class CompressPlugin(PostBuildPlugin):
             "name": "compress",
             "args": {
                     "method": "gzip",
-                    "load_exported_image": true
+                    "load_exported_image": true,
+                    "threads": 4,
+                    "level": 6
             }
     }]
 
-    Currently supported compression methods are gzip and lzma; gzip is default.
+    Currently supported compression methods are gzip, lzma and zstd (requires
+    the zstandard module); gzip is default.
     By default, the plugin doesn't work on exported image, you have to explicitly
     ask for it by using `load_exported_image: true`.
+
+    The image is compressed as a single stream on one thread by default. With
+    `threads` greater than 1 (or null for all available cores), it's split into
+    blocks compressed in parallel and stored as concatenated gzip members, xz
+    streams or zstd frames, which gzip, xz and zstd decompress as usual; the
+    output is a bit bigger, since blocks don't share compression history.
     """
     key = 'compress'
     is_allowed_to_fail = False
+    reads = ('exported_image_sequence', )
+    writes = ('exported_image_sequence', )
 
     # TODO: add remove_former_image?
-    def __init__(self, tasker, workflow, load_exported_image=False, method='gzip'):
+    def __init__(self, tasker, workflow, load_exported_image=False, method='gzip',
+                 threads=1, level=None):
         """
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param load_exported_image: bool, when running squash plugin with `dont_load=True`,
                                     you may load the exported tar with this switch
+        :param method: str, compression method: gzip, lzma or zstd
+        :param threads: int, number of threads to compress with, None for all cores
+        :param level: int, compression level, default depends on method
         """
         super(CompressPlugin, self).__init__(tasker, workflow)
         self.load_exported_image = load_exported_image
         self.method = method
+        self.threads = get_compression_threads(threads)
+        self.level = level
         self.uncompressed_size = 0
+        self.duration = 0
 
     def _compress_image_stream(self, stream):
-        outfile = os.path.join(self.workflow.source.workdir,
-                               EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE)
-        if self.method == 'gzip':
-            outfile = outfile.format('gz')
-            fp = gzip.open(outfile, 'wb', compresslevel=6)
-        elif self.method == 'lzma':
-            outfile = outfile.format('xz')
-            fp = lzma.open(outfile, 'wb')
-        else:
-            raise RuntimeError('Unsupported compression format {0}'.format(self.method))
-
-        _chunk_size = 1024**2  # 1 MB chunk size for reading/writing
+        outfile = get_compressed_image_path(self.workflow.source.workdir, self.method)
         self.log.info('compressing image %s to %s using %s method',
                       self.workflow.image, outfile, self.method)
-        data = stream.read(_chunk_size)
-        while data != b'':
-            fp.write(data)
-            data = stream.read(_chunk_size)
-
-        self.uncompressed_size = stream.tell()
-
-        return outfile
+        start_time = time.time()
+        metadata = compress_stream(stream, outfile, self.method,
+                                   threads=self.threads, level=self.level)
+        self.duration = time.time() - start_time
+        self.uncompressed_size = metadata['uncompressed_size']
+        return metadata
 
     def run(self):
         if self.load_exported_image:
@@ -82,21 +81,38 @@ class CompressPlugin(PostBuildPlugin):
             image = self.workflow.exported_image_sequence[-1].get('path')
             self.log.info('preparing to compress image %s', image)
             with open(image, 'rb') as image_stream:
-                outfile = self._compress_image_stream(image_stream)
+                metadata = self._compress_image_stream(image_stream)
         else:
             image = self.workflow.image
             self.log.info('fetching image %s from docker', image)
-            with self.tasker.d.get_image(image) as image_stream:
-                outfile = self._compress_image_stream(image_stream)
-        metadata = get_exported_image_metadata(outfile)
+            with self.tasker.get_image(image) as image_stream:
+                metadata = self._compress_image_stream(image_stream)
+        outfile = metadata['path']
 
         if self.uncompressed_size != 0:
-            metadata['uncompressed_size'] = self.uncompressed_size
             savings = 1 - metadata['size'] / float(metadata['uncompressed_size'])
             self.log.debug('uncompressed: %s, compressed: %s, ratio: %.2f %% saved',
                            human_size(metadata['uncompressed_size']),
                            human_size(metadata['size']),
                            100*savings)
+        else:
+            del metadata['uncompressed_size']
 
         self.workflow.exported_image_sequence.append(metadata)
         self.log.info('compressed image is available as %s', outfile)
+
+        result = {
+            'method': self.method,
+            'level': DEFAULT_LEVELS[self.method] if self.level is None else self.level,
+            'threads': self.threads,
+            'uncompressed_size': self.uncompressed_size,
+            'compressed_size': metadata['size'],
+            'duration': self.duration,
+            # bytes of uncompressed data per second
+            'throughput': None,
+        }
+        if self.duration > 0:
+            result['throughput'] = self.uncompressed_size / self.duration
+            self.log.info('compressed with %d thread(s) at %s/s', self.threads,
+                          human_size(result['throughput']))
+        return result
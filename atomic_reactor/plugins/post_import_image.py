@@ -26,6 +26,9 @@ class ImportImagePlugin(PostBuildPlugin):
 
     key = "import_image"
     is_allowed_to_fail = False
+    # tags have to be pushed before they can be imported
+    reads = ('push_conf', )
+    writes = ()
 
     def __init__(self, tasker, workflow, imagestream, docker_image_repo,
                  url, build_json_dir, verify_ssl=True, use_auth=True,
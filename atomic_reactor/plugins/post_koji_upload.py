@@ -18,12 +18,13 @@ import time
 import copy
 
 from atomic_reactor import __version__ as atomic_reactor_version
-from atomic_reactor.plugin import PostBuildPlugin
+from atomic_reactor import rpm_util
+from atomic_reactor.plugin import PostBuildPlugin, KOJI_SESSION
 from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
 from atomic_reactor.constants import PROG, PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
 from atomic_reactor.util import (get_version_of_tools, get_checksums,
                                  get_build_json, get_docker_architecture)
-from atomic_reactor.koji_util import create_koji_session
+from atomic_reactor.koji_util import BuildrootCache, get_koji_session
 from osbs.conf import Configuration
 from osbs.api import OSBS
 from osbs.exceptions import OsbsException
@@ -77,6 +78,9 @@ class KojiUploadPlugin(PostBuildPlugin):
 
     key = PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
     is_allowed_to_fail = False
+    reads = ('exported_image_sequence', 'tag_conf', 'push_conf', 'build_result',
+             PostBuildRPMqaPlugin.key)
+    writes = (KOJI_SESSION,)
 
     def __init__(self, tasker, workflow, kojihub, url, build_json_dir,
                  verify_ssl=True, use_auth=True,
@@ -129,55 +133,7 @@ class KojiUploadPlugin(PostBuildPlugin):
         :param tags: list, str fields used for query output
         :return: list, dicts describing each rpm package
         """
-
-        def field(tag):
-            """
-            Get a field value by name
-            """
-            try:
-                value = fields[tags.index(tag)]
-            except ValueError:
-                return None
-
-            if value == '(none)':
-                return None
-
-            return value
-
-        components = []
-        sigmarker = 'Key ID '
-        for rpm in output:
-            fields = rpm.rstrip('\n').split(separator)
-            if len(fields) < len(tags):
-                continue
-
-            signature = field('SIGPGP:pgpsig') or field('SIGGPG:pgpsig')
-            if signature:
-                parts = signature.split(sigmarker, 1)
-                if len(parts) > 1:
-                    signature = parts[1]
-
-            component_rpm = {
-                'type': 'rpm',
-                'name': field('NAME'),
-                'version': field('VERSION'),
-                'release': field('RELEASE'),
-                'arch': field('ARCH'),
-                'sigmd5': field('SIGMD5'),
-                'signature': signature,
-            }
-
-            # Special handling for epoch as it must be an integer or None
-            epoch = field('EPOCH')
-            if epoch is not None:
-                epoch = int(epoch)
-
-            component_rpm['epoch'] = epoch
-
-            if component_rpm['name'] != 'gpg-pubkey':
-                components.append(component_rpm)
-
-        return components
+        return rpm_util.parse_rpm_output(output, tags, separator=separator)
 
     def get_rpms(self):
         """
@@ -221,14 +177,17 @@ class KojiUploadPlugin(PostBuildPlugin):
 
         return self.parse_rpm_output(output.splitlines(), tags, separator=sep)
 
-    def get_output_metadata(self, path, filename):
+    def get_output_metadata(self, path, filename, checksums=None):
         """
         Describe a file by its metadata.
 
+        :param checksums: dict, checksums of the file if already known,
+                          it is read only if md5sum is missing
         :return: dict
         """
 
-        checksums = get_checksums(path, ['md5'])
+        if not checksums or 'md5sum' not in checksums:
+            checksums = get_checksums(path, ['md5'])
         metadata = {'filename': filename,
                     'filesize': os.path.getsize(path),
                     'checksum': checksums['md5sum'],
@@ -239,26 +198,28 @@ class KojiUploadPlugin(PostBuildPlugin):
     def get_builder_image_id(self):
         """
         Find out the docker ID of the buildroot image we are in.
+
+        :return: str, image ID, None when it can't be found
         """
 
         try:
             buildroot_tag = os.environ["OPENSHIFT_CUSTOM_BUILD_BASE_IMAGE"]
         except KeyError:
-            return ''
+            return None
 
         try:
             pod = self.osbs.get_pod_for_build(self.build_id)
             all_images = pod.get_container_image_ids()
         except OsbsException as ex:
             self.log.error("unable to find image id: %r", ex)
-            return buildroot_tag
+            return None
 
         try:
             return all_images[buildroot_tag]
         except KeyError:
             self.log.error("Unable to determine buildroot image ID for %s",
                            buildroot_tag)
-            return buildroot_tag
+            return None
 
     def get_buildroot(self, build_id):
         """
@@ -267,8 +228,12 @@ class KojiUploadPlugin(PostBuildPlugin):
         :return: dict, partial metadata
         """
 
-        docker_info = self.tasker.get_info()
+        docker_info = self.tasker.get_static_info()
         host_arch, docker_version = get_docker_architecture(self.tasker)
+        builder_image_id = self.get_builder_image_id()
+        # rpms and tools of the buildroot don't change between builds
+        # using the same builder image
+        buildroot_cache = BuildrootCache(builder_image_id)
 
         buildroot = {
             'id': 1,
@@ -289,17 +254,19 @@ class KojiUploadPlugin(PostBuildPlugin):
                     'name': tool['name'],
                     'version': tool['version'],
                 }
-                for tool in get_version_of_tools()] + [
+                for tool in buildroot_cache.get('tools', get_version_of_tools)] + [
                 {
                     'name': 'docker',
                     'version': docker_version,
                 },
             ],
-            'components': self.get_rpms(),
+            'components': buildroot_cache.get('components', self.get_rpms),
             'extra': {
                 'osbs': {
                     'build_id': build_id,
-                    'builder_image_id': self.get_builder_image_id(),
+                    'builder_image_id': (builder_image_id or
+                                         os.environ.get('OPENSHIFT_CUSTOM_BUILD_BASE_IMAGE',
+                                                        '')),
                 }
             },
         }
@@ -364,8 +331,9 @@ class KojiUploadPlugin(PostBuildPlugin):
             # sep instance variable added in Aug 2016
             sep = ','
 
-        return self.parse_rpm_output(output, PostBuildRPMqaPlugin.rpm_tags,
-                                     separator=sep)
+        # only packages which aren't in the base image need to be parsed
+        return rpm_util.get_image_components(self.workflow, output,
+                                             PostBuildRPMqaPlugin.rpm_tags, separator=sep)
 
     def get_image_output(self, arch):
         """
@@ -380,11 +348,13 @@ class KojiUploadPlugin(PostBuildPlugin):
         """
 
         image_id = self.workflow.builder.image_id
-        saved_image = self.workflow.exported_image_sequence[-1].get('path')
+        exported_image = self.workflow.exported_image_sequence[-1]
+        saved_image = exported_image.get('path')
         ext = saved_image.split('.', 1)[1]
         name_fmt = 'docker-image-{id}.{arch}.{ext}'
         image_name = name_fmt.format(id=image_id, arch=arch, ext=ext)
-        metadata = self.get_output_metadata(saved_image, image_name)
+        metadata = self.get_output_metadata(saved_image, image_name,
+                                            checksums=exported_image)
         output = Output(file=open(saved_image), metadata=metadata)
 
         return metadata, output
@@ -591,7 +561,7 @@ class KojiUploadPlugin(PostBuildPlugin):
             "krb_principal": str(self.koji_principal),
             "krb_keytab": str(self.koji_keytab)
         }
-        return create_koji_session(str(self.kojihub), auth_info)
+        return get_koji_session(self.workflow, str(self.kojihub), auth_info)
 
     def run(self):
         """
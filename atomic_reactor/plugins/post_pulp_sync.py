@@ -52,7 +52,7 @@ from __future__ import print_function, unicode_literals
 
 from atomic_reactor.constants import PLUGIN_PULP_SYNC_KEY, PLUGIN_PULP_PUSH_KEY
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.util import ImageName, Dockercfg, are_plugins_in_order
+from atomic_reactor.util import ImageName, get_dockercfg_credentials, are_plugins_in_order
 import dockpulp
 import os
 import re
@@ -69,6 +69,9 @@ filterwarnings("module")
 class PulpSyncPlugin(PostBuildPlugin):
     key = PLUGIN_PULP_SYNC_KEY
     is_allowed_to_fail = False
+    # syncs from the docker registry, so has to wait for pushes to it
+    reads = ('tag_conf', )
+    writes = ('push_conf', )
 
     CER = 'pulp.cer'
     KEY = 'pulp.key'
@@ -148,8 +151,8 @@ class PulpSyncPlugin(PostBuildPlugin):
         if not self.registry_secret_path:
             return {}
 
-        dockercfg = Dockercfg(self.registry_secret_path)
-        registry_creds = dockercfg.get_credentials(docker_registry)
+        registry_creds = get_dockercfg_credentials(self.registry_secret_path,
+                                                   docker_registry)
         if 'username' not in registry_creds:
             return {}
 
@@ -41,6 +41,7 @@ pulp_secret_path:
 from __future__ import print_function, unicode_literals
 from dockpulp import setup_logger
 
+from atomic_reactor.compression import compress_stream, filter_tar
 from atomic_reactor.constants import PLUGIN_PULP_SYNC_KEY, PLUGIN_PULP_PUSH_KEY
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.util import ImageName, are_plugins_in_order
@@ -51,7 +52,6 @@ import dockpulp.imgutils
 import os
 import re
 import tempfile
-import subprocess
 from collections import namedtuple
 from tempfile import NamedTemporaryFile
 
@@ -151,6 +151,26 @@ class PulpUploader(object):
 
         return top_layer, layers
 
+    def _get_uncompressed_source(self):
+        """
+        Find the uncompressed tarball of the image to upload, if there is one,
+        so it doesn't have to be decompressed just to be compressed again
+        """
+        sequence = self.workflow.exported_image_sequence
+        if (self.filename.endswith('.tar') or len(sequence) < 2 or
+                sequence[-1].get('path') != self.filename):
+            return self.filename
+
+        # the compress plugin appends the compressed image right after its source
+        source = sequence[-2]
+        path = source.get('path')
+        if (path and path.endswith('.tar') and os.path.isfile(path) and
+                source.get('size') == sequence[-1].get('uncompressed_size')):
+            self.log.debug("using uncompressed tarball %s", path)
+            return path
+
+        return self.filename
+
     def push_tarball_to_pulp(self, image_names, repo_prefix="redhat-"):
         self.log.info("checking image before upload")
         self._check_file()
@@ -182,10 +202,9 @@ class PulpUploader(object):
         self.log.info("pulp_repos = %s", pulp_repos)
         self._create_missing_repos(p, pulp_repos, repo_prefix)
 
-        _, file_extension = os.path.splitext(self.filename)
-
+        source = self._get_uncompressed_source()
         try:
-            top_layer, layers = self._get_tar_metadata(self.filename)
+            top_layer, layers = self._get_tar_metadata(source)
             # getImageIdsExist was introduced in rh-dockpulp 0.6+
             existing_imageids = p.getImageIdsExist(layers)
             self.log.debug("existing layers: %s", existing_imageids)
@@ -193,29 +212,20 @@ class PulpUploader(object):
             # Strip existing layers from the tar and repack it
             remove_layers = [str(os.path.join(x, 'layer.tar')) for x in existing_imageids]
 
-            commands = {'.xz': 'xzcat', '.gz': 'zcat', '.bz2': 'bzcat', '.tar': 'cat'}
-            unpacker = commands.get(file_extension, None)
-            self.log.debug("using unpacker %s for extension %s", unpacker, file_extension)
-            if unpacker is None:
-                raise Exception("Unknown tarball format: %s" % self.filename)
-
             with NamedTemporaryFile(prefix='strip_tar_', suffix='.gz') as outfile:
-                cmd = "set -o pipefail; {0} {1} | tar --delete {2} | gzip - > {3}".format(
-                    unpacker, self.filename, ' '.join(remove_layers), outfile.name)
-                self.log.debug("running %s", cmd)
-                subprocess.check_call(cmd, shell=True)
+                self.log.debug("removing %s from %s", remove_layers, source)
+                filter_tar(source, outfile.name, remove_layers, method='gzip')
                 self.log.debug("uploading %s", outfile.name)
                 p.upload(outfile.name)
         except:
             self.log.debug("Error on creating deduplicated layers tar", exc_info=True)
             try:
-                if file_extension != '.tar':
+                if not source.endswith('.tar'):
                     raise RuntimeError("tar is already compressed")
                 with NamedTemporaryFile(prefix='full_tar_', suffix='.gz') as outfile:
-                    cmd = "set -o pipefail; cat {0} | gzip - > {1}".format(
-                        self.filename, outfile.name)
-                    self.log.debug("Compressing tar using '%s' command", cmd)
-                    subprocess.check_call(cmd, shell=True)
+                    self.log.debug("compressing %s", source)
+                    with open(source, 'rb') as source_stream:
+                        compress_stream(source_stream, outfile.name, 'gzip')
                     self.log.debug("uploading %s", outfile.name)
                     p.upload(outfile.name)
             except:
@@ -328,10 +338,9 @@ class PulpPushPlugin(PostBuildPlugin):
             image = self.workflow.image
             self.log.info("fetching image %s from docker", image)
             with tempfile.NamedTemporaryFile(prefix='docker-image-', suffix='.tar') as image_file:
-                image_file.write(self.tasker.d.get_image(image).data)
                 # This file will be referenced by its filename, not file
-                # descriptor - must ensure contents are written to disk
-                image_file.flush()
+                # descriptor - save_image_to flushes its contents to disk
+                self.tasker.save_image_to(image, image_file)
                 crane_repos = self.push_tar(image_file.name, image_names)
 
         if self.publish:
@@ -6,7 +6,15 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
 from atomic_reactor.plugin import PostBuildPlugin
+from atomic_reactor.rpm_util import (RpmdbError, extract_rpmdb_from_image, get_base_image_key,
+                                     get_rpm_component_cache, query_rpmdb)
 from docker.errors import APIError
 
 
@@ -16,6 +24,8 @@ __all__ = ('PostBuildRPMqaPlugin', )
 class PostBuildRPMqaPlugin(PostBuildPlugin):
     key = "all_rpm_packages"
     is_allowed_to_fail = False
+    reads = ('exported_image_sequence',)
+    writes = ()
     rpm_tags = [
         'NAME',
         'VERSION',
@@ -30,19 +40,91 @@ class PostBuildRPMqaPlugin(PostBuildPlugin):
     ]
     sep = ';'
 
-    def __init__(self, tasker, workflow, image_id, ignore_autogenerated_gpg_keys=True):
+    def __init__(self, tasker, workflow, image_id, ignore_autogenerated_gpg_keys=True,
+                 read_rpmdb=True):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
+        :param image_id: str, image to list packages of
+        :param ignore_autogenerated_gpg_keys: bool, leave out gpg-pubkey packages
+        :param read_rpmdb: bool, extract rpm database from the image and query it
+                           with rpm on the host; a container running rpm from the
+                           image is used when this is off or fails
         """
         # call parent constructor
         super(PostBuildRPMqaPlugin, self).__init__(tasker, workflow)
         self.image_id = image_id
         self.ignore_autogenerated_gpg_keys = ignore_autogenerated_gpg_keys
+        self.read_rpmdb = read_rpmdb
 
-    def run(self):
+    def get_exported_image_path(self):
+        """
+        :return: str, path of tarball with the image saved by an earlier plugin,
+                 None when there's none
+        """
+        if self.image_id != getattr(self.workflow.builder, 'image_id', None):
+            return None
+        if not self.workflow.exported_image_sequence:
+            return None
+        path = self.workflow.exported_image_sequence[-1].get('path')
+        if path and os.path.isfile(path):
+            return path
+        return None
+
+    def get_missing_base_image_key(self):
+        """
+        :return: str, key of the base image in the host's cache of parsed rpm
+                 lists when its list isn't there yet, None otherwise
+        """
+        cache = get_rpm_component_cache()
+        if not cache.cache_dir:
+            return None
+        if self.image_id != getattr(self.workflow.builder, 'image_id', None):
+            return None
+        base_key = get_base_image_key(self.workflow)
+        if base_key is None or cache.load(base_key, self.rpm_tags, self.sep) is not None:
+            return None
+        return base_key
+
+    def query_rpmdb(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # the base image's package list is read from the base layers of the
+            # built image, once per base image on the host
+            base_key = self.get_missing_base_image_key()
+            extract_kwargs = {}
+            if base_key:
+                base_layers = (self.workflow.base_image_inspect.get('RootFS') or {}).get('Layers')
+                if base_layers:
+                    extract_kwargs['base_dest_dir'] = os.path.join(tmpdir, 'base')
+                    extract_kwargs['base_layer_count'] = len(base_layers)
+                    os.mkdir(extract_kwargs['base_dest_dir'])
+
+            path = self.get_exported_image_path()
+            if path:
+                self.log.debug("reading rpm database from %s", path)
+                with open(path, 'rb') as image_stream:
+                    dbpath = extract_rpmdb_from_image(image_stream, tmpdir, **extract_kwargs)
+            else:
+                self.log.debug("reading rpm database from image %s", self.image_id)
+                with self.tasker.get_image(self.image_id) as image_stream:
+                    dbpath = extract_rpmdb_from_image(image_stream, tmpdir, **extract_kwargs)
+
+            if extract_kwargs:
+                base_dbpath = os.path.join(extract_kwargs['base_dest_dir'], 'rpm')
+                if os.path.isdir(base_dbpath):
+                    self.log.debug("caching rpm list of the base image")
+                    base_output = query_rpmdb(base_dbpath, self.rpm_tags, self.sep)
+                    get_rpm_component_cache().get_components(base_output, self.rpm_tags,
+                                                             self.sep, key=base_key)
+
+            return query_rpmdb(dbpath, self.rpm_tags, self.sep)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def query_in_container(self):
         fmt = self.sep.join(["%%{%s}" % tag for tag in self.rpm_tags])
         container_id = self.tasker.run(
             self.image_id,
@@ -53,12 +135,6 @@ class PostBuildRPMqaPlugin(PostBuildPlugin):
         self.tasker.wait(container_id)
         plugin_output = self.tasker.logs(container_id, stream=False)
 
-        # gpg-pubkey are autogenerated packages by rpm when you import a gpg key
-        # these are of course not signed, let's ignore those by default
-        if self.ignore_autogenerated_gpg_keys:
-            self.log.debug("ignore rpms 'gpg-pubkey'")
-            plugin_output = [x for x in plugin_output if not x.startswith("gpg-pubkey" + self.sep)]
-
         volumes = self.tasker.get_volumes_for_container(container_id)
 
         try:
@@ -74,3 +150,24 @@ class PostBuildRPMqaPlugin(PostBuildPlugin):
                 self.log.warning("error removing volume (ignored):", exc_info=True)
 
         return plugin_output
+
+    def run(self):
+        plugin_output = None
+        if self.read_rpmdb:
+            try:
+                plugin_output = self.query_rpmdb()
+            except (RpmdbError, APIError, tarfile.TarError, subprocess.CalledProcessError,
+                    EnvironmentError, ValueError, KeyError) as ex:
+                self.log.warning("unable to read rpm database from image, "
+                                 "running rpm in container: %r", ex)
+
+        if plugin_output is None:
+            plugin_output = self.query_in_container()
+
+        # gpg-pubkey are autogenerated packages by rpm when you import a gpg key
+        # these are of course not signed, let's ignore those by default
+        if self.ignore_autogenerated_gpg_keys:
+            self.log.debug("ignore rpms 'gpg-pubkey'")
+            plugin_output = [x for x in plugin_output if not x.startswith("gpg-pubkey" + self.sep)]
+
+        return plugin_output
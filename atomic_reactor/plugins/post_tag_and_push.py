@@ -7,6 +7,7 @@ of the BSD license. See the LICENSE file for details.
 """
 
 from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.plugins.exit_remove_built_image import defer_removal
@@ -23,8 +24,10 @@ class TagAndPushPlugin(PostBuildPlugin):
 
     key = "tag_and_push"
     is_allowed_to_fail = False
+    reads = ('tag_conf', )
+    writes = ('tag_conf', 'push_conf', 'plugin_workspace')
 
-    def __init__(self, tasker, workflow, registries):
+    def __init__(self, tasker, workflow, registries, max_parallel_pushes=1):
         """
         constructor
 
@@ -37,11 +40,88 @@ class TagAndPushPlugin(PostBuildPlugin):
                               plain HTTP.
                             * "secret" optional string - path to the secret, which stores
                               email, login and password for remote registry
+        :param max_parallel_pushes: int, how many images may be pushed to a registry at
+                                    the same time; the first image is always pushed on its
+                                    own, so its layers are uploaded just once
         """
         # call parent constructor
         super(TagAndPushPlugin, self).__init__(tasker, workflow)
 
         self.registries = deepcopy(registries)
+        self.max_parallel_pushes = max_parallel_pushes or 1
+
+    def push_image(self, registry_image, insecure, docker_push_secret):
+        """
+        tag and push image, then get its manifest digests
+
+        :return: ManifestDigest instance
+        """
+        self.tasker.tag_and_push_image(self.workflow.builder.image_id,
+                                       registry_image, insecure=insecure,
+                                       force=True, dockercfg=docker_push_secret)
+        return self.get_digests(registry_image, insecure, docker_push_secret)
+
+    def get_digests(self, registry_image, insecure, docker_push_secret):
+        return get_manifest_digests(registry_image, registry_image.registry,
+                                    insecure, docker_push_secret)
+
+    def get_registry_images(self, registry):
+        registry_images = []
+        for image in self.workflow.tag_conf.images:
+            if image.registry:
+                raise RuntimeError("Image name must not contain registry: %r" % image.registry)
+
+            registry_image = image.copy()
+            registry_image.registry = registry
+            registry_images.append(registry_image)
+        return registry_images
+
+    def push_concurrently(self, pool, registry_images, insecure, docker_push_secret,
+                          first_v2):
+        """
+        push first image on its own, the rest in parallel; the config of the
+        first image with v2 digest is fetched as soon as the digest is known
+
+        :param pool: ThreadPool instance
+        :param registry_images: list of ImageName
+        :param first_v2: tuple, (ImageName, str) first image with v2 digest
+                         (from any registry) and the digest; or (None, None)
+        :return: tuple, (list of (ImageName, ManifestDigest or exception),
+                         AsyncResult for config or None, first_v2)
+        """
+        first_image = registry_images[0]
+        self.tasker.tag_and_push_image(self.workflow.builder.image_id,
+                                       first_image, insecure=insecure,
+                                       force=True, dockercfg=docker_push_secret)
+        pending = [pool.apply_async(self.get_digests,
+                                    (first_image, insecure, docker_push_secret))]
+        pending += [pool.apply_async(self.push_image,
+                                     (registry_image, insecure, docker_push_secret))
+                    for registry_image in registry_images[1:]]
+
+        def get_config(first_v2):
+            registry_image, digest = first_v2
+            return get_config_from_registry(registry_image, first_image.registry, digest,
+                                            insecure, docker_push_secret, 'v2')
+
+        config_result = None
+        if first_v2[1]:
+            config_result = pool.apply_async(get_config, (first_v2, ))
+
+        results = []
+        for registry_image, async_result in zip(registry_images, pending):
+            try:
+                digests = async_result.get()
+            except Exception as ex:
+                results.append((registry_image, ex))
+                continue
+
+            results.append((registry_image, digests))
+            if not first_v2[1] and digests.v2:
+                first_v2 = (registry_image, digests.v2)
+                config_result = pool.apply_async(get_config, (first_v2, ))
+
+        return results, config_result, first_v2
 
     def run(self):
         pushed_images = []
@@ -49,6 +129,15 @@ class TagAndPushPlugin(PostBuildPlugin):
         if not self.workflow.tag_conf.unique_images:
             self.workflow.tag_conf.add_unique_image(self.workflow.image)
 
+        if self.max_parallel_pushes > 1 and len(self.workflow.tag_conf.images) > 1:
+            self.log.info("pushing up to %d images at a time", self.max_parallel_pushes)
+            pool = ThreadPool(self.max_parallel_pushes)
+            try:
+                return self.run_concurrently(pool)
+            finally:
+                pool.terminate()
+                pool.join()
+
         first_v2_digest = None
         first_registry_image = None
         for registry, registry_conf in self.registries.items():
@@ -90,3 +179,41 @@ class TagAndPushPlugin(PostBuildPlugin):
 
         self.log.info("All images were tagged and pushed")
         return pushed_images
+
+    def run_concurrently(self, pool):
+        pushed_images = []
+        first_v2 = (None, None)
+        for registry, registry_conf in self.registries.items():
+            insecure = registry_conf.get('insecure', False)
+            push_conf_registry = \
+                self.workflow.push_conf.add_docker_registry(registry, insecure=insecure)
+
+            docker_push_secret = registry_conf.get('secret', None)
+            self.log.info("Registry %s secret %s", registry, docker_push_secret)
+
+            registry_images = self.get_registry_images(registry)
+            results, config_result, first_v2 = self.push_concurrently(
+                pool, registry_images, insecure, docker_push_secret, first_v2)
+
+            # record results in the same order as when pushing one by one
+            failure = None
+            for registry_image, digests in results:
+                if isinstance(digests, Exception):
+                    failure = failure or digests
+                    continue
+
+                pushed_images.append(registry_image)
+                defer_removal(self.workflow, registry_image)
+                tag = registry_image.to_str(registry=False)
+                push_conf_registry.digests[tag] = digests
+
+            if failure is not None:
+                raise failure
+
+            if config_result is not None:
+                push_conf_registry.config = config_result.get()
+            else:
+                self.log.info("V2 schema 2 digest is not available")
+
+        self.log.info("All images were tagged and pushed")
+        return pushed_images
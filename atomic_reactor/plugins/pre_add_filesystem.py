@@ -30,7 +30,9 @@ import os
 from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE, PLUGIN_ADD_FILESYSTEM_KEY
 from atomic_reactor.plugin import PreBuildPlugin, BuildCanceledException
 from atomic_reactor.plugins.exit_remove_built_image import defer_removal
-from atomic_reactor.koji_util import create_koji_session, TaskWatcher, stream_task_output
+from atomic_reactor.download import DOWNLOAD_CACHE_ENV, DEFAULT_DOWNLOAD_CACHE_SIZE
+from atomic_reactor.koji_util import (get_koji_session, get_task_output_cache_path,
+                                      koji_multicall, TaskWatcher, stream_task_output)
 from atomic_reactor import util
 
 
@@ -58,6 +60,8 @@ class AddFilesystemPlugin(PreBuildPlugin):
 
     key = PLUGIN_ADD_FILESYSTEM_KEY
     is_allowed_to_fail = False
+    # the koji image task is canceled when the build is
+    handles_cancel = True
 
     DEFAULT_IMAGE_BUILD_CONF = dedent('''\
         [image-build]
@@ -82,7 +86,8 @@ class AddFilesystemPlugin(PreBuildPlugin):
                  from_task_id=None, poll_interval=5,
                  blocksize=DEFAULT_DOWNLOAD_BLOCK_SIZE,
                  repos=None, architectures=None,
-                 architecture=None):
+                 architecture=None, prefetch_blocks=3, download_cache_dir=None,
+                 download_cache_size=DEFAULT_DOWNLOAD_CACHE_SIZE):
         """
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
@@ -101,6 +106,12 @@ class AddFilesystemPlugin(PreBuildPlugin):
                       from each repo file.
         :param architectures: list<str>, list of arches to build on (orchestrator)
         :param architecture: str, arch to build on (worker)
+        :param prefetch_blocks: int, number of blocks downloaded in one request
+                                while the previous ones are being imported
+        :param download_cache_dir: str, directory to keep downloaded filesystems in,
+                                   default is $ATOMIC_REACTOR_DOWNLOAD_CACHE
+        :param download_cache_size: int, disk budget for downloaded filesystems in
+                                    bytes, the least recently used are evicted
         """
         # call parent constructor
         super(AddFilesystemPlugin, self).__init__(tasker, workflow)
@@ -119,6 +130,12 @@ class AddFilesystemPlugin(PreBuildPlugin):
         self.is_orchestrator = True if self.architectures else False
         self.architecture = architecture
         self.scratch = util.is_scratch_build()
+        self.task_stats = None
+        self.prefetch_blocks = prefetch_blocks
+        if download_cache_dir is None:
+            download_cache_dir = os.environ.get(DOWNLOAD_CACHE_ENV)
+        self.download_cache_dir = download_cache_dir
+        self.download_cache_size = download_cache_size
 
     def is_image_build_type(self, base_image):
         return base_image.strip().lower() == 'koji/image-build'
@@ -248,17 +265,28 @@ class AddFilesystemPlugin(PreBuildPlugin):
         return task_id, filesystem_regex
 
     def find_filesystem(self, task_id, filesystem_regex):
-        for f in self.session.listTaskOutput(task_id):
-            f = f.strip()
-            match = filesystem_regex.match(f)
-            if match:
-                return task_id, match.group(0)
-
-        # Not found in this task, search sub tasks
-        for sub_task in self.session.getTaskChildren(task_id):
-            found = self.find_filesystem(sub_task['id'], filesystem_regex)
-            if found:
-                return found
+        # Walk the task tree breadth-first, looking up outputs and children
+        # of all tasks of one level in a single request
+        tasks = [task_id]
+        while tasks:
+            calls = []
+            for task in tasks:
+                calls.append(('listTaskOutput', (task, ), {}))
+                calls.append(('getTaskChildren', (task, ), {}))
+            results = koji_multicall(self.session, calls)
+
+            sub_tasks = []
+            for task, output, children in zip(tasks, results[::2], results[1::2]):
+                for f in output:
+                    f = f.strip()
+                    match = filesystem_regex.match(f)
+                    if match:
+                        return task, match.group(0)
+
+                sub_tasks.extend(sub_task['id'] for sub_task in children)
+
+            # Not found in these tasks, search sub tasks
+            tasks = sub_tasks
 
         return None
 
@@ -272,8 +300,15 @@ class AddFilesystemPlugin(PreBuildPlugin):
         self.log.info('Streaming filesystem: %s from task ID: %s',
                       file_name, task_id)
 
+        cache_path = None
+        if self.download_cache_dir:
+            cache_path = get_task_output_cache_path(self.download_cache_dir, self.koji_hub,
+                                                    task_id, file_name)
+
         contents = stream_task_output(self.session, task_id, file_name,
-                                      self.blocksize)
+                                      self.blocksize, prefetch=self.prefetch_blocks,
+                                      cache_path=cache_path,
+                                      max_cache_size=self.download_cache_size)
 
         return contents
 
@@ -291,6 +326,9 @@ class AddFilesystemPlugin(PreBuildPlugin):
         try:
             task = TaskWatcher(self.session, task_id, self.poll_interval)
             task.wait()
+            self.task_stats = task.stats
+            self.log.info('waited %.1fs for image task %s, %d polls',
+                          task.wait_time, task_id, task.polls)
         except BuildCanceledException:
             self.log.info("Build was canceled, canceling task %s", task_id)
             try:
@@ -329,7 +367,7 @@ class AddFilesystemPlugin(PreBuildPlugin):
         if not image_build_conf or image_build_conf == 'latest':
             image_build_conf = 'image-build.conf'
 
-        self.session = create_koji_session(self.koji_hub, self.koji_auth_info)
+        self.session = get_koji_session(self.workflow, self.koji_hub, self.koji_auth_info)
 
         task_id, filesystem_regex = self.run_image_task(image_build_conf)
 
@@ -340,4 +378,5 @@ class AddFilesystemPlugin(PreBuildPlugin):
         return {
             'base-image-id': new_base_image,
             'filesystem-koji-task-id': task_id,
+            'filesystem-koji-task-stats': self.task_stats,
         }
@@ -121,7 +121,7 @@ class AddLabelsPlugin(PreBuildPlugin):
         generated['architecture'], _ = get_docker_architecture(self.tasker)
 
         # build host
-        docker_info = self.tasker.get_info()
+        docker_info = self.tasker.get_static_info()
         generated['com.redhat.build-host'] = docker_info['Name']
 
         # VCS info
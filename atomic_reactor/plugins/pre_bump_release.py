@@ -10,7 +10,7 @@ from __future__ import unicode_literals
 
 from atomic_reactor.plugin import PreBuildPlugin
 from atomic_reactor.util import get_all_label_keys, get_preferred_label_key, df_parser
-from atomic_reactor.koji_util import create_koji_session
+from atomic_reactor.koji_util import get_koji_session, koji_multicall
 
 
 class BumpReleasePlugin(PreBuildPlugin):
@@ -25,7 +25,8 @@ class BumpReleasePlugin(PreBuildPlugin):
     # The target parameter is no longer used by this plugin. It's
     # left as an optional parameter to allow a graceful transition
     # in osbs-client.
-    def __init__(self, tasker, workflow, hub, target=None, koji_ssl_certs_dir=None):
+    def __init__(self, tasker, workflow, hub, target=None, koji_ssl_certs_dir=None,
+                 release_window=10):
         """
         constructor
 
@@ -36,6 +37,8 @@ class BumpReleasePlugin(PreBuildPlugin):
         :param koji_ssl_certs_dir: str, path to "cert", "ca", and "serverca"
             Note that this plugin requires koji_ssl_certs_dir set if Koji
             certificate is not trusted by CA bundle.
+        :param release_window: int, number of consecutive releases checked
+            for existing builds in one request
         """
         # call parent constructor
         super(BumpReleasePlugin, self).__init__(tasker, workflow)
@@ -44,7 +47,21 @@ class BumpReleasePlugin(PreBuildPlugin):
             koji_auth_info = {
                 'ssl_certs_dir': koji_ssl_certs_dir,
             }
-        self.xmlrpc = create_koji_session(hub, koji_auth_info)
+        self.xmlrpc = get_koji_session(self.workflow, hub, koji_auth_info)
+        self.release_window = max(1, release_window)
+
+    def get_release_candidates(self, release):
+        """
+        :param release: str, first release to check
+        :return: list of str, release and the ones following it
+        """
+        try:
+            first = int(release)
+        except ValueError:
+            # can't be incremented, check just this one
+            return [release]
+
+        return [release] + [str(first + index) for index in range(1, self.release_window)]
 
     def run(self):
         """
@@ -79,15 +96,22 @@ class BumpReleasePlugin(PreBuildPlugin):
         # getNextRelease will return the release of the last successful build
         # but next_release might be a failed build. Koji's CGImport doesn't
         # allow reuploading builds, so instead we should increment next_release
-        # and make sure the build doesn't exist
+        # and make sure the build doesn't exist; a window of candidate
+        # releases is checked in a single request
         while True:
-            build_info = {'name': component, 'version': version, 'release': next_release}
-            self.log.debug('checking that the build does not exist: %s', build_info)
-            build = self.xmlrpc.getBuild(build_info)
-            if not build:
+            candidates = self.get_release_candidates(next_release)
+            self.log.debug('checking that the builds do not exist: %s-%s-%s',
+                           component, version, candidates)
+            builds = koji_multicall(self.xmlrpc, [
+                ('getBuild', ({'name': component, 'version': version, 'release': release}, ), {})
+                for release in candidates
+            ])
+            free = [release for release, build in zip(candidates, builds) if not build]
+            if free:
+                next_release = free[0]
                 break
 
-            next_release = str(int(next_release) + 1)
+            next_release = str(int(candidates[-1]) + 1)
 
         # Always set preferred release label - other will be set if old-style
         # label is present
@@ -11,10 +11,10 @@ import fnmatch
 import hashlib
 import koji
 import os
-import requests
 
 from atomic_reactor import util
-from atomic_reactor.koji_util import create_koji_session
+from atomic_reactor.download import Downloader, DEFAULT_DOWNLOAD_CACHE_SIZE
+from atomic_reactor.koji_util import get_koji_session, koji_multicall
 from atomic_reactor.plugin import PreBuildPlugin
 from collections import namedtuple
 
@@ -76,7 +76,8 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
     def __init__(self, tasker, workflow, koji_hub, koji_root,
                  koji_proxyuser=None, koji_ssl_certs_dir=None,
                  koji_krb_principal=None, koji_krb_keytab=None,
-                 allowed_domains=None):
+                 allowed_domains=None, max_parallel_downloads=4,
+                 download_cache_dir=None, download_cache_size=DEFAULT_DOWNLOAD_CACHE_SIZE):
         """
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
@@ -88,6 +89,11 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
         :param koji_krb_keytab: str, Kerberos keytab
         :param allowed_domains: list<str>: list of domains that are
                allowed to be used when fetching artifacts by URL (case insensitive)
+        :param max_parallel_downloads: int, how many artifacts to download at once
+        :param download_cache_dir: str, directory to keep downloaded artifacts in,
+               keyed by their checksums, default is $ATOMIC_REACTOR_DOWNLOAD_CACHE
+        :param download_cache_size: int, disk budget for cached artifacts in bytes,
+               the least recently used are evicted
         """
         super(FetchMavenArtifactsPlugin, self).__init__(tasker, workflow)
         koji_auth = {
@@ -106,6 +112,9 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
         self.path_info = koji.PathInfo(topdir=self.koji_info['root'])
         self.allowed_domains = set(domain.lower() for domain in allowed_domains or [])
         self.workdir = self.workflow.source.get_dockerfile_path()[1]
+        self.max_parallel_downloads = max_parallel_downloads
+        self.download_cache_dir = download_cache_dir
+        self.download_cache_size = download_cache_size
         self.session = None
 
     def read_nvr_requests(self):
@@ -129,15 +138,26 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
         download_queue = []
         errors = []
 
-        for nvr_request in nvr_requests:
-            build_info = self.session.getBuild(nvr_request.nvr)
+        # look up all builds in one request, then all their archives in another
+        builds = koji_multicall(self.session, [
+            ('getBuild', (nvr_request.nvr, ), {}) for nvr_request in nvr_requests
+        ])
+        found = [(nvr_request, build_info)
+                 for nvr_request, build_info in zip(nvr_requests, builds) if build_info]
+        archives = koji_multicall(self.session, [
+            ('listArchives', (), {'buildID': build_info['id'], 'type': 'maven'})
+            for _, build_info in found
+        ])
+        build_archives_by_nvr = dict((nvr_request.nvr, build_archives)
+                                     for (nvr_request, _), build_archives in zip(found, archives))
+
+        for nvr_request, build_info in zip(nvr_requests, builds):
             if not build_info:
                 errors.append('Build {} not found.'.format(nvr_request.nvr))
                 continue
 
             maven_build_path = self.path_info.mavenbuild(build_info)
-            build_archives = self.session.listArchives(buildID=build_info['id'],
-                                                       type='maven')
+            build_archives = build_archives_by_nvr[nvr_request.nvr]
             build_archives = nvr_request.match_all(build_archives)
 
             for build_archive in build_archives:
@@ -193,32 +213,24 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
 
         self.log.debug('%d files to download', len(downloads))
 
-        for index, download in enumerate(downloads):
-            dest_path = os.path.join(artifacts_path, download.dest)
-            dest_dir = dest_path.rsplit('/', 1)[0]
-            if not os.path.exists(dest_dir):
-                os.makedirs(dest_dir)
-
-            self.log.debug('%d/%d downloading %s', index + 1, len(downloads),
-                           download.url)
-
-            checksums = {algo: hashlib.new(algo) for algo in download.checksums}
-            request = requests.get(download.url, stream=True)
-            request.raise_for_status()
-            with open(dest_path, 'wb') as f:
-                for chunk in request.iter_content():
-                    f.write(chunk)
-                    for checksum in checksums.values():
-                        checksum.update(chunk)
-
-            for algo, checksum in checksums.items():
-                if checksum.hexdigest() != download.checksums[algo]:
-                    raise ValueError(
-                        'Computed {} checksum, {}, does not match expected checksum, {}'
-                        .format(algo, checksum.hexdigest(), download.checksums[algo]))
+        downloader = Downloader(cache_dir=self.download_cache_dir,
+                                max_parallel=self.max_parallel_downloads,
+                                max_cache_size=self.download_cache_size)
+        results = downloader.download_all([
+            (download.url, os.path.join(artifacts_path, download.dest), download.checksums)
+            for download in downloads
+        ])
+
+        for download, result in zip(downloads, results):
+            self.log.debug('%s %s (%s)', 'copied' if result['cached'] else 'downloaded',
+                           download.url, util.human_size(result['size']))
+
+        cached = sum(1 for result in results if result['cached'])
+        self.log.info('%d files downloaded, %d found in cache', len(results) - cached, cached)
 
     def run(self):
-        self.session = create_koji_session(self.koji_info['hub'], self.koji_info.get('auth'))
+        self.session = get_koji_session(self.workflow, self.koji_info['hub'],
+                                        self.koji_info.get('auth'))
 
         nvr_requests = self.read_nvr_requests()
         url_requests = self.read_url_requests()
@@ -13,7 +13,7 @@ import koji
 from atomic_reactor.constants import YUM_REPOS_DIR
 from atomic_reactor.plugin import PreBuildPlugin
 from atomic_reactor.util import render_yum_repo
-from atomic_reactor.koji_util import create_koji_session
+from atomic_reactor.koji_util import get_koji_session
 
 
 class KojiPlugin(PreBuildPlugin):
@@ -41,7 +41,7 @@ class KojiPlugin(PreBuildPlugin):
             koji_auth_info = {
                 'ssl_certs_dir': koji_ssl_certs_dir,
             }
-        self.xmlrpc = create_koji_session(hub, koji_auth_info)
+        self.xmlrpc = get_koji_session(self.workflow, hub, koji_auth_info)
         self.pathinfo = koji.PathInfo(topdir=root)
         self.proxy = proxy
 
@@ -11,13 +11,23 @@ Pull base image to build our layer on.
 
 from __future__ import unicode_literals
 
+import time
+
+from docker.errors import APIError
+import requests
+
+from atomic_reactor.image_cache import get_image_cache, DEFAULT_IMAGE_CACHE_TTL
 from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.util import get_remote_manifest_digest
+
 
 class PullBaseImagePlugin(PreBuildPlugin):
     key = "pull_base_image"
     is_allowed_to_fail = False
 
-    def __init__(self, tasker, workflow, parent_registry=None, parent_registry_insecure=False):
+    def __init__(self, tasker, workflow, parent_registry=None, parent_registry_insecure=False,
+                 check_digest=False, parent_registry_dockercfg_path=None,
+                 base_image_cache_dir=None, base_image_cache_ttl=DEFAULT_IMAGE_CACHE_TTL):
         """
         constructor
 
@@ -25,12 +35,138 @@ class PullBaseImagePlugin(PreBuildPlugin):
         :param workflow: DockerBuildWorkflow instance
         :param parent_registry: registry to enforce pulling from
         :param parent_registry_insecure: allow connecting to the registry over plain http
+        :param check_digest: bool, ask the registry for the manifest digest of the base
+                             image first and don't pull it when the local image has it
+        :param parent_registry_dockercfg_path: str, dirname of .dockercfg location
+                                               with credentials for parent_registry
+        :param base_image_cache_dir: str, directory with the state of base images
+                                     retained on the docker host, see
+                                     remove_built_image plugin; by default it's taken
+                                     from $ATOMIC_REACTOR_IMAGE_CACHE, empty string
+                                     disables it
+        :param base_image_cache_ttl: int, for how many seconds after it was pulled
+                                     a retained base image is used without pulling
+                                     it again; 0 (default) means it's always pulled
+                                     unless check_digest confirms it's up to date
         """
         # call parent constructor
         super(PullBaseImagePlugin, self).__init__(tasker, workflow)
 
         self.parent_registry = parent_registry
         self.parent_registry_insecure = parent_registry_insecure
+        self.check_digest = check_digest
+        self.parent_registry_dockercfg_path = parent_registry_dockercfg_path
+        self.base_image_cache = get_image_cache(base_image_cache_dir)
+        self.base_image_cache_ttl = base_image_cache_ttl
+
+    def _with_library(self, image):
+        candidates = [image]
+        if image.namespace != 'library':
+            library_image = image.copy()
+            library_image.namespace = 'library'
+            candidates.append(library_image)
+        return candidates
+
+    def get_remote_digest(self, image):
+        """
+        find image in its registry, trying the 'library' namespace as well
+
+        :param image: ImageName, image with registry
+        :return: tuple, (ImageName found in registry, its manifest digest),
+                 digest is None when neither of the names is in the registry
+        """
+        for candidate in self._with_library(image):
+            digest = get_remote_manifest_digest(candidate, candidate.registry,
+                                                insecure=self.parent_registry_insecure,
+                                                dockercfg_path=self.parent_registry_dockercfg_path)
+            if digest:
+                return candidate, digest
+            self.log.info("'%s' not found", candidate.to_str())
+
+        return image, None
+
+    def get_local_image_info(self, image):
+        """
+        :param image: ImageName
+        :return: dict, inspection of the local image, empty if there's none
+        """
+        try:
+            return self.tasker.inspect_image(image)
+        except APIError:
+            return {}
+
+    def get_local_digests(self, image):
+        """
+        :param image: ImageName
+        :return: list of str, RepoDigests of the local image, empty if there's none
+        """
+        return self.get_local_image_info(image).get('RepoDigests') or []
+
+    def find_retained(self, image):
+        """
+        find image retained on the host by an earlier build, which pulled it
+        less than base_image_cache_ttl seconds ago
+
+        :param image: ImageName, image with registry
+        :return: tuple, (retained ImageName, False) like pull_if_changed(),
+                 None when the image isn't retained
+        """
+        for candidate in self._with_library(image):
+            entry = self.base_image_cache.get(candidate.to_str())
+            if entry is None:
+                continue
+            if time.time() - entry.get('pulled', 0) > self.base_image_cache_ttl:
+                self.log.debug("retained image '%s' was pulled too long ago", candidate)
+                continue
+            if self.get_local_image_info(candidate).get('Id') == entry['id']:
+                self.log.info("base image '%s' is retained on the host, not pulling it",
+                              candidate)
+                return candidate, False
+            self.log.debug("retained image '%s' changed, ignoring it", candidate)
+
+        return None
+
+    def pull_if_changed(self, image):
+        """
+        pull image unless the local image has the same manifest digest as the remote one
+
+        :param image: ImageName, image with registry
+        :return: tuple, (ImageName which is available now, bool whether it was pulled),
+                 None when this can't be decided and image should simply be pulled
+        """
+        try:
+            remote_image, digest = self.get_remote_digest(image)
+        except (requests.exceptions.RequestException, RuntimeError) as ex:
+            self.log.warning("failed to get manifest digest of '%s': %s", image, ex)
+            return None
+
+        if digest is None:
+            return None
+
+        repo_digest = '{}@{}'.format(remote_image.to_str(tag=False), digest)
+        if repo_digest in self.get_local_digests(remote_image):
+            self.log.info("local image '%s' is up to date (%s), not pulling it",
+                          remote_image, digest)
+            return remote_image, False
+
+        self.tasker.pull_image(remote_image, insecure=self.parent_registry_insecure)
+        return remote_image, True
+
+    def pull_with_fallback(self, image):
+        """
+        pull image, trying the 'library' namespace when it's not found
+
+        :param image: ImageName, image with registry
+        :return: ImageName, the image which was pulled
+        """
+        self.tasker.pull_image(image, insecure=self.parent_registry_insecure)
+        if image.namespace != 'library' and not self.tasker.image_exists(image.to_str()):
+            self.log.info("'%s' not found", image.to_str())
+            image = image.copy()
+            image.namespace = 'library'
+            self.log.info("trying '%s'", image.to_str())
+            self.tasker.pull_image(image, insecure=self.parent_registry_insecure)
+        return image
 
     def run(self):
         """
@@ -58,17 +194,26 @@ class PullBaseImagePlugin(PreBuildPlugin):
 
             base_image_with_registry.registry = self.parent_registry
 
-        pulled_base = self.tasker.pull_image(base_image_with_registry,
-                                             insecure=self.parent_registry_insecure)
-        if (base_image_with_registry.namespace != 'library' and
-                not self.tasker.image_exists(base_image_with_registry.to_str())):
-            self.log.info("'%s' not found", base_image_with_registry.to_str())
-            base_image_with_registry.namespace = 'library'
-            self.log.info("trying '%s'", base_image_with_registry.to_str())
-            pulled_base = self.tasker.pull_image(base_image_with_registry,
-                                                 insecure=self.parent_registry_insecure)
-
-        self.workflow.pulled_base_images.add(pulled_base)
+        checked = None
+        if self.check_digest and base_image_with_registry.registry:
+            checked = self.pull_if_changed(base_image_with_registry)
+
+        if (checked is None and self.base_image_cache is not None and
+                self.base_image_cache_ttl > 0):
+            checked = self.find_retained(base_image_with_registry)
+
+        if checked is None:
+            base_image_with_registry = self.pull_with_fallback(base_image_with_registry)
+            pulled = True
+        else:
+            base_image_with_registry, pulled = checked
+
+        pulled_base = base_image_with_registry.to_str()
+        if pulled:
+            # image which was here before the build is not ours to remove later
+            self.workflow.pulled_base_images.add(pulled_base)
+        elif self.base_image_cache is not None:
+            self.base_image_cache.touch(pulled_base)
 
         if not base_image.registry:
             response = self.tasker.tag_image(base_image_with_registry, base_image, force=True)
@@ -0,0 +1,556 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Querying rpm database of an image without running a container.
+
+The rpm database is extracted from the image tarball ('docker save' output,
+layers are applied in order including whiteouts) or from a flat filesystem
+tarball ('docker export' output) and queried by rpm on the host using
+--dbpath. Only files of the database are written to disk; the tarballs are
+read as streams.
+
+Parsed package lists are cached by the ID and layers of the image they
+belong to, so a build only parses packages its base image doesn't have. The
+package list of the base image is read from the base layers of the built
+image the first time the base image is used on the host.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# locations of rpm database within image filesystem, most preferred first
+RPMDB_PATHS = ('var/lib/rpm', 'usr/lib/sysimage/rpm')
+
+# directory to keep parsed package lists of images in, there's no cache when not set
+RPM_CACHE_ENV = 'ATOMIC_REACTOR_RPM_CACHE'
+
+WHITEOUT_PREFIX = '.wh.'
+OPAQUE_WHITEOUT = '.wh..wh..opq'
+
+
+class RpmdbError(Exception):
+    """ rpm database couldn't be read from image """
+
+
+def _normalize(name):
+    # tar member names may start with './' or '/'
+    return posixpath.normpath('/' + name).lstrip('/')
+
+
+def _in_rpmdb(name):
+    """
+    :param name: str, normalized path within image filesystem
+    :return: bool, whether the path is rpm database location or is inside it
+    """
+    return any(name == rpmdb_path or name.startswith(rpmdb_path + '/')
+               for rpmdb_path in RPMDB_PATHS)
+
+
+def _affects_rpmdb(name):
+    """
+    :param name: str, normalized path within image filesystem
+    :return: bool, whether removing the path removes anything of rpm database
+    """
+    prefix = name + '/' if name else ''
+    return _in_rpmdb(name) or any(rpmdb_path.startswith(prefix) for rpmdb_path in RPMDB_PATHS)
+
+
+def _local_path(root, name):
+    return os.path.join(root, *name.split('/'))
+
+
+def _extract_member(tar, member, root, name):
+    path = _local_path(root, name)
+    if member.isdir():
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return
+    if not member.isreg():
+        # the database consists of regular files only
+        return
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    if os.path.lexists(path):
+        os.unlink(path)
+    source = tar.extractfile(member)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(source, f)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def _extract_layer(layer_fileobj, layer_dir):
+    """
+    extract rpmdb files from a layer tarball into layer_dir
+
+    :return: list of tuples, (str, bool), whiteouts of the layer: path within
+             image filesystem and whether the whiteout is opaque, i.e. it
+             applies to content of the directory
+    """
+    whiteouts = []
+    with tarfile.open(fileobj=layer_fileobj, mode='r|*') as layer:
+        for member in layer:
+            name = _normalize(member.name)
+            dirname, basename = posixpath.split(name)
+            if basename == OPAQUE_WHITEOUT:
+                if _affects_rpmdb(dirname):
+                    whiteouts.append((dirname, True))
+            elif basename.startswith(WHITEOUT_PREFIX):
+                target = posixpath.join(dirname, basename[len(WHITEOUT_PREFIX):])
+                if _affects_rpmdb(target):
+                    whiteouts.append((target, False))
+            elif _in_rpmdb(name):
+                _extract_member(layer, member, layer_dir, name)
+    return whiteouts
+
+
+def _apply_whiteouts(whiteouts, rootfs):
+    for name, opaque in whiteouts:
+        if _in_rpmdb(name):
+            path = _local_path(rootfs, name)
+            if not opaque:
+                _remove(path)
+            elif os.path.isdir(path):
+                for entry in os.listdir(path):
+                    _remove(os.path.join(path, entry))
+        else:
+            # removal of a directory above the database removes all of it
+            prefix = name + '/' if name else ''
+            for rpmdb_path in RPMDB_PATHS:
+                if rpmdb_path.startswith(prefix):
+                    _remove(_local_path(rootfs, rpmdb_path))
+
+
+def _merge_layer(layer_dir, rootfs):
+    for root, _, files in os.walk(layer_dir):
+        target_root = os.path.join(rootfs, os.path.relpath(root, layer_dir))
+        if not os.path.isdir(target_root):
+            os.makedirs(target_root)
+        for name in files:
+            target_path = os.path.join(target_root, name)
+            _remove(target_path)
+            os.rename(os.path.join(root, name), target_path)
+
+
+def _get_layer_order(manifest, parents):
+    """
+    :param manifest: list, content of manifest.json, None if there's none
+    :param parents: dict, layer id -> parent layer id, from <id>/json files
+    :return: list of str, layer ids from the bottom one
+    """
+    if manifest:
+        return [posixpath.dirname(layer) for layer in manifest[0]['Layers']]
+
+    # legacy format: follow parents from the layer no other layer builds on
+    children = set(parent for parent in parents.values() if parent)
+    tops = [layer_id for layer_id in parents if layer_id not in children]
+    if len(tops) != 1:
+        raise RpmdbError('unable to figure out order of layers')
+    order = []
+    layer_id = tops[0]
+    while layer_id:
+        order.append(layer_id)
+        layer_id = parents.get(layer_id)
+    order.reverse()
+    return order
+
+
+def extract_rpmdb_from_image(fileobj, dest_dir, base_dest_dir=None, base_layer_count=0):
+    """
+    extract rpm database from 'docker save' tarball
+
+    :param fileobj: file-like object with the tarball, may be compressed and
+                    doesn't have to be seekable
+    :param dest_dir: str, directory to extract into
+    :param base_dest_dir: str, directory to extract rpm database of the base
+                          image into, it's found in 'rpm' subdirectory if the
+                          base image has one
+    :param base_layer_count: int, number of bottom layers which belong to the
+                             base image; the base rpm database isn't extracted
+                             when the image has no layers above them
+    :return: str, path of the rpm database within dest_dir
+    """
+    staging_dir = tempfile.mkdtemp(dir=dest_dir, prefix='.layers-')
+    try:
+        manifest = None
+        parents = {}
+        whiteouts = {}
+        with tarfile.open(fileobj=fileobj, mode='r|*') as image:
+            for member in image:
+                if not member.isreg():
+                    continue
+                name = _normalize(member.name)
+                if name == 'manifest.json':
+                    manifest = json.loads(image.extractfile(member).read().decode('utf-8'))
+                    continue
+                layer_id, basename = posixpath.split(name)
+                if not layer_id or '/' in layer_id:
+                    continue
+                if basename == 'json':
+                    layer_json = json.loads(image.extractfile(member).read().decode('utf-8'))
+                    parents[layer_id] = layer_json.get('parent')
+                elif basename == 'layer.tar':
+                    layer_dir = os.path.join(staging_dir, layer_id)
+                    os.mkdir(layer_dir)
+                    # layers come in no particular order, so they are applied later
+                    whiteouts[layer_id] = _extract_layer(image.extractfile(member),
+                                                         layer_dir)
+
+        rootfs = os.path.join(staging_dir, 'rootfs')
+        os.mkdir(rootfs)
+        order = _get_layer_order(manifest, parents)
+        if len(order) <= base_layer_count:
+            # e.g. squashed into a single layer
+            base_dest_dir = None
+        for index, layer_id in enumerate(order):
+            if layer_id not in whiteouts:
+                raise RpmdbError('layer {0} missing in image tarball'.format(layer_id))
+            # whiteouts of a layer apply to the layers below it
+            _apply_whiteouts(whiteouts[layer_id], rootfs)
+            _merge_layer(os.path.join(staging_dir, layer_id), rootfs)
+            if base_dest_dir and index + 1 == base_layer_count:
+                _copy_rpmdb(rootfs, base_dest_dir)
+
+        return _move_rpmdb(rootfs, dest_dir)
+    finally:
+        shutil.rmtree(staging_dir)
+
+
+def extract_rpmdb_from_filesystem(fileobj, dest_dir):
+    """
+    extract rpm database from 'docker export' tarball
+
+    :param fileobj: file-like object with the tarball, doesn't have to be seekable
+    :param dest_dir: str, directory to extract into
+    :return: str, path of the rpm database within dest_dir
+    """
+    rootfs = tempfile.mkdtemp(dir=dest_dir, prefix='.rootfs-')
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as filesystem:
+            for member in filesystem:
+                name = _normalize(member.name)
+                if _in_rpmdb(name):
+                    _extract_member(filesystem, member, rootfs, name)
+        return _move_rpmdb(rootfs, dest_dir)
+    finally:
+        shutil.rmtree(rootfs)
+
+
+def _copy_rpmdb(rootfs, dest_dir):
+    for rpmdb_path in RPMDB_PATHS:
+        source = _local_path(rootfs, rpmdb_path)
+        if os.path.isdir(source) and os.listdir(source):
+            shutil.copytree(source, os.path.join(dest_dir, 'rpm'))
+            return
+
+
+def _move_rpmdb(rootfs, dest_dir):
+    for rpmdb_path in RPMDB_PATHS:
+        source = _local_path(rootfs, rpmdb_path)
+        if os.path.isdir(source) and os.listdir(source):
+            target = os.path.join(dest_dir, 'rpm')
+            os.rename(source, target)
+            return target
+    raise RpmdbError('no rpm database found in image')
+
+
+def query_rpmdb(dbpath, rpm_tags, sep):
+    """
+    list all packages in rpm database using rpm on the host
+
+    :param dbpath: str, path of the rpm database
+    :param rpm_tags: list of str, tags to output for each package
+    :param sep: str, separator of tags
+    :return: list of str, a line for each package
+    """
+    fmt = sep.join(["%%{%s}" % tag for tag in rpm_tags])
+    cmd = ['rpm', '--dbpath', os.path.abspath(dbpath), '-qa', '--qf', fmt + '\n']
+    logger.debug("querying rpm database '%s'", cmd)
+    output = subprocess.check_output(cmd)
+    if not isinstance(output, str):
+        output = output.decode('utf-8')
+    return [line for line in output.split('\n') if line]
+
+
+def parse_rpm_line(line, tags, separator=';'):
+    """
+    Parse a line of output of the rpm query.
+
+    :param line: str, package described by values of tags
+    :param tags: list, str fields used for query output
+    :param separator: str, separator of values
+    :return: dict describing the rpm package, None when the line is incomplete
+    """
+    fields = line.rstrip('\n').split(separator)
+    if len(fields) < len(tags):
+        return None
+
+    def field(tag):
+        """
+        Get a field value by name
+        """
+        try:
+            value = fields[tags.index(tag)]
+        except ValueError:
+            return None
+
+        if value == '(none)':
+            return None
+
+        return value
+
+    signature = field('SIGPGP:pgpsig') or field('SIGGPG:pgpsig')
+    if signature:
+        parts = signature.split('Key ID ', 1)
+        if len(parts) > 1:
+            signature = parts[1]
+
+    component_rpm = {
+        'type': 'rpm',
+        'name': field('NAME'),
+        'version': field('VERSION'),
+        'release': field('RELEASE'),
+        'arch': field('ARCH'),
+        'sigmd5': field('SIGMD5'),
+        'signature': signature,
+    }
+
+    # Special handling for epoch as it must be an integer or None
+    epoch = field('EPOCH')
+    if epoch is not None:
+        epoch = int(epoch)
+
+    component_rpm['epoch'] = epoch
+    return component_rpm
+
+
+def parse_rpm_output(output, tags, separator=';', known=None):
+    """
+    Parse output of the rpm query.
+
+    :param output: list, decoded output (str) from the rpm subprocess
+    :param tags: list, str fields used for query output
+    :param separator: str, separator of values
+    :param known: dict, line -> already parsed component (or None), it is
+                  updated with newly parsed lines
+    :return: list, dicts describing each rpm package
+    """
+    if known is None:
+        known = {}
+
+    components = []
+    for rpm in output:
+        line = rpm.rstrip('\n')
+        try:
+            component_rpm = known[line]
+        except KeyError:
+            component_rpm = known[line] = parse_rpm_line(line, tags, separator)
+
+        if component_rpm is not None and component_rpm['name'] != 'gpg-pubkey':
+            components.append(dict(component_rpm))
+
+    return components
+
+
+def get_image_layers_key(image_inspect):
+    """
+    :param image_inspect: dict, output of inspect_image
+    :return: str, identifies content of the image: hash of its ID and chain of
+             layer digests
+    """
+    layers = (image_inspect.get('RootFS') or {}).get('Layers') or []
+    content = '\n'.join([image_inspect['Id']] + layers)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get_base_image_key(workflow):
+    """
+    :param workflow: DockerBuildWorkflow instance
+    :return: str, see get_image_layers_key(), None when the base image is unknown
+    """
+    try:
+        return get_image_layers_key(workflow.base_image_inspect)
+    except (KeyError, AttributeError, TypeError) as ex:
+        logger.debug("base image unknown, not using its rpm list: %r", ex)
+        return None
+
+
+class RpmComponentCache(object):
+    """
+    Parsed package lists of images, keyed by get_image_layers_key().
+
+    The list of an image is parsed with help of the list of its base image:
+    only lines which aren't in the base image's list are parsed. Entries are
+    kept in memory and, when the cache has a directory, in JSON files there,
+    one per image, so builds on the same host share them.
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        :param cache_dir: str, directory to keep entries in, None to keep them in memory only
+        """
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        # (format digest, key) -> {'lines': [...], 'components': {line: component}}
+        self._entries = {}
+
+    @staticmethod
+    def _get_format_digest(tags, separator):
+        return hashlib.sha256(json.dumps([tags, separator]).encode('utf-8')).hexdigest()[:16]
+
+    def get_path(self, key, tags, separator=';'):
+        """
+        :return: str, path of the file with the entry, None when there's no cache dir
+        """
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, self._get_format_digest(tags, separator),
+                            key + '.json')
+
+    def load(self, key, tags, separator=';'):
+        """
+        :param key: str, see get_image_layers_key()
+        :param tags: list, str fields used for query output
+        :param separator: str, separator of values
+        :return: dict, 'lines' of rpm output and their parsed 'components'
+                 (line -> component), None when there's no entry
+        """
+        memory_key = (self._get_format_digest(tags, separator), key)
+        with self._lock:
+            entry = self._entries.get(memory_key)
+        if entry is not None:
+            return entry
+
+        path = self.get_path(key, tags, separator)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError) as ex:
+            logger.warning("can't load rpm list from %s: %r", path, ex)
+            return None
+
+        with self._lock:
+            self._entries[memory_key] = entry
+        return entry
+
+    def store(self, key, tags, separator, lines, components):
+        """
+        :param key: str, see get_image_layers_key()
+        :param tags: list, str fields used for query output
+        :param separator: str, separator of values
+        :param lines: list of str, rpm output
+        :param components: dict, line -> parsed component
+        """
+        entry = {
+            'lines': list(lines),
+            'components': dict((line, components[line]) for line in lines),
+        }
+        with self._lock:
+            self._entries[(self._get_format_digest(tags, separator), key)] = entry
+
+        path = self.get_path(key, tags, separator)
+        if not path:
+            return
+        try:
+            cache_dir = os.path.dirname(path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.rpms-')
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entry, cache_file)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as ex:
+            logger.warning("can't save rpm list to %s: %r", path, ex)
+
+    def get_components(self, output, tags, separator=';', key=None, base_key=None):
+        """
+        Parse output of the rpm query, reusing what is known about the image
+        and its base image, and remember the result for the image.
+
+        :param output: list, decoded output (str) from the rpm subprocess
+        :param tags: list, str fields used for query output
+        :param separator: str, separator of values
+        :param key: str, key of the image the output is of, None if unknown
+        :param base_key: str, key of its base image, None if unknown
+        :return: list, dicts describing each rpm package
+        """
+        lines = [line.rstrip('\n') for line in output]
+        base_entry = base_key and self.load(base_key, tags, separator)
+        entry = key and self.load(key, tags, separator)
+        known = {}
+        for known_entry in (base_entry, entry):
+            if known_entry:
+                known.update(known_entry['components'])
+
+        reused = sum(1 for line in lines if line in known)
+        components = parse_rpm_output(lines, tags, separator, known=known)
+        logger.debug("parsed %d rpms, %d known from cache", len(lines) - reused, reused)
+        if key and (not entry or entry['lines'] != lines):
+            self.store(key, tags, separator, lines, known)
+        return components
+
+
+_rpm_component_cache = None
+_rpm_component_cache_lock = threading.Lock()
+
+
+def get_rpm_component_cache():
+    """
+    get process-wide cache of parsed package lists; it's kept in the
+    directory specified by the ATOMIC_REACTOR_RPM_CACHE environment
+    variable, if set
+
+    :return: RpmComponentCache instance
+    """
+    global _rpm_component_cache
+    with _rpm_component_cache_lock:
+        if _rpm_component_cache is None:
+            _rpm_component_cache = RpmComponentCache(os.environ.get(RPM_CACHE_ENV))
+        return _rpm_component_cache
+
+
+def get_image_components(workflow, output, tags, separator=';'):
+    """
+    Parse output of the rpm query of the built image, using the cache of
+    parsed package lists of the image and its base image
+
+    :param workflow: DockerBuildWorkflow instance
+    :param output: list, decoded output (str) from the rpm subprocess
+    :param tags: list, str fields used for query output
+    :param separator: str, separator of values
+    :return: list, dicts describing each rpm package
+    """
+    key = None
+    if workflow.built_image_inspect:
+        key = get_image_layers_key(workflow.built_image_inspect)
+    elif workflow.builder.image_id:
+        key = workflow.builder.image_id.split(':')[-1]
+
+    return get_rpm_component_cache().get_components(output, tags, separator, key=key,
+                                                    base_key=get_base_image_key(workflow))
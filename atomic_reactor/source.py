@@ -21,6 +21,7 @@ except ImportError:
     from urllib.parse import urlparse
 
 from atomic_reactor import util
+from atomic_reactor.build_context import copy_tree
 
 
 logger = logging.getLogger(__name__)
@@ -77,7 +78,9 @@ class GitSource(Source):
         super(GitSource, self).__init__(provider, uri, dockerfile_path,
                 provider_params, tmpdir)
         self.git_commit = self.provider_params.get('git_commit', None)
-        self.lg = util.LazyGit(self.uri, self.git_commit, self.source_path)
+        self.git_cache_dir = self.provider_params.get('git_cache_dir', None)
+        self.lg = util.LazyGit(self.uri, self.git_commit, self.source_path,
+                               cache_dir=self.git_cache_dir)
 
     @property
     def commit_id(self):
@@ -103,21 +106,13 @@ class PathSource(Source):
             self.uri = 'file://' + self.uri
         self.schemeless_path = self.uri[len('file://'):]
         os.makedirs(self.source_path)
+        self._copied = False
 
     def get(self):
-        # work around the weird behaviour of copytree, which requires the top dir
-        #  to *not* exist
-        for f in os.listdir(self.schemeless_path):
-            old = os.path.join(self.schemeless_path, f)
-            new = os.path.join(self.source_path, f)
-            if os.path.exists(new):
-                # this is the second invocation of this method; just break the loop
-                break
-            else:
-                if os.path.isdir(old):
-                    shutil.copytree(old, new)
-                else:
-                    shutil.copy2(old, new)
+        # the copy is made only once, build plugins modify it (e.g. the Dockerfile)
+        if not self._copied:
+            copy_tree(self.schemeless_path, self.source_path)
+            self._copied = True
         return self.source_path
 
 
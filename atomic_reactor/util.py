@@ -15,20 +15,29 @@ import os
 import re
 from pipes import quote
 import requests
+import requests.adapters
+import requests.auth
 import shutil
 import subprocess
 import tempfile
+import threading
 import logging
 import uuid
 import yaml
 import codecs
+import fcntl
 
 from atomic_reactor.constants import DOCKERFILE_FILENAME, TOOLS_USED, INSPECT_CONFIG
 
 from dockerfile_parse import DockerfileParser
+from dockerfile_parse.util import b2u
 from pkg_resources import resource_stream
 
 from importlib import import_module
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
 
 
 logger = logging.getLogger(__name__)
@@ -220,20 +229,93 @@ def wait_for_command(logs_generator):
     return cr
 
 
-def clone_git_repo(git_url, target_dir, commit=None):
+# directory to keep mirrors of git repositories in, there's no cache when not set
+GIT_CACHE_ENV = 'ATOMIC_REACTOR_GIT_CACHE'
+
+
+def get_git_mirror_path(cache_dir, git_url):
     """
-    clone provided git repo to target_dir, optionally checkout provided commit
+    :param cache_dir: str, directory with mirrors of git repositories
+    :param git_url: str, URL of the mirrored repo
+    :return: str, path of the bare mirror of git_url
+    """
+    url_hash = hashlib.sha256(git_url.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, url_hash[:2], url_hash + '.git')
 
-    :param git_url: str, git repo to clone
-    :param target_dir: str, filesystem path where the repo should be cloned
-    :param commit: str, commit to checkout, SHA-1 or ref
-    :return: str, commit ID of HEAD
+
+def update_git_mirror(git_url, cache_dir, commit=None, clone_to=None):
     """
-    commit = commit or "master"
-    logger.info("cloning git repo '%s'", git_url)
-    logger.debug("url = '%s', dir = '%s', commit = '%s'",
-                 git_url, target_dir, commit)
+    create or incrementally update bare mirror of git repo and resolve commit in it;
+    builds running at the same time wait for each other
+
+    :param git_url: str, git repo to mirror
+    :param cache_dir: str, directory with mirrors of git repositories
+    :param commit: str, commit to resolve, SHA-1 or ref, HEAD of the repo when None
+    :param clone_to: str, directory to clone the mirror into (without checkout)
+                     while it's locked; the clone doesn't depend on the mirror
+    :return: tuple, (str, path of the mirror, str, SHA-1 of commit)
+    """
+    mirror_path = get_git_mirror_path(cache_dir, git_url)
+    mirror_dir = os.path.dirname(mirror_path)
+    if not os.path.isdir(mirror_dir):
+        try:
+            os.makedirs(mirror_dir)
+        except OSError:
+            if not os.path.isdir(mirror_dir):
+                raise
 
+    with open(mirror_path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.path.isdir(mirror_path):
+                logger.info("updating mirror of git repo '%s'", git_url)
+                cmd = ["git", "--git-dir", mirror_path, "fetch", "--prune", "origin"]
+                logger.debug("fetching '%s'", cmd)
+                subprocess.check_call(cmd)
+            else:
+                logger.info("mirroring git repo '%s'", git_url)
+                tmp_path = tempfile.mkdtemp(dir=mirror_dir, suffix='.git.tmp')
+                try:
+                    cmd = ["git", "clone", "--mirror", git_url, tmp_path]
+                    logger.debug("cloning '%s'", cmd)
+                    subprocess.check_call(cmd)
+                    os.rename(tmp_path, mirror_path)
+                finally:
+                    if os.path.isdir(tmp_path):
+                        shutil.rmtree(tmp_path)
+
+            # refs, tags, full and abbreviated SHA-1 are all resolved the same way
+            cmd = ["git", "--git-dir", mirror_path, "rev-parse", "--verify",
+                   "{0}^{{commit}}".format(commit or "HEAD")]
+            logger.debug("resolving commit '%s'", cmd)
+            commit_id = subprocess.check_output(cmd).strip()
+
+            if clone_to:
+                # objects are copied from the mirror locally, nothing is transferred
+                # over network; other builds can't prune them from under the clone
+                # as the mirror is locked, and the clone keeps no reference to it
+                cmd = ["git", "clone", "--no-checkout", "--reference", mirror_path,
+                       "--dissociate", mirror_path, clone_to]
+                logger.debug("cloning from mirror '%s'", cmd)
+                subprocess.check_call(cmd)
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    if not isinstance(commit_id, str):
+        commit_id = commit_id.decode('ascii')
+    return mirror_path, commit_id
+
+
+def _clone_git_repo_from_mirror(git_url, target_dir, commit, cache_dir):
+    _, commit_id = update_git_mirror(git_url, cache_dir, commit, clone_to=target_dir)
+    cmd = ["git", "remote", "set-url", "origin", git_url]
+    subprocess.check_call(cmd, cwd=target_dir)
+    cmd = ["git", "reset", "--hard", commit_id]
+    logger.debug("checking out commit '%s'", cmd)
+    subprocess.check_call(cmd, cwd=target_dir)
+
+
+def _clone_git_repo(git_url, target_dir, commit):
     cmd = ["git", "clone", "-b", commit, "--depth", "1", git_url, quote(target_dir)]
     logger.debug("doing a shallow clone '%s'", cmd)
     try:
@@ -255,6 +337,35 @@ def clone_git_repo(git_url, target_dir, commit=None):
             cmd = ["git", "reset", "--hard", commit]
             logger.debug("checking out branch '%s'", cmd)
             subprocess.check_call(cmd, cwd=target_dir)
+
+
+def clone_git_repo(git_url, target_dir, commit=None, cache_dir=None):
+    """
+    clone provided git repo to target_dir, optionally checkout provided commit
+
+    When a cache directory is configured, the repo is cloned from its local
+    bare mirror, which is fetched incrementally first.
+
+    :param git_url: str, git repo to clone
+    :param target_dir: str, filesystem path where the repo should be cloned
+    :param commit: str, commit to checkout, SHA-1 or ref
+    :param cache_dir: str, directory with mirrors of git repositories; by default
+                      it's taken from $ATOMIC_REACTOR_GIT_CACHE, empty string
+                      disables it
+    :return: str, commit ID of HEAD
+    """
+    commit = commit or "master"
+    if cache_dir is None:
+        cache_dir = os.environ.get(GIT_CACHE_ENV)
+    logger.info("cloning git repo '%s'", git_url)
+    logger.debug("url = '%s', dir = '%s', commit = '%s'",
+                 git_url, target_dir, commit)
+
+    if cache_dir:
+        _clone_git_repo_from_mirror(git_url, target_dir, commit, cache_dir)
+    else:
+        _clone_git_repo(git_url, target_dir, commit)
+
     cmd = ["git", "rev-parse", "HEAD"]
     logger.debug("getting SHA-1 of provided ref '%s'", cmd)
     commit_id = subprocess.check_output(cmd, cwd=target_dir)
@@ -276,10 +387,12 @@ class LazyGit(object):
         lazy_git = LazyGit(git_url="...", tmpdir=tmp_dir)
         lazy_git.git_path
     """
-    def __init__(self, git_url, commit=None, tmpdir=None):
+    def __init__(self, git_url, commit=None, tmpdir=None, cache_dir=None):
         self.git_url = git_url
         # provided commit ID/reference to check out
         self.commit = commit
+        # directory with git mirrors, see clone_git_repo()
+        self.cache_dir = cache_dir
         # commit ID of HEAD; we'll figure this out ourselves
         self._commit_id = None
         self.provided_tmpdir = tmpdir
@@ -296,7 +409,8 @@ class LazyGit(object):
     @property
     def git_path(self):
         if self._git_path is None:
-            self._commit_id = clone_git_repo(self.git_url, self._tmpdir, self.commit)
+            self._commit_id = clone_git_repo(self.git_url, self._tmpdir, self.commit,
+                                             cache_dir=self.cache_dir)
             self._git_path = self._tmpdir
         return self._git_path
 
@@ -418,10 +532,135 @@ def _process_plugin_substitution(mapping, key_parts, value):
                            plugin_name, plugins_num)
 
 
+CHECKSUM_CACHE_ENV = 'ATOMIC_REACTOR_CHECKSUM_CACHE'
+
+
+class ChecksumCache(object):
+    """
+    Checksums of files keyed by file identity: path, device, inode, size
+    and modification time (in nanoseconds, where available). An entry is
+    used only while the identity of the file stays the same.
+
+    When created with a path, the cache is loaded from and saved to a JSON
+    file there, so it survives the process.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: str, JSON file to keep the cache in, None to keep it in memory only
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # realpath -> {'id': [dev, inode, size, mtime_ns], 'checksums': {...}}
+        self._entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as cache_file:
+                    self._entries = json.load(cache_file)
+            except (IOError, OSError, ValueError) as ex:
+                logger.warning("can't load checksum cache from %s: %r", path, ex)
+
+    @staticmethod
+    def get_file_id(path):
+        """
+        :param path: str, path to file
+        :return: tuple, (realpath, [device, inode, size, mtime_ns])
+        """
+        st = os.stat(path)
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 1e9)
+        return os.path.realpath(path), [st.st_dev, st.st_ino, st.st_size, mtime_ns]
+
+    def get(self, path):
+        """
+        :param path: str, path to file
+        :return: dict, known checksums of the file, same format as returned by get_checksums
+        """
+        realpath, file_id = self.get_file_id(path)
+        with self._lock:
+            entry = self._entries.get(realpath)
+            if entry is None or entry['id'] != file_id:
+                return {}
+            return dict(entry['checksums'])
+
+    def update(self, path, checksums):
+        """
+        remember checksums of a file, e.g. computed while writing it
+
+        :param path: str, path to file
+        :param checksums: dict, same format as returned by get_checksums
+        """
+        realpath, file_id = self.get_file_id(path)
+        with self._lock:
+            entry = self._entries.get(realpath)
+            if entry is None or entry['id'] != file_id:
+                entry = {'id': file_id, 'checksums': {}}
+                self._entries[realpath] = entry
+            entry['checksums'].update((key, value) for key, value in checksums.items()
+                                      if key.endswith('sum'))
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+
+        # drop entries of files which are gone
+        for realpath in list(self._entries):
+            if not os.path.exists(realpath):
+                del self._entries[realpath]
+        try:
+            cache_dir = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.checksums-')
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(self._entries, cache_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as ex:
+            logger.warning("can't save checksum cache to %s: %r", self.path, ex)
+
+
+_checksum_cache = None
+_checksum_cache_lock = threading.Lock()
+
+
+def get_checksum_cache():
+    """
+    get process-wide checksum cache; it's kept in the file specified by
+    the ATOMIC_REACTOR_CHECKSUM_CACHE environment variable, if set
+
+    :return: ChecksumCache instance
+    """
+    global _checksum_cache
+    with _checksum_cache_lock:
+        if _checksum_cache is None:
+            _checksum_cache = ChecksumCache(os.environ.get(CHECKSUM_CACHE_ENV))
+        return _checksum_cache
+
+
+# read files in big chunks, each one is fed to all hashes
+CHECKSUM_BLOCK_SIZE = 1024**2
+
+
+def _compute_checksums(path, algorithms):
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    with open(path, mode='rb') as f:
+        buf = f.read(CHECKSUM_BLOCK_SIZE)
+        while len(buf) > 0:
+            for hash_obj in hashes:
+                hash_obj.update(buf)
+            buf = f.read(CHECKSUM_BLOCK_SIZE)
+
+    return dict(('{0}sum'.format(algorithm), hash_obj.hexdigest())
+                for algorithm, hash_obj in zip(algorithms, hashes))
+
+
 def get_checksums(path, algorithms):
     """
     Compute a checksum(s) of given file using specified algorithms.
 
+    Checksums are remembered in the process-wide checksum cache, only those
+    not known yet for the file are computed, all in one read.
+
     :param path: path to file
     :param algorithms: list of cryptographic hash functions, currently supported: md5, sha256
     :return: dictionary
@@ -429,33 +668,81 @@ def get_checksums(path, algorithms):
     if not algorithms:
         return {}
 
-    compute_md5 = 'md5' in algorithms
-    compute_sha256 = 'sha256' in algorithms
-
-    if compute_md5:
-        md5 = hashlib.md5()
-    if compute_sha256:
-        sha256 = hashlib.sha256()
-    blocksize = 65536
-    with open(path, mode='rb') as f:
-        buf = f.read(blocksize)
-        while len(buf) > 0:
-            if compute_md5:
-                md5.update(buf)
-            if compute_sha256:
-                sha256.update(buf)
-            buf = f.read(blocksize)
+    cache = get_checksum_cache()
+    known = cache.get(path)
+    missing = [algorithm for algorithm in algorithms
+               if '{0}sum'.format(algorithm) not in known]
+    if missing:
+        computed = _compute_checksums(path, missing)
+        cache.update(path, computed)
+        known.update(computed)
+    else:
+        logger.debug('checksums of %s are known', path)
 
     checksums = {}
-    if compute_md5:
-        checksums['md5sum'] = md5.hexdigest()
-        logger.debug('md5sum: %s', checksums['md5sum'])
-    if compute_sha256:
-        checksums['sha256sum'] = sha256.hexdigest()
-        logger.debug('sha256sum: %s', checksums['sha256sum'])
+    for algorithm in algorithms:
+        key = '{0}sum'.format(algorithm)
+        checksums[key] = known[key]
+        logger.debug('%s: %s', key, checksums[key])
     return checksums
 
 
+class StreamChecksums(object):
+    """
+    Compute size and checksums of data as it passes through, so that
+    files don't have to be read again just to get their checksums.
+    """
+
+    def __init__(self, algorithms=('md5', 'sha256')):
+        """
+        :param algorithms: list of cryptographic hash functions, currently supported: md5, sha256
+        """
+        self._hashes = [(algorithm, hashlib.new(algorithm)) for algorithm in algorithms]
+        self.size = 0
+
+    def update(self, data):
+        for _, hash_obj in self._hashes:
+            hash_obj.update(data)
+        self.size += len(data)
+
+    @property
+    def checksums(self):
+        """
+        :return: dict, same format as returned by get_checksums
+        """
+        return dict(('{0}sum'.format(algorithm), hash_obj.hexdigest())
+                    for algorithm, hash_obj in self._hashes)
+
+
+class ChecksumWriter(object):
+    """
+    Writable file-like object passing data to another one, computing
+    checksums of everything written.
+    """
+
+    def __init__(self, fileobj, algorithms=('md5', 'sha256')):
+        """
+        :param fileobj: file-like object to write to
+        :param algorithms: list of cryptographic hash functions, see StreamChecksums
+        """
+        self.fileobj = fileobj
+        self.stream_checksums = StreamChecksums(algorithms)
+
+    def write(self, data):
+        self.stream_checksums.update(data)
+        self.fileobj.write(data)
+
+    def tell(self):
+        return self.stream_checksums.size
+
+    def flush(self):
+        self.fileobj.flush()
+
+    @property
+    def checksums(self):
+        return self.stream_checksums.checksums
+
+
 def get_docker_architecture(tasker):
     docker_version = tasker.get_version()
     host_arch = docker_version['Arch']
@@ -464,7 +751,15 @@ def get_docker_architecture(tasker):
     return (host_arch, docker_version['Version'])
 
 
-def get_exported_image_metadata(path):
+def get_exported_image_metadata(path, checksums=None):
+    """
+    Describe exported image for workflow.exported_image_sequence
+
+    :param path: str, path to image tarball
+    :param checksums: dict, md5sum and sha256sum of the file if already known
+                      (e.g. computed while writing it), to avoid reading it again
+    :return: dict
+    """
     logger.info('getting metadata for tarball %s', path)
     metadata = {'path': path}
     if not path or not os.path.isfile(path):
@@ -473,6 +768,8 @@ def get_exported_image_metadata(path):
 
     metadata['size'] = os.path.getsize(path)
     logger.debug('size: %d bytes', metadata['size'])
+    if checksums:
+        get_checksum_cache().update(path, checksums)
     metadata.update(get_checksums(path, ['md5', 'sha256']))
     return metadata
 
@@ -642,6 +939,176 @@ def get_manifest_media_type(version):
     return 'application/vnd.docker.distribution.manifest.{}+json'.format(version)
 
 
+# manifest types docker accepts when pulling, most preferred first
+PULL_MANIFEST_MEDIA_TYPES = (
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    get_manifest_media_type('v2'),
+    'application/vnd.docker.distribution.manifest.v1+prettyjws',
+    get_manifest_media_type('v1'),
+)
+
+
+_dockercfg_cache = {}
+_dockercfg_cache_lock = threading.Lock()
+
+
+def get_dockercfg_credentials(secret_path, docker_registry):
+    """
+    Get credentials for a registry from .dockercfg in secret_path; the file
+    is parsed only once, unless it changes
+
+    :param secret_path: str, dirname of .dockercfg location
+    :param docker_registry: str, registry (without scheme) to get credentials for
+    :return: dict, e.g. with 'username' and 'password' keys, may be empty
+    """
+    path = os.path.join(secret_path, '.dockercfg')
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+
+    with _dockercfg_cache_lock:
+        cached = _dockercfg_cache.get(secret_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, Dockercfg(secret_path))
+            _dockercfg_cache[secret_path] = cached
+
+    return cached[1].get_credentials(docker_registry)
+
+
+def parse_www_authenticate(header):
+    """
+    parse Bearer challenge from WWW-Authenticate response header
+
+    :param header: str, e.g. 'Bearer realm="https://auth/token",service="registry"'
+    :return: dict, challenge parameters (realm, service, scope) or None for other schemes
+    """
+    scheme, _, params = header.partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+
+    return dict(re.findall(r'(\w+)="([^"]*)"', params))
+
+
+class RegistrySession(object):
+    """
+    HTTP session for a docker registry: connections are kept alive and
+    reused, and bearer tokens of registries using token authentication are
+    cached and reused for further requests to the same repository.
+
+    Use get_registry_session to share sessions.
+    """
+
+    def __init__(self, registry, insecure=False, dockercfg_path=None,
+                 credentials_registry=None, pool_size=10):
+        """
+        :param registry: str, URI for registry, if URI schema is not provided,
+                              https:// will be used
+        :param insecure: bool, when True registry's cert is not verified
+        :param dockercfg_path: str, dirname of .dockercfg location
+        :param credentials_registry: str, name of registry in .dockercfg,
+                                     registry without schema by default
+        :param pool_size: int, how many connections may be kept open
+        """
+        if not re.match('http(s)?://', registry):
+            registry = 'https://{}'.format(registry)
+        self.registry = registry.rstrip('/')
+        self.insecure = insecure
+
+        self.auth = None
+        if dockercfg_path:
+            if credentials_registry is None:
+                credentials_registry = urlparse(self.registry).netloc
+            credentials = get_dockercfg_credentials(dockercfg_path, credentials_registry)
+            username = credentials.get('username')
+            password = credentials.get('password')
+            if username and password:
+                self.auth = requests.auth.HTTPBasicAuth(username, password)
+
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._tokens_lock = threading.Lock()
+        # (repository, method) -> bearer token
+        self._tokens = {}
+
+    def _get_token(self, challenge):
+        realm = challenge.pop('realm', None)
+        if not realm:
+            return None
+
+        logger.debug('requesting token from %s for %s', realm, challenge)
+        response = self._session.get(realm, params=challenge, auth=self.auth,
+                                     verify=not self.insecure)
+        response.raise_for_status()
+        token_response = response.json()
+        return token_response.get('token') or token_response.get('access_token')
+
+    def request(self, method, path, repository=None, headers=None, **kwargs):
+        """
+        :param method: str, HTTP method
+        :param path: str, path on the registry, e.g. '/v2/namespace/repo/manifests/latest'
+        :param repository: str, repository the request is for, tokens are cached per repository
+        :param headers: dict, request headers
+        :return: requests.Response object
+        """
+        url = '{}{}'.format(self.registry, path)
+        headers = dict(headers or {})
+        token_key = (repository, method)
+        with self._tokens_lock:
+            token = self._tokens.get(token_key)
+
+        def send(token):
+            auth = self.auth
+            if token:
+                headers['Authorization'] = 'Bearer {}'.format(token)
+                auth = None
+            return self._session.request(method, url, headers=headers, auth=auth,
+                                         verify=not self.insecure, **kwargs)
+
+        response = send(token)
+        if response.status_code == requests.codes.UNAUTHORIZED:
+            challenge = parse_www_authenticate(response.headers.get('WWW-Authenticate', ''))
+            if challenge:
+                token = self._get_token(challenge)
+                if token:
+                    with self._tokens_lock:
+                        self._tokens[token_key] = token
+                    response = send(token)
+
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+
+_registry_sessions = {}
+_registry_sessions_lock = threading.Lock()
+
+
+def get_registry_session(registry, insecure=False, dockercfg_path=None,
+                         credentials_registry=None):
+    """
+    get process-wide RegistrySession for registry, see RegistrySession for params
+
+    :return: RegistrySession instance
+    """
+    key = (registry, insecure, dockercfg_path, credentials_registry)
+    with _registry_sessions_lock:
+        session = _registry_sessions.get(key)
+        if session is None:
+            session = RegistrySession(registry, insecure=insecure,
+                                      dockercfg_path=dockercfg_path,
+                                      credentials_registry=credentials_registry)
+            _registry_sessions[key] = session
+        return session
+
+
 def query_registry(image, registry, digest=None, insecure=False, dockercfg_path=None,
                    version='v1', is_blob=False):
     """Return manifest digest for image.
@@ -657,34 +1124,57 @@ def query_registry(image, registry, digest=None, insecure=False, dockercfg_path=
 
     :return: requests.Response object
     """
-    auth = None
-    if dockercfg_path:
-        dockercfg = Dockercfg(dockercfg_path).get_credentials(image.registry)
-
-        username = dockercfg.get('username')
-        password = dockercfg.get('password')
-        if username and password:
-            auth = requests.auth.HTTPBasicAuth(username, password)
-
-    if not re.match('http(s)?://', registry):
-        registry = 'https://{}'.format(registry)
+    session = get_registry_session(registry, insecure=insecure,
+                                   dockercfg_path=dockercfg_path,
+                                   credentials_registry=image.registry)
 
     context = '/'.join([x for x in [image.namespace, image.repo] if x])
     reference = digest or image.tag or 'latest'
     object_type = 'manifests'
     if is_blob:
         object_type = 'blobs'
-    url = '{}/v2/{}/{}/{}'.format(registry, context, object_type, reference)
-    logger.debug("url: {}".format(url))
+    path = '/v2/{}/{}/{}'.format(context, object_type, reference)
+    logger.debug("url: {}{}".format(session.registry, path))
 
     headers = {'Accept': (get_manifest_media_type(version))}
-    kwargs = {'verify': not insecure, 'headers': headers, 'auth': auth}
-
-    response = requests.get(url, **kwargs)
+    response = session.get(path, repository=context, headers=headers)
     response.raise_for_status()
     return response
 
 
+def get_remote_manifest_digest(image, registry, insecure=False, dockercfg_path=None):
+    """Return digest of the manifest docker would pull for image.
+
+    Only the headers are requested, and the same manifest types are accepted
+    as by docker, so the digest matches what docker records in RepoDigests
+    when pulling the image.
+
+    :param image: ImageName, the remote image to inspect
+    :param registry: str, URI for registry, if URI schema is not provided,
+                          https:// will be used
+    :param insecure: bool, when True registry's cert is not verified
+    :param dockercfg_path: str, dirname of .dockercfg location
+
+    :return: str, digest, or None if the image is not in the registry
+    """
+    session = get_registry_session(registry, insecure=insecure,
+                                   dockercfg_path=dockercfg_path,
+                                   credentials_registry=image.registry)
+
+    context = '/'.join([x for x in [image.namespace, image.repo] if x])
+    path = '/v2/{}/manifests/{}'.format(context, image.tag or 'latest')
+    headers = {'Accept': ', '.join(PULL_MANIFEST_MEDIA_TYPES)}
+    response = session.request('HEAD', path, repository=context, headers=headers)
+    if response.status_code == requests.codes.not_found:
+        logger.debug('%s not found in %s', image, session.registry)
+        return None
+
+    response.raise_for_status()
+    digest = response.headers.get('Docker-Content-Digest')
+    logger.debug('%s has manifest digest %s', image, digest)
+    return digest
+
+
 def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
                          versions=('v1', 'v2')):
     """Return manifest digest for image.
@@ -763,11 +1253,151 @@ def get_config_from_registry(image, registry, digest, insecure=False,
 
     return blob_config
 
+def get_parent_env(base_image_inspect):
+    """
+    Get ENV of the parent image, to be inherited by Dockerfile
+
+    :param base_image_inspect: dict, inspection of the base image
+    :return: dict, parent ENV key:value pairs
+    """
+    p_env = {}
+    try:
+        tmp_env = base_image_inspect[INSPECT_CONFIG]["Env"]
+    except (TypeError, KeyError):
+        logger.debug("Parent Environment not found, not applied to Dockerfile")
+        return p_env
+
+    logger.debug("Parent Config ENV: %s" % tmp_env)
+
+    if isinstance(tmp_env, dict):
+        p_env = tmp_env
+    elif isinstance(tmp_env, list):
+        try:
+            for key_val in tmp_env:
+                key, val = key_val.split("=", 1)
+                p_env[key] = val
+
+        except ValueError:
+            logger.debug("Unable to parse all of Parent Config ENV")
+
+    return p_env
+
+
+class CachedDockerfileParser(DockerfileParser):
+    """
+    DockerfileParser which reads and parses Dockerfile only when it changes
+
+    Content is kept for as long as the file on disk stays the same (same inode,
+    size and modification time), writes through the parser update it in place.
+    Structure, labels, envs and base image are computed once per content and
+    parent ENV; the caller gets copies, so modifying them doesn't alter the cache.
+    """
+
+    def __init__(self, df_path, env_replace=True, parent_env=None):
+        """
+        :param df_path: string, path to Dockerfile or to directory with Dockerfile
+        :param env_replace: bool, replace ENV declarations as part of parsing
+        :param parent_env: dict, parent ENV key:value pairs to be inherited
+        """
+        self._lock = threading.RLock()
+        self._stat = None
+        self._content = None
+        self._parsed = {}
+        self._parent_env = {}
+        try:
+            super(CachedDockerfileParser, self).__init__(df_path, env_replace=env_replace,
+                                                         parent_env=parent_env)
+        except TypeError:
+            logger.debug("Old version of dockerfile-parse detected, "
+                         "unable to set inherited parent ENVs")
+            super(CachedDockerfileParser, self).__init__(df_path, env_replace=env_replace)
+
+    def _get_stat(self):
+        st = os.stat(self.dockerfile_path)
+        return st.st_ino, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime)
+
+    def _get_content(self):
+        with self._lock:
+            try:
+                stat = self._get_stat()
+            except OSError as ex:
+                logger.error("Couldn't retrieve content of dockerfile: %r", ex)
+                raise
+
+            if self._content is None or stat != self._stat:
+                logger.debug("reading %s", self.dockerfile_path)
+                self._content = DockerfileParser.content.fget(self)
+                self._stat = stat
+                self._parsed = {}
+            return self._content
+
+    def _set_content(self, content):
+        with self._lock:
+            DockerfileParser.content.fset(self, content)
+            self._content = b2u(content)
+            self._stat = self._get_stat()
+            self._parsed = {}
+
+    def _get_lines(self):
+        return self._get_content().splitlines(True)
+
+    def _set_lines(self, lines):
+        self._set_content(''.join(b2u(line) for line in lines))
+
+    content = property(_get_content, _set_content)
+    lines = property(_get_lines, _set_lines)
+
+    def _get_parent_env(self):
+        return self._parent_env
+
+    def _set_parent_env(self, parent_env):
+        with self._lock:
+            if parent_env != getattr(self, '_parent_env', None):
+                self._parent_env = parent_env
+                self._parsed = {}
+
+    parent_env = property(_get_parent_env, _set_parent_env)
+
+    def _get_parsed(self, name):
+        with self._lock:
+            # make sure the content is still current
+            self._get_content()
+            key = (name, self.env_replace)
+            if key not in self._parsed:
+                self._parsed[key] = getattr(DockerfileParser, name).fget(self)
+            return self._parsed[key]
+
+    @property
+    def structure(self):
+        return [dict(instruction) for instruction in self._get_parsed('structure')]
+
+    def _copy_key_values(self, key_values):
+        if type(key_values) is dict:
+            return dict(key_values)
+        # bind the copy to this parser, so that writes to it update Dockerfile
+        return type(key_values)(key_values, self)
+
+    def _get_labels(self):
+        return self._copy_key_values(self._get_parsed('labels'))
+
+    def _get_envs(self):
+        return self._copy_key_values(self._get_parsed('envs'))
+
+    labels = property(_get_labels, DockerfileParser.labels.fset)
+    envs = property(_get_envs, DockerfileParser.envs.fset)
+    baseimage = property(lambda self: self._get_parsed('baseimage'),
+                         DockerfileParser.baseimage.fset)
+
+
 def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, parent_env=None):
     """
     Wrapper for dockerfile_parse's DockerfileParser that takes into account
     parent_env inheritance.
 
+    When workflow is provided (and neither cache_content nor parent_env is),
+    the Dockerfile parser shared by the workflow is returned, see
+    DockerBuildWorkflow.get_df_parser.
+
     :param df_path: string, path to Dockerfile (normally in DockerBuildWorkflow instance)
     :param workflow: DockerBuildWorkflow object instance, used to find parent image information
     :param cache_content: bool, tells DockerfileParser to cache Dockerfile content
@@ -785,31 +1415,19 @@ def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, par
 
     elif workflow:
 
+        get_workflow_df_parser = getattr(workflow, 'get_df_parser', None)
+        if get_workflow_df_parser is not None and not cache_content and env_replace:
+            return get_workflow_df_parser(df_path)
+
         # If parent_env is not provided, but workflow is then attempt to inspect
         # the workflow for the parent_env
 
         try:
-            parent_config = workflow.base_image_inspect[INSPECT_CONFIG]
+            base_image_inspect = workflow.base_image_inspect
         except (AttributeError, TypeError, KeyError):
             logger.debug("base image unable to be inspected")
         else:
-            try:
-                tmp_env = parent_config["Env"]
-                logger.debug("Parent Config ENV: %s" % tmp_env)
-
-                if isinstance(tmp_env, dict):
-                    p_env = tmp_env
-                elif isinstance(tmp_env, list):
-                    try:
-                        for key_val in tmp_env:
-                            key, val = key_val.split("=", 1)
-                            p_env[key] = val
-
-                    except ValueError:
-                        logger.debug("Unable to parse all of Parent Config ENV")
-
-            except KeyError:
-                logger.debug("Parent Environment not found, not applied to Dockerfile")
+            p_env = get_parent_env(base_image_inspect)
 
     try:
         dfparser = DockerfileParser(
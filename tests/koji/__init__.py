@@ -27,6 +27,18 @@ CHECKSUM_TYPES = {
 
 TASK_STATES.update({value: name for name, value in TASK_STATES.items()})
 
+class GenericError(Exception):
+    pass
+
+
+class AuthError(GenericError):
+    pass
+
+
+class AuthExpired(AuthError):
+    pass
+
+
 class ClientSession(object):
     def __init__(self, hub, opts=None):
         raise ImportError("No module named koji")
@@ -10,6 +10,7 @@ from __future__ import print_function, unicode_literals
 from textwrap import dedent
 from flexmock import flexmock
 
+import base64
 import pytest
 import os.path
 import responses
@@ -42,6 +43,7 @@ from atomic_reactor import koji_util, util
 from tests.constants import (MOCK_SOURCE, DOCKERFILE_GIT, DOCKERFILE_SHA1,
                              MOCK, IMPORTED_IMAGE_ID)
 from tests.fixtures import docker_tasker
+from tests.util import MockKojiMultiCallSession
 if MOCK:
     from tests.docker_mock import mock_docker
 
@@ -111,10 +113,16 @@ def mock_koji_session(koji_proxyuser=None, koji_ssl_certs_dir=None,
     session.should_receive('getTaskChildren').and_return([
         {'id': 1234568},
     ])
+    def _mockCallMethod(method, task_id, file_name, offset=0, size=-1):
+        assert method == 'downloadTaskOutput'
+        return base64.b64encode(b'tarball-contents'[offset:offset + size])
+
     if download_filesystem:
         session.should_receive('downloadTaskOutput').and_return('tarball-contents')
+        session.should_receive('callMethod').replace_with(_mockCallMethod)
     else:
         session.should_receive('downloadTaskOutput').never()
+        session.should_receive('callMethod').never()
     koji_auth_info = {
         'proxyuser': koji_proxyuser,
         'ssl_certs_dir': koji_ssl_certs_dir,
@@ -138,7 +146,7 @@ def mock_koji_session(koji_proxyuser=None, koji_ssl_certs_dir=None,
     (flexmock(koji)
         .should_receive('ClientSession')
         .once()
-        .and_return(session))
+        .and_return(MockKojiMultiCallSession(session)))
 
 
 def mock_image_build_file(tmpdir, contents=None):
@@ -237,6 +245,10 @@ def test_add_filesystem_plugin_generated(tmpdir, docker_tasker, scratch):
     plugin_result = results[PLUGIN_ADD_FILESYSTEM_KEY]
     assert 'base-image-id' in plugin_result
     assert 'filesystem-koji-task-id' in plugin_result
+    task_stats = plugin_result.pop('filesystem-koji-task-stats')
+    assert task_stats['task_id'] == FILESYSTEM_TASK_ID
+    assert task_stats['state'] == 'CLOSED'
+    assert task_stats['polls'] == 1
     assert plugin_result == expected_results
 
 
@@ -547,6 +559,60 @@ def test_build_filesystem_from_task_id(tmpdir, prefix, architecture, suffix):
     assert match.group(0) == pattern
 
 
+def test_find_filesystem_in_sub_tasks(tmpdir):
+    plugin = create_plugin_instance(tmpdir)
+    outputs = {
+        1: ['image-build.log'],
+        2: ['oz.log'],
+        3: ['oz.log'],
+        4: ['oz.log'],
+        5: ['fedora-23-1.0.x86_64.tar.gz'],
+    }
+    children = {1: [2, 3], 2: [4], 3: [5], 4: [], 5: []}
+
+    session = flexmock()
+    session.should_receive('listTaskOutput').replace_with(lambda task_id: outputs[task_id])
+    (session.should_receive('getTaskChildren')
+        .replace_with(lambda task_id: [{'id': child} for child in children[task_id]]))
+    plugin.session = MockKojiMultiCallSession(session)
+
+    found = plugin.find_filesystem(1, plugin.get_filesystem_regex('fedora-23'))
+    assert found == (5, 'fedora-23-1.0.x86_64.tar.gz')
+    # one request per level of the task tree
+    assert plugin.session.multicalls == [2, 4, 4]
+
+    outputs[5] = ['oz.log']
+    assert plugin.find_filesystem(1, plugin.get_filesystem_regex('fedora-23')) is None
+
+
+def test_download_filesystem_cached(tmpdir):
+    cache_dir = str(tmpdir.mkdir('cache'))
+    mock_koji_session()
+    plugin = create_plugin_instance(tmpdir, {
+        'blocksize': 4,
+        'prefetch_blocks': 3,
+        'download_cache_dir': cache_dir,
+    })
+    plugin.session = koji.ClientSession(KOJI_HUB)
+    filesystem_regex = plugin.get_filesystem_regex('fedora-23')
+
+    contents = list(plugin.download_filesystem(FILESYSTEM_TASK_ID, filesystem_regex))
+    assert contents == [b'tarb', b'all-', b'cont', b'ents']
+
+    cache_path = koji_util.get_task_output_cache_path(cache_dir, KOJI_HUB, FILESYSTEM_TASK_ID,
+                                                      'fedora-23-1.0.x86_64.tar.gz')
+    with open(cache_path, 'rb') as f:
+        assert f.read() == b''.join(contents)
+
+    # later downloads are read from cache
+    plugin.session = flexmock()
+    plugin.session.should_receive('listTaskOutput').and_return(['fedora-23-1.0.x86_64.tar.gz'])
+    plugin.session.should_receive('getTaskChildren').and_return([])
+    plugin.session = MockKojiMultiCallSession(plugin.session)
+    assert b''.join(plugin.download_filesystem(FILESYSTEM_TASK_ID, filesystem_regex)) == \
+        b''.join(contents)
+
+
 @pytest.mark.parametrize(('architecture', 'architectures', 'download_filesystem'), [
     ('x86_64', None, True),
     (None, ['x86_64'], False),
@@ -29,6 +29,7 @@ except ImportError:
 from atomic_reactor.plugins.pre_bump_release import BumpReleasePlugin
 from atomic_reactor.util import df_parser
 from flexmock import flexmock
+from tests.util import MockKojiMultiCallSession
 import pytest
 
 
@@ -140,7 +141,7 @@ class TestBumpRelease(object):
                 return True
 
         session = MockedClientSession('')
-        flexmock(koji, ClientSession=session)
+        flexmock(koji).should_receive('ClientSession').and_return(MockKojiMultiCallSession(session))
 
         labels = {}
         labels.update(component)
@@ -166,3 +167,31 @@ class TestBumpRelease(object):
             assert 'Release' not in parser.labels
         else:
             assert parser.labels['Release'] == next_release['expected']
+
+    @pytest.mark.parametrize(('release_window', 'existing', 'expected', 'requests'), [
+        (10, 0, '5', [10]),
+        (10, 3, '8', [10]),
+        (10, 12, '17', [10, 10]),
+        (1, 2, '7', [1, 1, 1]),
+    ])
+    def test_release_window(self, tmpdir, release_window, existing, expected, requests):
+        session = flexmock()
+        session.should_receive('getNextRelease').and_return('5')
+
+        def get_build(build_info):
+            if int(build_info['release']) < 5 + existing:
+                return {'release': build_info['release']}
+            return None
+
+        session.should_receive('getBuild').replace_with(get_build)
+        session = MockKojiMultiCallSession(session)
+        flexmock(koji).should_receive('ClientSession').and_return(session)
+
+        plugin = self.prepare(tmpdir, labels={'com.redhat.component': 'component',
+                                              'version': '1.0'})
+        plugin.release_window = release_window
+        plugin.run()
+
+        parser = df_parser(plugin.workflow.builder.df_path, workflow=plugin.workflow)
+        assert parser.labels['release'] == expected
+        assert session.multicalls == requests
@@ -8,7 +8,7 @@ from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner
 from atomic_reactor.plugins.post_compress import CompressPlugin
-from atomic_reactor.util import ImageName
+from atomic_reactor.util import ImageName, get_checksums
 
 from tests.constants import INPUT_IMAGE, MOCK
 
@@ -38,7 +38,13 @@ class TestCompress(object):
         ('lzma', False, 'xz'),
         ('gzip', True, 'gz'),
     ])
-    def test_compress(self, tmpdir, caplog, method, load_exported_image, extension):
+    @pytest.mark.parametrize('threads, level', [
+        (None, None),
+        (1, None),
+        (2, 1),
+    ])
+    def test_compress(self, tmpdir, caplog, method, load_exported_image, extension,
+                      threads, level):
         if MOCK:
             mock_docker()
 
@@ -59,11 +65,13 @@ class TestCompress(object):
                 'args': {
                     'method': method,
                     'load_exported_image': load_exported_image,
+                    'threads': threads,
+                    'level': level,
                 },
             }]
         )
 
-        runner.run()
+        result = runner.run()[CompressPlugin.key]
 
         compressed_img = os.path.join(
             workflow.source.tmpdir,
@@ -74,3 +82,26 @@ class TestCompress(object):
         assert 'uncompressed_size' in metadata
         assert isinstance(metadata['uncompressed_size'], integer_types)
         assert ", ratio: " in caplog.text()
+
+        checksums = get_checksums(compressed_img, ['md5', 'sha256'])
+        assert metadata['md5sum'] == checksums['md5sum']
+        assert metadata['sha256sum'] == checksums['sha256sum']
+        assert metadata['size'] == os.path.getsize(compressed_img)
+
+        assert result['method'] == method
+        assert result['threads'] >= 1
+        if threads is not None:
+            assert result['threads'] == threads
+        assert result['level'] == (level or 6)
+        assert result['uncompressed_size'] == metadata['uncompressed_size']
+        assert result['compressed_size'] == metadata['size']
+        assert result['duration'] >= 0
+        assert 'throughput' in result
+
+    def test_compress_single_thread_by_default(self):
+        if MOCK:
+            mock_docker()
+
+        workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+        # block-parallel compression changes the output, it's opt-in
+        assert CompressPlugin(DockerTasker(), workflow).threads == 1
@@ -106,9 +106,9 @@ def test_delete_from_registry_plugin(saved_digests, req_registries, tmpdir):
                 continue
             url = "https://" + reg + "/v2/" + tag.split(":")[0] + "/manifests/" + dig
             auth_type = requests.auth.HTTPBasicAuth if req_registries[reg] else None
-            (flexmock(requests)
-                .should_receive('delete')
-                .with_args(url, verify=bool, auth=auth_type)
+            (flexmock(requests.Session)
+                .should_receive('request')
+                .with_args('DELETE', url, headers=dict, verify=bool, auth=auth_type)
                 .once()
                 .and_return(flexmock(status_code=202)))
             deleted_digests.add(dig)
@@ -25,7 +25,7 @@ class MockDockerTasker(object):
     def inspect_image(self, name):
         return {}
 
-    def build_image_from_path(self):
+    def build_image_from_path(self, path, image, compression=None):
         return True
 
 class X(object):
@@ -42,7 +42,7 @@ class MockInsideBuilder(object):
         self.df_path = 'some'
         self.df_dir = 'some'
 
-        def simplegen(x, y):
+        def simplegen(x, y, compression=None):
             yield "some\u2018".encode('utf-8')
         flexmock(self.tasker, build_image_from_path=simplegen)
 
@@ -97,3 +97,23 @@ def test_build(is_failed):
         assert workflow.build_result.fail_reason == error
         assert '\\' not in workflow.plugins_errors['docker_api']
         assert error in workflow.plugins_errors['docker_api']
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_context_compression(compression):
+    flexmock(DockerfileParser, content='df_content')
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    (flexmock(fake_builder.tasker)
+        .should_receive('build_image_from_path')
+        .with_args('some', 'image', compression=compression)
+        .and_return(iter([b'some']))
+        .once())
+
+    buildstep_plugins = [{'name': 'docker_api', 'args': {'context_compression': compression}}]
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   buildstep_plugins=buildstep_plugins)
+    workflow.build_docker_image()
+
+    assert not workflow.build_result.is_failed()
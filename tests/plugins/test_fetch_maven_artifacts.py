@@ -36,6 +36,7 @@ from atomic_reactor.plugins.pre_fetch_maven_artifacts import FetchMavenArtifacts
 from atomic_reactor.util import ImageName
 from tests.constants import MOCK_SOURCE
 from tests.fixtures import docker_tasker  # noqa
+from tests.util import MockKojiMultiCallSession
 from textwrap import dedent
 
 
@@ -268,7 +269,7 @@ def mock_koji_session(koji_proxyuser=None, koji_ssl_certs_dir=None,
     (flexmock(koji)
         .should_receive('ClientSession')
         .once()
-        .and_return(session))
+        .and_return(MockKojiMultiCallSession(session)))
 
     def mock_get_build(nvr):
         if nvr == DEFAULT_KOJI_BUILD['nvr']:
@@ -376,6 +377,45 @@ def test_fetch_maven_artifacts(tmpdir, docker_tasker):
         assert os.path.exists(dest)
 
 
+@responses.activate  # noqa
+def test_fetch_maven_artifacts_cached(tmpdir, docker_tasker):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+
+    for build in ('build1', 'build2'):
+        build_dir = tmpdir.mkdir(build)
+        workflow = mock_workflow(build_dir)
+        mock_koji_session()
+        if build == 'build1':
+            mock_nvr_downloads()
+            mock_url_downloads()
+        mock_fetch_artifacts_by_nvr(str(build_dir))
+        mock_fetch_artifacts_by_url(str(build_dir))
+        runner = PreBuildPluginsRunner(
+            docker_tasker,
+            workflow,
+            [{
+                'name': FetchMavenArtifactsPlugin.key,
+                'args': {
+                    'koji_hub': KOJI_HUB,
+                    'koji_root': KOJI_ROOT,
+                    'max_parallel_downloads': 3,
+                    'download_cache_dir': cache_dir,
+                }
+            }]
+        )
+
+        results = runner.run()
+        plugin_result = results[FetchMavenArtifactsPlugin.key]
+        assert len(plugin_result) == len(DEFAULT_ARCHIVES) + len(DEFAULT_REMOTE_FILES)
+        for download in plugin_result:
+            dest = os.path.join(str(build_dir), FetchMavenArtifactsPlugin.DOWNLOAD_DIR,
+                                download.dest)
+            assert os.path.exists(dest)
+
+    # second build only links artifacts from cache
+    assert len(responses.calls) == len(DEFAULT_ARCHIVES) + len(DEFAULT_REMOTE_FILES)
+
+
 @pytest.mark.parametrize(('nvr_requests', 'expected'), (  # noqa
     ([
         {
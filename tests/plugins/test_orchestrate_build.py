@@ -57,7 +57,7 @@ class MockInsideBuilder(object):
         self.df_path = 'df_path'
         self.df_dir = 'df_dir'
 
-        def simplegen(x, y):
+        def simplegen(x, y, compression=None):
             yield "some\u2018".encode('utf-8')
         flexmock(self.tasker, build_image_from_path=simplegen)
 
@@ -471,6 +471,56 @@ def test_orchestrate_build_choose_clusters(tmpdir, clusters_x86_64,
         assert plat_annotations['build']['cluster-url'] == 'https://chosen_{}.com/'.format(platform)
 
 
+def test_orchestrate_build_probe_clusters_once(tmpdir):
+    workflow = mock_workflow(tmpdir)
+    mock_osbs()
+
+    platforms = ['x86_64', 'ppc64le', 'aarch64', 's390x']
+    mock_reactor_config(tmpdir, dict(
+        (platform, [{'name': '{}_{}'.format(platform, index), 'max_concurrent_builds': 3}
+                    for index in range(3)])
+        for platform in platforms
+    ))
+
+    # every cluster is queried exactly once and gets one OSBS instance
+    (flexmock(OSBS)
+        .should_receive('list_builds')
+        .and_return(range(2))
+        .times(len(platforms) * 3))
+    plugin = OrchestrateBuildPlugin(workflow.builder.tasker, workflow,
+                                    platforms=platforms,
+                                    build_kwargs=make_worker_build_kwargs(),
+                                    osbs_client_config=str(tmpdir))
+    plugin.probe_clusters(platforms)
+    for platform in platforms:
+        cluster_info = plugin.choose_cluster(platform)
+        assert cluster_info.platform == platform
+        assert cluster_info.cluster.name.startswith(platform)
+        assert cluster_info.osbs is plugin.choose_cluster(platform).osbs
+
+    assert len(plugin._osbs_clients) == len(platforms) * 3
+
+
+def test_orchestrate_build_cluster_load_expires(tmpdir, monkeypatch):
+    workflow = mock_workflow(tmpdir)
+    mock_osbs()
+    mock_reactor_config(tmpdir)
+
+    (flexmock(OSBS)
+        .should_receive('list_builds')
+        .and_return(range(2))
+        .times(2))
+    plugin = OrchestrateBuildPlugin(workflow.builder.tasker, workflow,
+                                    platforms=['x86_64'],
+                                    build_kwargs=make_worker_build_kwargs(),
+                                    osbs_client_config=str(tmpdir))
+    plugin.choose_cluster('x86_64')
+    plugin.choose_cluster('x86_64')
+
+    monkeypatch.setattr(OrchestrateBuildPlugin, 'CLUSTER_LOAD_TTL', 0)
+    plugin.choose_cluster('x86_64')
+
+
 def test_orchestrate_build_exclude_platforms(tmpdir):
     workflow = mock_workflow(tmpdir)
     mock_osbs()
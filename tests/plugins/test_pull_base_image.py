@@ -8,12 +8,17 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import docker
+from flexmock import flexmock
 import pytest
+import requests
 
 from atomic_reactor.core import DockerTasker
+from atomic_reactor.image_cache import get_image_cache
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PreBuildPluginsRunner, PluginFailedException
 from atomic_reactor.util import ImageName
+from atomic_reactor.plugins import pre_pull_base_image
 from atomic_reactor.plugins.pre_pull_base_image import PullBaseImagePlugin
 from tests.constants import MOCK, MOCK_SOURCE, LOCALHOST_REGISTRY
 
@@ -127,3 +132,156 @@ def test_pull_base_image_plugin(parent_registry, df_base, expected, not_expected
 def test_pull_base_wrong_registry():
     with pytest.raises(PluginFailedException):
         test_pull_base_image_plugin('localhost:1234', BASE_IMAGE_W_REGISTRY, [], [])
+
+
+@pytest.mark.parametrize(('local_digests', 'pulled'), [
+    (['{}@sha256:spam'.format(LOCALHOST_REGISTRY + '/busybox')], False),
+    (['{}@sha256:old'.format(LOCALHOST_REGISTRY + '/busybox')], True),
+    (None, True),
+])
+def test_pull_base_image_check_digest(monkeypatch, local_digests, pulled):
+    if MOCK:
+        mock_docker(remember_images=True)
+
+    def get_digest(image, registry, insecure=False, dockercfg_path=None):
+        assert registry == LOCALHOST_REGISTRY
+        assert insecure
+        return 'sha256:spam'
+
+    monkeypatch.setattr(pre_pull_base_image, 'get_remote_manifest_digest', get_digest)
+
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = MockBuilder()
+    workflow.builder.base_image = ImageName.parse(BASE_IMAGE)
+
+    if local_digests is None:
+        (flexmock(tasker)
+            .should_receive('inspect_image')
+            .and_raise(docker.errors.NotFound('not found',
+                                              flexmock(status_code=404, content=b'not found'))))
+    else:
+        (flexmock(tasker)
+            .should_receive('inspect_image')
+            .and_return({'RepoDigests': local_digests}))
+    (flexmock(tasker)
+        .should_receive('pull_image')
+        .with_args(ImageName.parse(BASE_IMAGE_W_REGISTRY), insecure=True)
+        .times(1 if pulled else 0))
+    flexmock(tasker).should_receive('tag_image').and_return(BASE_IMAGE).once()
+
+    runner = PreBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': PullBaseImagePlugin.key,
+            'args': {'parent_registry': LOCALHOST_REGISTRY, 'parent_registry_insecure': True,
+                     'check_digest': True}
+        }]
+    )
+    runner.run()
+
+    if pulled:
+        assert BASE_IMAGE_W_REGISTRY in workflow.pulled_base_images
+    else:
+        assert BASE_IMAGE_W_REGISTRY not in workflow.pulled_base_images
+    assert BASE_IMAGE in workflow.pulled_base_images
+
+
+@pytest.mark.parametrize('probe_fails', [False, True])
+def test_pull_base_image_check_digest_library(monkeypatch, probe_fails):
+    if MOCK:
+        mock_docker(remember_images=True)
+
+    probed = []
+    base_image = 'library-only:latest'
+    base_image_w_registry = LOCALHOST_REGISTRY + '/' + base_image
+    base_image_w_lib_reg = LOCALHOST_REGISTRY + '/library/' + base_image
+
+    def get_digest(image, registry, insecure=False, dockercfg_path=None):
+        probed.append(image.to_str())
+        if probe_fails:
+            raise requests.exceptions.ConnectionError('refused')
+        if image.namespace == 'library':
+            return 'sha256:spam'
+        return None
+
+    monkeypatch.setattr(pre_pull_base_image, 'get_remote_manifest_digest', get_digest)
+
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = MockBuilder()
+    workflow.builder.base_image = ImageName.parse(base_image)
+
+    runner = PreBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': PullBaseImagePlugin.key,
+            'args': {'parent_registry': LOCALHOST_REGISTRY, 'parent_registry_insecure': True,
+                     'check_digest': True}
+        }]
+    )
+    runner.run()
+
+    if probe_fails:
+        # falls back to pulling
+        assert probed == [base_image_w_registry]
+    else:
+        # the image is looked for in the library namespace without trying to pull it
+        assert probed == [base_image_w_registry, base_image_w_lib_reg]
+    assert base_image_w_lib_reg in workflow.pulled_base_images
+    assert base_image_w_registry not in workflow.pulled_base_images
+    assert tasker.image_exists(base_image)
+    tasker.remove_image(base_image)
+    tasker.remove_image(base_image_w_lib_reg)
+
+
+@pytest.mark.parametrize(('retained_id', 'ttl', 'pulled'), [
+    ('sha256:spam', 3600, False),
+    # the name now refers to a different image
+    ('sha256:old', 3600, True),
+    (None, 3600, True),
+    # retained images aren't trusted without a digest check by default
+    ('sha256:spam', None, True),
+])
+def test_pull_base_image_retained(tmpdir, retained_id, ttl, pulled):
+    if MOCK:
+        mock_docker(remember_images=True)
+
+    cache = get_image_cache(str(tmpdir))
+    if retained_id:
+        cache.record(BASE_IMAGE_W_REGISTRY, retained_id, 100)
+
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = MockBuilder()
+    workflow.builder.base_image = ImageName.parse(BASE_IMAGE)
+
+    (flexmock(tasker)
+        .should_receive('inspect_image')
+        .and_return({'Id': 'sha256:spam'}))
+    (flexmock(tasker)
+        .should_receive('pull_image')
+        .with_args(ImageName.parse(BASE_IMAGE_W_REGISTRY), insecure=True)
+        .times(1 if pulled else 0))
+    flexmock(tasker).should_receive('image_exists').and_return(True)
+    flexmock(tasker).should_receive('tag_image').and_return(BASE_IMAGE).once()
+    flexmock(cache).should_receive('touch').with_args(BASE_IMAGE_W_REGISTRY).times(
+        0 if pulled else 1)
+
+    args = {'parent_registry': LOCALHOST_REGISTRY, 'parent_registry_insecure': True,
+            'base_image_cache_dir': str(tmpdir)}
+    if ttl is not None:
+        args['base_image_cache_ttl'] = ttl
+    runner = PreBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': PullBaseImagePlugin.key,
+            'args': args,
+        }]
+    )
+    runner.run()
+
+    assert (BASE_IMAGE_W_REGISTRY in workflow.pulled_base_images) == pulled
@@ -16,12 +16,11 @@ from atomic_reactor.plugin import PostBuildPluginsRunner
 from atomic_reactor.util import ImageName
 try:
     import dockpulp
+    from atomic_reactor.plugins import post_push_to_pulp
     from atomic_reactor.plugins.post_push_to_pulp import PulpPushPlugin
 except (ImportError, SyntaxError):
     dockpulp = None
 
-import subprocess
-
 import pytest
 from flexmock import flexmock
 from tests.constants import INPUT_IMAGE, SOURCE, MOCK
@@ -105,8 +104,11 @@ def prepare(check_repo_retval=0, existing_layers=[],
          .with_args(list)
          .and_return(existing_layers))
     if subprocess_exceptions:
-        (flexmock(subprocess)
-         .should_receive("check_call")
+        (flexmock(post_push_to_pulp)
+         .should_receive("filter_tar")
+         .and_raise(Exception))
+        (flexmock(post_push_to_pulp)
+         .should_receive("compress_stream")
          .and_raise(Exception))
 
     mock_docker()
@@ -118,8 +120,8 @@ def prepare(check_repo_retval=0, existing_layers=[],
 @pytest.mark.parametrize(("existing_layers", "should_raise", "subprocess_exceptions"), [
     (None, True, False),               # mock dockpulp without getImageIdsExist method
     ([], True, False),                 # this will trigger remove dedup layers and pass
-    (['no-such-layer'], True, False),  # no such layer - tar command will fail
-    ([], True, True),                  # all subprocess.check_call will fail
+    (['no-such-layer'], True, False),  # no such layer - nothing is removed
+    ([], True, True),                  # filtering and compressing the tar will fail
 ])
 def test_pulp_dedup_layers(
         tmpdir, existing_layers, should_raise, monkeypatch, subprocess_exceptions):
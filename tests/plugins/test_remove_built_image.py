@@ -12,6 +12,7 @@ import flexmock
 import pytest
 
 from atomic_reactor.core import DockerTasker
+from atomic_reactor.image_cache import get_image_cache
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner
 from atomic_reactor.plugins.exit_remove_built_image import (GarbageCollectionPlugin,
@@ -82,3 +83,67 @@ class TestGarbageCollectionPlugin(object):
         image_set = set(removed_images)
         assert len(image_set) == len(removed_images)
         assert image_set == expected
+
+    def test_retain_base_images(self, tmpdir):
+        tasker, workflow = mock_environment()
+        cache = get_image_cache(str(tmpdir))
+        cache.record('old:latest', 'sha256:old', 100)
+        cache.record('older:latest', 'sha256:older', 100)
+        cache.touch('old:latest')
+
+        runner = PostBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': GarbageCollectionPlugin.key,
+                'args': {'base_image_cache_dir': str(tmpdir),
+                         'base_image_cache_size': 250},
+            }]
+        )
+        removed_images = []
+
+        def spy_remove_image(image_id, force=None):
+            removed_images.append(image_id)
+
+        flexmock(tasker, remove_image=spy_remove_image)
+        (flexmock(tasker)
+            .should_receive('inspect_image')
+            .with_args(IMPORTED_IMAGE_ID)
+            .and_return({'Id': 'sha256:base', 'VirtualSize': 100}))
+        runner.run()
+
+        # base image is kept, least recently used one is removed to fit the budget
+        assert removed_images == [INPUT_IMAGE, 'older:latest']
+        assert cache.get(IMPORTED_IMAGE_ID)['id'] == 'sha256:base'
+        assert cache.get('old:latest') is not None
+        assert cache.get('older:latest') is None
+
+    def test_retain_base_images_replaced(self, tmpdir):
+        tasker, workflow = mock_environment()
+        cache = get_image_cache(str(tmpdir))
+        # the base image was pulled again and its name refers to a newer image now
+        cache.record(IMPORTED_IMAGE_ID, 'sha256:previous', 100)
+
+        runner = PostBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': GarbageCollectionPlugin.key,
+                'args': {'base_image_cache_dir': str(tmpdir)},
+            }]
+        )
+        removed_images = []
+
+        def spy_remove_image(image_id, force=None):
+            removed_images.append(image_id)
+
+        flexmock(tasker, remove_image=spy_remove_image)
+        (flexmock(tasker)
+            .should_receive('inspect_image')
+            .with_args(IMPORTED_IMAGE_ID)
+            .and_return({'Id': 'sha256:base', 'VirtualSize': 100}))
+        runner.run()
+
+        assert removed_images == [INPUT_IMAGE, 'sha256:previous']
+        assert cache.get(IMPORTED_IMAGE_ID)['id'] == 'sha256:base'
+        assert cache.get('sha256:previous') is None
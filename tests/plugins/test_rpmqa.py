@@ -8,6 +8,9 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import io
+import os
+
 import docker
 from flexmock import flexmock
 import pytest
@@ -15,7 +18,10 @@ import pytest
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
+from atomic_reactor.plugins import post_rpmqa
 from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
+from atomic_reactor import rpm_util
+from atomic_reactor.rpm_util import RpmComponentCache, RpmdbError
 from atomic_reactor.util import ImageName
 from tests.constants import DOCKERFILE_GIT, MOCK
 if MOCK:
@@ -136,3 +142,124 @@ def test_dangling_volumes_removed(request):
     assert ("removing volume '%s'", u'conflict_exception') in fake_logger.infos
     assert ("removing volume '%s'", u'real_exception') in fake_logger.infos
     assert ('ignoring a conflict when removing volume %s', 'conflict_exception') in fake_logger.debugs
+
+
+@pytest.mark.parametrize('exported', [True, False])
+def test_rpmqa_plugin_reads_rpmdb(tmpdir, exported):
+    if MOCK:
+        mock_docker()
+
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(SOURCE, "test-image")
+    setattr(workflow, 'builder', X())
+    setattr(workflow.builder, 'image_id', TEST_IMAGE)
+    setattr(workflow.builder, 'base_image', ImageName(repo='fedora', tag='21'))
+    setattr(workflow.builder, "source", X())
+    setattr(workflow.builder.source, 'dockerfile_path', "/non/existent")
+    setattr(workflow.builder.source, 'path', "/non/existent")
+    if exported:
+        image_tar = tmpdir.join('image.tar')
+        image_tar.write('tarball')
+        workflow.exported_image_sequence.append({'path': str(image_tar)})
+    else:
+        (flexmock(tasker)
+            .should_receive('get_image')
+            .with_args(TEST_IMAGE)
+            .and_return(io.BytesIO(b'tarball'))
+            .once())
+
+    def extract(image_stream, dest_dir, **kwargs):
+        assert image_stream.read() == b'tarball'
+        assert not kwargs
+        return os.path.join(dest_dir, 'rpm')
+
+    flexmock(post_rpmqa).should_receive('extract_rpmdb_from_image').replace_with(extract)
+    (flexmock(post_rpmqa)
+        .should_receive('query_rpmdb')
+        .with_args(str, PostBuildRPMqaPlugin.rpm_tags, PostBuildRPMqaPlugin.sep)
+        .and_return(PACKAGE_LIST_WITH_AUTOGENERATED))
+    flexmock(tasker).should_receive('run').never()
+
+    runner = PostBuildPluginsRunner(tasker, workflow,
+                                    [{"name": PostBuildRPMqaPlugin.key,
+                                      "args": {'image_id': TEST_IMAGE}}])
+    results = runner.run()
+    assert results[PostBuildRPMqaPlugin.key] == PACKAGE_LIST
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_rpmqa_plugin_caches_base_image_rpms(tmpdir, monkeypatch, cached):
+    if MOCK:
+        mock_docker()
+
+    cache = RpmComponentCache(str(tmpdir.mkdir('cache')))
+    monkeypatch.setattr(rpm_util, '_rpm_component_cache', cache)
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(SOURCE, "test-image")
+    setattr(workflow, 'builder', X())
+    setattr(workflow.builder, 'image_id', TEST_IMAGE)
+    setattr(workflow.builder, 'base_image', ImageName(repo='fedora', tag='21'))
+    setattr(workflow.builder, "source", X())
+    setattr(workflow.builder.source, 'dockerfile_path', "/non/existent")
+    setattr(workflow.builder.source, 'path', "/non/existent")
+    workflow._base_image_inspect = {'Id': 'sha256:base',
+                                    'RootFS': {'Layers': ['sha256:a', 'sha256:b']}}
+    base_key = rpm_util.get_base_image_key(workflow)
+    base_list = PACKAGE_LIST[:1]
+    if cached:
+        cache.get_components(base_list, PostBuildRPMqaPlugin.rpm_tags,
+                             PostBuildRPMqaPlugin.sep, key=base_key)
+    flexmock(tasker).should_receive('get_image').and_return(io.BytesIO(b'tarball'))
+
+    def extract(image_stream, dest_dir, base_dest_dir=None, base_layer_count=0):
+        if cached:
+            assert base_dest_dir is None
+        else:
+            assert base_layer_count == 2
+            os.mkdir(os.path.join(base_dest_dir, 'rpm'))
+        return os.path.join(dest_dir, 'rpm')
+
+    def query(dbpath, rpm_tags, sep):
+        if '/base/' in dbpath:
+            return base_list
+        return PACKAGE_LIST
+
+    flexmock(post_rpmqa).should_receive('extract_rpmdb_from_image').replace_with(extract)
+    flexmock(post_rpmqa).should_receive('query_rpmdb').replace_with(query)
+
+    runner = PostBuildPluginsRunner(tasker, workflow,
+                                    [{"name": PostBuildRPMqaPlugin.key,
+                                      "args": {'image_id': TEST_IMAGE}}])
+    results = runner.run()
+    assert results[PostBuildRPMqaPlugin.key] == PACKAGE_LIST
+    entry = cache.load(base_key, PostBuildRPMqaPlugin.rpm_tags, PostBuildRPMqaPlugin.sep)
+    assert entry['lines'] == base_list
+
+
+@pytest.mark.parametrize('read_rpmdb', [True, False])
+def test_rpmqa_plugin_container_fallback(read_rpmdb):
+    if MOCK:
+        mock_docker()
+
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow(SOURCE, "test-image")
+    setattr(workflow, 'builder', X())
+    setattr(workflow.builder, 'image_id', TEST_IMAGE)
+    setattr(workflow.builder, 'base_image', ImageName(repo='fedora', tag='21'))
+    setattr(workflow.builder, "source", X())
+    setattr(workflow.builder.source, 'dockerfile_path', "/non/existent")
+    setattr(workflow.builder.source, 'path', "/non/existent")
+
+    (flexmock(post_rpmqa)
+        .should_receive('extract_rpmdb_from_image')
+        .and_raise(RpmdbError)
+        .times(1 if read_rpmdb else 0))
+    flexmock(tasker).should_receive('get_image').and_return(io.BytesIO(b''))
+    flexmock(docker.Client, logs=mock_logs)
+
+    runner = PostBuildPluginsRunner(tasker, workflow,
+                                    [{"name": PostBuildRPMqaPlugin.key,
+                                      "args": {'image_id': TEST_IMAGE,
+                                               'read_rpmdb': read_rpmdb}}])
+    results = runner.run()
+    assert results[PostBuildRPMqaPlugin.key] == PACKAGE_LIST
@@ -210,7 +210,7 @@ def test_tag_and_push_plugin(
     blob_config = requests.Response()
     (flexmock(blob_config, raise_for_status=lambda: None, json=response_json))
 
-    def custom_get(url, headers, **kwargs):
+    def custom_get(method, url, headers, **kwargs):
         if url == config_latest_url:
             if headers['Accept'] == 'application/vnd.docker.distribution.manifest.v1+json':
                 return config_response_config_v1
@@ -224,8 +224,8 @@ def test_tag_and_push_plugin(
         if url == blob_url:
             return blob_config
 
-    (flexmock(requests)
-        .should_receive('get')
+    (flexmock(requests.Session)
+        .should_receive('request')
         .replace_with(custom_get)
     )
 
@@ -265,3 +265,83 @@ def test_tag_and_push_plugin(
                 assert isinstance(workflow.push_conf.docker_registries[0].config, dict)
             else:
                 assert workflow.push_conf.docker_registries[0].config is None
+
+
+@pytest.mark.parametrize('fail_tag', [None, 'tag2'])
+def test_tag_and_push_concurrently(monkeypatch, fail_tag):
+    if MOCK:
+        mock_docker()
+
+    import threading
+    from atomic_reactor.plugins import post_tag_and_push
+
+    registries = {
+        LOCALHOST_REGISTRY: {'insecure': True},
+        DOCKER0_REGISTRY: {'insecure': True},
+    }
+    tags = ['tag1', 'tag2', 'tag3', 'tag4']
+
+    def run_plugin(max_parallel_pushes):
+        tasker = DockerTasker()
+        workflow = DockerBuildWorkflow({"provider": "git", "uri": "asd"}, TEST_IMAGE)
+        workflow.tag_conf.add_primary_images(['{}:{}'.format(TEST_IMAGE, tag) for tag in tags])
+        setattr(workflow, 'builder', X)
+
+        first_pushed = {}
+        lock = threading.Lock()
+
+        def tag_and_push_image(image_id, registry_image, **kwargs):
+            with lock:
+                if registry_image.registry not in first_pushed:
+                    # first push of a registry runs on its own
+                    assert registry_image.tag == tags[0]
+                    first_pushed[registry_image.registry] = True
+            if fail_tag and registry_image.tag == fail_tag:
+                raise RuntimeError('push failed')
+
+        def get_manifest_digests(registry_image, registry, insecure, secret):
+            assert registry_image.registry in first_pushed
+            return ManifestDigest(v1='v1-{}'.format(registry_image.tag),
+                                  v2='v2-{}'.format(registry_image.tag))
+
+        def get_config_from_registry(image, registry, digest, insecure, secret, version):
+            return {'image': image.to_str(), 'registry': registry, 'digest': digest}
+
+        flexmock(tasker, tag_and_push_image=tag_and_push_image)
+        monkeypatch.setattr(post_tag_and_push, 'get_manifest_digests', get_manifest_digests)
+        monkeypatch.setattr(post_tag_and_push, 'get_config_from_registry',
+                            get_config_from_registry)
+
+        runner = PostBuildPluginsRunner(tasker, workflow, [{
+            'name': TagAndPushPlugin.key,
+            'args': {
+                'registries': registries,
+                'max_parallel_pushes': max_parallel_pushes,
+            },
+        }])
+        results = runner.run()
+        removals = workflow.plugin_workspace.get('remove_built_image', {})
+        return results, workflow.push_conf, removals
+
+    if fail_tag:
+        from atomic_reactor.plugin import PluginFailedException
+        with pytest.raises(PluginFailedException):
+            run_plugin(3)
+        return
+
+    sequential_results, sequential_conf, sequential_removals = run_plugin(1)
+    results, push_conf, removals = run_plugin(3)
+
+    assert ([str(image) for image in results[TagAndPushPlugin.key]] ==
+            [str(image) for image in sequential_results[TagAndPushPlugin.key]])
+    assert len(push_conf.docker_registries) == 2
+    for registry, expected in zip(push_conf.docker_registries,
+                                  sequential_conf.docker_registries):
+        assert registry.uri == expected.uri
+        assert registry.insecure == expected.insecure
+        assert list(registry.digests) == list(expected.digests)
+        for tag, digests in registry.digests.items():
+            assert digests.v1 == expected.digests[tag].v1
+            assert digests.v2 == expected.digests[tag].v2
+        assert registry.config == expected.config
+    assert removals == sequential_removals
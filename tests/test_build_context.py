@@ -0,0 +1,197 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+from flexmock import flexmock
+
+from atomic_reactor import build_context
+from atomic_reactor.build_context import BuildContext, DockerIgnore, copy_file, copy_tree
+
+
+@pytest.mark.parametrize(('patterns', 'path', 'excluded'), [
+    (['*.log'], 'a.log', True),
+    (['*.log'], 'dir/a.log', False),
+    (['*/*.log'], 'dir/a.log', True),
+    (['**/*.log'], 'a.log', True),
+    (['**/*.log'], 'dir/sub/a.log', True),
+    (['tmp'], 'tmp/dir/file', True),
+    (['/tmp/'], 'tmp', True),
+    (['fil?'], 'file', True),
+    (['fil?'], 'fil/e', False),
+    (['[!a]x'], 'bx', True),
+    (['[!a]x'], 'ax', False),
+    (['# comment', ''], 'file', False),
+    (['build', '!build/keep'], 'build/file', True),
+    (['build', '!build/keep'], 'build/keep', False),
+    (['!build/keep', 'build'], 'build/keep', True),
+    (['*'], 'Dockerfile', False),
+    (['*'], '.dockerignore', False),
+])
+def test_dockerignore(patterns, path, excluded):
+    assert DockerIgnore(patterns).excludes(path) == excluded
+
+
+def test_dockerignore_excludes_dir():
+    assert DockerIgnore(['build']).excludes_dir('build')
+    # an exception may match something inside
+    assert not DockerIgnore(['build', '!build/keep']).excludes_dir('build')
+
+
+def test_dockerignore_from_dir(tmpdir):
+    assert not DockerIgnore.from_dir(str(tmpdir)).rules
+    tmpdir.join('.dockerignore').write('*.log\n')
+    assert DockerIgnore.from_dir(str(tmpdir)).excludes('a.log')
+
+
+@pytest.mark.parametrize('hardlink', [True, False])
+@pytest.mark.parametrize(('reflink', 'copy_file_range', 'expected'), [
+    (True, True, 'reflink'),
+    (False, True, 'copy_file_range'),
+    (False, False, 'chunks'),
+])
+def test_copy_file(tmpdir, hardlink, reflink, copy_file_range, expected):
+    src = tmpdir.join('src')
+    src.write('x' * (build_context.CHUNK_SIZE + 1))
+    src.chmod(0o751)
+    dst = tmpdir.join('dst')
+    dst.write('old')
+
+    def fake_copy(supported):
+        def copy(src_fd, dst_fd, *args):
+            if not supported:
+                return False
+            build_context._copy_chunks(src_fd, dst_fd)
+            return True
+        return copy
+
+    (flexmock(build_context)
+        .should_receive('_reflink')
+        .replace_with(fake_copy(reflink)))
+    (flexmock(build_context)
+        .should_receive('_copy_file_range')
+        .replace_with(fake_copy(copy_file_range)))
+
+    method = copy_file(str(src), str(dst), hardlink=hardlink)
+    assert method == ('hardlink' if hardlink else expected)
+    assert dst.read() == src.read()
+    assert dst.stat().mode == src.stat().mode
+    assert int(dst.mtime()) == int(src.mtime())
+    assert (dst.stat().ino == src.stat().ino) == hardlink
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_copy_tree(tmpdir, threads):
+    src = tmpdir.mkdir('src')
+    src.ensure('.git', 'config')
+    src.ensure('top')
+    src.ensure('context', 'Dockerfile')
+    src.ensure('context', 'debug.log')
+    src.join('context', '.dockerignore').write('*.log\n')
+    src.join('link').mksymlinkto('top')
+    dst = tmpdir.join('dst')
+
+    copied = copy_tree(str(src), str(dst), threads=threads)
+    # .dockerignore is applied only when the context is sent to docker daemon
+    assert sorted(copied) == [
+        '.git/config',
+        'context/.dockerignore',
+        'context/Dockerfile',
+        'context/debug.log',
+        'top',
+    ]
+    assert dst.join('link').readlink() == 'top'
+
+
+def make_context(tmpdir):
+    context = tmpdir.mkdir('context')
+    context.join('Dockerfile').write('FROM fedora\n')
+    context.join('big').write('x' * 3000)
+    context.ensure('sub', 'file')
+    context.ensure('logs', 'debug.log')
+    context.join('.dockerignore').write('logs\n')
+    context.join('link').mksymlinkto('big')
+    return context
+
+
+def read_tar(data, compression):
+    if compression == 'gzip':
+        data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+    assert len(data) % tarfile.RECORDSIZE == 0
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        members = dict((member.name, member) for member in tar.getmembers())
+        contents = dict((member.name, tar.extractfile(member).read())
+                        for member in members.values() if member.isreg())
+    return members, contents
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_build_context(tmpdir, compression):
+    context = make_context(tmpdir)
+    build_context = BuildContext(str(context), compression=compression, cache_dir='',
+                                 chunk_size=1024)
+    assert build_context.encoding == compression
+
+    chunks = list(build_context)
+    if compression is None:
+        # only the end-of-archive padding may be bigger
+        assert len(chunks) > 1
+        assert max(len(chunk) for chunk in chunks[:-1]) < 2 * 1024
+    members, contents = read_tar(b''.join(chunks), compression)
+
+    assert sorted(members) == ['.dockerignore', 'Dockerfile', 'big', 'link', 'sub', 'sub/file']
+    assert members['link'].issym() and members['link'].linkname == 'big'
+    assert members['sub'].isdir()
+    assert contents['big'] == b'x' * 3000
+    assert contents['Dockerfile'] == b'FROM fedora\n'
+
+
+def test_build_context_unsupported_compression(tmpdir):
+    with pytest.raises(RuntimeError):
+        BuildContext(str(tmpdir), compression='lzma')
+
+
+@pytest.mark.parametrize('from_env', [True, False])
+def test_build_context_cache(tmpdir, monkeypatch, from_env):
+    context = make_context(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    if from_env:
+        monkeypatch.setenv(build_context.BUILD_CONTEXT_CACHE_ENV, cache_dir)
+        kwargs = {}
+    else:
+        kwargs = {'cache_dir': cache_dir}
+
+    data = b''.join(BuildContext(str(context), **kwargs))
+    assert len(os.listdir(cache_dir)) == 1
+
+    # only the tar of changed directory is generated, unchanged one is read from cache
+    (flexmock(BuildContext)
+        .should_call('_generate_tar')
+        .once())
+    assert b''.join(BuildContext(str(context), **kwargs)) == data
+
+    context.join('sub', 'file').write('changed')
+    members, contents = read_tar(b''.join(BuildContext(str(context), **kwargs)), None)
+    assert contents['sub/file'] == b'changed'
+    # stale tar was replaced
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_build_context_cache_incomplete(tmpdir):
+    context = make_context(tmpdir)
+    cache_dir = tmpdir.join('cache')
+    chunks = iter(BuildContext(str(context), cache_dir=str(cache_dir), chunk_size=1024))
+    next(chunks)
+    chunks.close()
+    assert cache_dir.listdir() == []
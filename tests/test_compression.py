@@ -0,0 +1,158 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+from flexmock import flexmock
+
+from atomic_reactor import compression
+from atomic_reactor.compression import (compress_stream, get_compressed_image_path, filter_tar,
+                                        get_compression_threads, lzma, zstandard)
+from atomic_reactor.util import get_checksums
+
+
+def read_gzip(path):
+    with gzip.open(path, 'rb') as fp:
+        return fp.read()
+
+
+def read_xz(path):
+    with lzma.open(path, 'rb') as fp:
+        return fp.read()
+
+
+def read_zstd(path):
+    # concatenated frames have to be decompressed one by one
+    data = b''
+    with open(path, 'rb') as fp:
+        reader = zstandard.ZstdDecompressor().stream_reader(fp, read_across_frames=True)
+        chunk = reader.read(1024**2)
+        while chunk:
+            data += chunk
+            chunk = reader.read(1024**2)
+    return data
+
+
+@pytest.mark.parametrize('method, extension, reader', [
+    ('gzip', 'gz', read_gzip),
+    ('lzma', 'xz', read_xz),
+    pytest.param('zstd', 'zst', read_zstd,
+                 marks=pytest.mark.skipif(zstandard is None,
+                                          reason='zstandard is not installed')),
+])
+@pytest.mark.parametrize('threads, level', [
+    (1, None),
+    (1, 1),
+    (4, None),
+    (3, 1),
+])
+def test_compress_stream(tmpdir, method, extension, reader, threads, level):
+    data = os.urandom(1024) * 3000
+    outfile = get_compressed_image_path(str(tmpdir), method)
+    assert outfile.endswith('.' + extension)
+
+    metadata = compress_stream(io.BytesIO(data), outfile, method, chunk_size=4096,
+                               threads=threads, level=level, block_size=256 * 1024)
+    assert metadata['path'] == outfile
+    assert metadata['uncompressed_size'] == len(data)
+    assert metadata['size'] == os.path.getsize(outfile)
+    checksums = get_checksums(outfile, ['md5', 'sha256'])
+    assert metadata['md5sum'] == checksums['md5sum']
+    assert metadata['sha256sum'] == checksums['sha256sum']
+
+    assert reader(outfile) == data
+
+
+def test_unsupported_method(tmpdir):
+    with pytest.raises(RuntimeError):
+        get_compressed_image_path(str(tmpdir), 'zip')
+
+
+@pytest.mark.skipif(zstandard is not None, reason='zstandard is installed')
+def test_zstd_unavailable(tmpdir):
+    with pytest.raises(RuntimeError):
+        compress_stream(io.BytesIO(b'abc'), os.path.join(str(tmpdir), 'x.zst'), 'zstd')
+
+
+@pytest.mark.parametrize('threads, cpus, expected', [
+    (None, 8, 8),
+    (2, 8, 2),
+    (0, 8, 1),
+])
+def test_get_compression_threads(threads, cpus, expected):
+    flexmock(compression).should_receive('cpu_count').and_return(cpus)
+    assert get_compression_threads(threads) == expected
+
+
+def make_image_tar(path, compression_method=None):
+    members = {
+        'repositories': b'{}',
+        'layer1/json': b'{"id": "layer1"}',
+        'layer1/layer.tar': os.urandom(1024) * 100,
+        'layer2/json': b'{"id": "layer2"}',
+        'layer2/layer.tar': os.urandom(1024) * 100,
+    }
+    tar_path = path + '.tmp'
+    with tarfile.open(tar_path, mode='w') as tar:
+        for name in sorted(members):
+            if name.endswith('/json'):
+                info = tarfile.TarInfo(os.path.dirname(name))
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            info = tarfile.TarInfo(name)
+            info.size = len(members[name])
+            tar.addfile(info, io.BytesIO(members[name]))
+
+    with open(tar_path, 'rb') as stream:
+        if compression_method:
+            compress_stream(stream, path, compression_method, threads=2,
+                            block_size=64 * 1024)
+        else:
+            with open(path, 'wb') as fp:
+                fp.write(stream.read())
+    os.remove(tar_path)
+    return members
+
+
+@pytest.mark.parametrize('source_name, source_method', [
+    ('image.tar', None),
+    ('image.tar.gz', 'gzip'),
+    ('image.tar.xz', 'lzma'),
+])
+@pytest.mark.parametrize('threads', [1, 3])
+def test_filter_tar(tmpdir, source_name, source_method, threads):
+    source = os.path.join(str(tmpdir), source_name)
+    members = make_image_tar(source, source_method)
+    outfile = os.path.join(str(tmpdir), 'stripped.tar.gz')
+
+    metadata = filter_tar(source, outfile, ['layer1/layer.tar', './no-such-layer/layer.tar'],
+                          threads=threads)
+    assert metadata['removed'] == ['layer1/layer.tar']
+    assert metadata['size'] == os.path.getsize(outfile)
+    assert metadata['md5sum'] == get_checksums(outfile, ['md5'])['md5sum']
+
+    with tarfile.open(outfile, mode='r:gz') as tar:
+        names = tar.getnames()
+        assert 'layer1/layer.tar' not in names
+        assert 'layer1' in names
+        for name in members:
+            if name != 'layer1/layer.tar':
+                assert tar.extractfile(name).read() == members[name]
+
+
+def test_filter_tar_unknown_format(tmpdir):
+    source = os.path.join(str(tmpdir), 'image.zip')
+    open(source, 'w').close()
+    with pytest.raises(RuntimeError):
+        filter_tar(source, os.path.join(str(tmpdir), 'out.tar.gz'), [])
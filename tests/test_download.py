@@ -0,0 +1,257 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import os
+
+from flexmock import flexmock
+import pytest
+import requests
+import responses
+
+from atomic_reactor.download import (Downloader, DOWNLOAD_CACHE_ENV, DOWNLOAD_CACHE_SUBDIR,
+                                     evict_cache)
+
+
+URL = 'https://example.com/spam.jar'
+BODY = b'spam' * 1000
+CHECKSUMS = {
+    'md5': hashlib.md5(BODY).hexdigest(),
+    'sha256': hashlib.sha256(BODY).hexdigest(),
+}
+
+
+class InterruptedResponse(object):
+    """
+    response yielding part of data and then failing
+    """
+
+    def __init__(self, data, status_code=200, fail_after=None):
+        self.data = data
+        self.status_code = status_code
+        self.fail_after = fail_after
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        data = self.data if self.fail_after is None else self.data[:self.fail_after]
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+        if self.fail_after is not None:
+            raise requests.exceptions.ChunkedEncodingError('connection broken')
+
+    def close(self):
+        pass
+
+
+@responses.activate
+def test_download(tmpdir):
+    responses.add(responses.GET, URL, body=BODY)
+    dest = os.path.join(str(tmpdir), 'spam.jar')
+
+    result = Downloader(cache_dir='').download(URL, dest, CHECKSUMS)
+    assert result['size'] == len(BODY)
+    assert not result['cached']
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+
+
+@responses.activate
+def test_download_bad_checksum(tmpdir):
+    responses.add(responses.GET, URL, body=b'corrupted')
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    downloader = Downloader(cache_dir=cache_dir)
+
+    with pytest.raises(ValueError) as exc:
+        downloader.download(URL, os.path.join(str(tmpdir), 'spam.jar'), CHECKSUMS)
+    assert 'does not match expected checksum' in str(exc)
+    assert not os.path.exists(downloader.get_cache_path(CHECKSUMS))
+
+
+@pytest.mark.parametrize(('resume_status', 'resumed'), [
+    (206, True),
+    # server ignores Range header
+    (200, False),
+])
+def test_download_resume(tmpdir, resume_status, resumed):
+    downloader = Downloader(cache_dir='', chunk_size=100, retry_delay=0)
+    (flexmock(downloader.session)
+        .should_receive('get')
+        .with_args(URL, stream=True, headers={}, timeout=None)
+        .and_return(InterruptedResponse(BODY, fail_after=1000))
+        .once()
+        .ordered())
+    (flexmock(downloader.session)
+        .should_receive('get')
+        .with_args(URL, stream=True, headers={'Range': 'bytes=1000-'}, timeout=None)
+        .and_return(InterruptedResponse(BODY[1000:] if resumed else BODY,
+                                        status_code=resume_status))
+        .once()
+        .ordered())
+
+    dest = os.path.join(str(tmpdir), 'spam.jar')
+    result = downloader.download(URL, dest, CHECKSUMS)
+    assert result['size'] == len(BODY)
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_download_retries_exhausted(tmpdir):
+    downloader = Downloader(cache_dir='', chunk_size=100, retries=2, retry_delay=0)
+    (flexmock(downloader.session)
+        .should_receive('get')
+        .and_raise(requests.exceptions.ConnectionError('refused'))
+        .times(3))
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        downloader.download(URL, os.path.join(str(tmpdir), 'spam.jar'), CHECKSUMS)
+
+
+@responses.activate
+def test_download_client_error_not_retried(tmpdir):
+    responses.add(responses.GET, URL, status=404)
+    downloader = Downloader(cache_dir='', retry_delay=0)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        downloader.download(URL, os.path.join(str(tmpdir), 'spam.jar'), CHECKSUMS)
+    assert len(responses.calls) == 1
+
+
+@pytest.mark.parametrize('from_env', [True, False])
+@responses.activate
+def test_download_cache(tmpdir, monkeypatch, from_env):
+    responses.add(responses.GET, URL, body=BODY)
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    if from_env:
+        monkeypatch.setenv(DOWNLOAD_CACHE_ENV, cache_dir)
+        downloader = Downloader()
+    else:
+        downloader = Downloader(cache_dir=cache_dir)
+
+    downloads = [
+        (URL, os.path.join(str(tmpdir), 'build{}'.format(index), 'spam.jar'), CHECKSUMS)
+        for index in range(3)
+    ]
+    results = downloader.download_all(downloads[:1])
+    assert not results[0]['cached']
+
+    cache_path = downloader.get_cache_path(CHECKSUMS)
+    assert cache_path == os.path.join(cache_dir, DOWNLOAD_CACHE_SUBDIR, 'sha256',
+                                      CHECKSUMS['sha256'][:2], CHECKSUMS['sha256'])
+    assert os.path.isfile(cache_path)
+
+    downloader.max_parallel = 2
+    results = downloader.download_all(downloads[1:])
+    assert all(result['cached'] for result in results)
+    assert len(responses.calls) == 1
+    for _, dest, _ in downloads:
+        assert not os.path.samefile(dest, cache_path)
+        with open(dest, 'rb') as f:
+            assert f.read() == BODY
+
+    # modifying a file in a build doesn't change the cache
+    with open(downloads[0][1], 'ab') as f:
+        f.write(b'eggs')
+    with open(cache_path, 'rb') as f:
+        assert f.read() == BODY
+
+
+@responses.activate
+def test_download_cache_corrupted(tmpdir):
+    responses.add(responses.GET, URL, body=BODY)
+    downloader = Downloader(cache_dir=os.path.join(str(tmpdir), 'cache'))
+    dest = os.path.join(str(tmpdir), 'spam.jar')
+    downloader.download(URL, dest, CHECKSUMS)
+
+    cache_path = downloader.get_cache_path(CHECKSUMS)
+    with open(cache_path, 'wb') as f:
+        f.write(b'eggs')
+
+    result = downloader.download(URL, dest, CHECKSUMS)
+    assert not result['cached']
+    assert len(responses.calls) == 2
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+    with open(cache_path, 'rb') as f:
+        assert f.read() == BODY
+
+
+@responses.activate
+def test_download_cache_eviction(tmpdir):
+    bodies = [b'spam' * 100, b'eggs' * 100, b'ham' * 100]
+    downloader = Downloader(cache_dir=os.path.join(str(tmpdir), 'cache'),
+                            max_cache_size=2 * 400)
+    cache_paths = []
+    for index, body in enumerate(bodies):
+        url = 'https://example.com/{}.jar'.format(index)
+        responses.add(responses.GET, url, body=body)
+        checksums = {'sha256': hashlib.sha256(body).hexdigest()}
+        downloader.download(url, os.path.join(str(tmpdir), '{}.jar'.format(index)), checksums)
+        cache_path = downloader.get_cache_path(checksums)
+        # make the order of entries deterministic
+        os.utime(cache_path, (index, index))
+        cache_paths.append(cache_path)
+
+    # the least recently used file is gone
+    assert not os.path.exists(cache_paths[0])
+    assert os.path.exists(cache_paths[1])
+    assert os.path.exists(cache_paths[2])
+
+
+@responses.activate
+def test_download_cache_eviction_own_subdir(tmpdir):
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    # files of other users of the cache directory don't count towards the budget
+    other = os.path.join(cache_dir, 'koji-task-output', 'ab', 'abc')
+    os.makedirs(os.path.dirname(other))
+    with open(other, 'wb') as f:
+        f.write(b'x' * 1000)
+    os.utime(other, (0, 0))
+
+    responses.add(responses.GET, URL, body=BODY)
+    downloader = Downloader(cache_dir=cache_dir, max_cache_size=len(BODY))
+    downloader.download(URL, os.path.join(str(tmpdir), 'spam.jar'), CHECKSUMS)
+    assert os.path.exists(other)
+    assert os.path.exists(downloader.get_cache_path(CHECKSUMS))
+
+
+@responses.activate
+def test_download_uppercase_checksums(tmpdir):
+    responses.add(responses.GET, URL, body=BODY)
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    downloader = Downloader(cache_dir=cache_dir)
+    checksums = dict((algo, digest.upper()) for algo, digest in CHECKSUMS.items())
+    dest = os.path.join(str(tmpdir), 'spam.jar')
+
+    assert not downloader.download(URL, dest, checksums)['cached']
+    assert os.path.isfile(downloader.get_cache_path(CHECKSUMS))
+    assert downloader.download(URL, dest, checksums)['cached']
+    assert len(responses.calls) == 1
+
+
+def test_evict_cache(tmpdir):
+    paths = []
+    for index in range(4):
+        path = os.path.join(str(tmpdir), str(index % 2), str(index))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        os.utime(path, (index, index))
+        paths.append(path)
+    with open(os.path.join(str(tmpdir), '0', 'partial.tmp'), 'wb') as f:
+        f.write(b'x' * 100)
+
+    assert evict_cache(str(tmpdir), 100) == []
+    assert evict_cache(str(tmpdir), 20, keep=(paths[0], )) == paths[1:3]
+    assert os.path.exists(paths[0])
+    assert os.path.exists(paths[3])
+    assert os.path.exists(os.path.join(str(tmpdir), '0', 'partial.tmp'))
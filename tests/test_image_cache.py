@@ -0,0 +1,85 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import os
+
+from flexmock import flexmock
+
+from atomic_reactor import image_cache
+from atomic_reactor.image_cache import ImageCache, get_image_cache, IMAGE_CACHE_ENV
+
+
+def test_get_image_cache(tmpdir, monkeypatch):
+    monkeypatch.delenv(IMAGE_CACHE_ENV, raising=False)
+    assert get_image_cache() is None
+    assert get_image_cache('') is None
+
+    cache_dir = str(tmpdir)
+    monkeypatch.setenv(IMAGE_CACHE_ENV, cache_dir)
+    cache = get_image_cache()
+    assert cache.cache_dir == cache_dir
+    assert get_image_cache(cache_dir) is cache
+    assert get_image_cache('') is None
+
+
+def test_record(tmpdir):
+    cache_dir = os.path.join(str(tmpdir), 'images')
+    cache = ImageCache(cache_dir)
+    assert cache.get('busybox:latest') is None
+    assert not cache.touch('busybox:latest')
+
+    times = iter([1, 2])
+    flexmock(image_cache.time).should_receive('time').replace_with(lambda: next(times))
+    cache.record('busybox:latest', 'sha256:busybox', 100)
+    assert cache.get('busybox:latest') == {'id': 'sha256:busybox', 'size': 100,
+                                           'last_used': 1, 'pulled': 1}
+    assert cache.touch('busybox:latest')
+
+    # state is shared by all builds on the host
+    assert ImageCache(cache_dir).get('busybox:latest')['last_used'] == 2
+    assert ImageCache(cache_dir).get('busybox:latest')['pulled'] == 1
+
+    cache.forget(['busybox:latest', 'unknown'])
+    assert cache.get('busybox:latest') is None
+
+
+def test_get_evictions(tmpdir):
+    cache = ImageCache(str(tmpdir))
+    times = iter(range(10))
+    flexmock(image_cache.time).should_receive('time').replace_with(lambda: next(times))
+
+    cache.record('registry/fedora:25', 'sha256:fedora25', 300)
+    # the same image under two names is accounted for once
+    cache.record('registry/busybox:latest', 'sha256:busybox', 100)
+    cache.record('busybox:latest', 'sha256:busybox', 100)
+    cache.record('registry/fedora:26', 'sha256:fedora26', 300)
+    cache.touch('registry/fedora:25')
+
+    assert cache.get_evictions(700) == []
+    assert cache.get_evictions(600) == ['busybox:latest', 'registry/busybox:latest']
+    assert cache.get_evictions(400) == ['busybox:latest', 'registry/busybox:latest',
+                                        'registry/fedora:26']
+    # images in use are never evicted
+    assert cache.get_evictions(0, keep=['registry/fedora:25']) == [
+        'busybox:latest', 'registry/busybox:latest', 'registry/fedora:26']
+
+
+def test_record_replaced(tmpdir):
+    cache = ImageCache(str(tmpdir))
+    assert cache.record('busybox:latest', 'sha256:old', 100) is None
+    assert cache.record('registry/busybox:latest', 'sha256:old', 100) is None
+    # the old image is still retained under the other name
+    assert cache.record('busybox:latest', 'sha256:new', 100) is None
+
+    assert cache.record('registry/busybox:latest', 'sha256:new', 100) == 'sha256:old'
+    # the previous image is accounted for until it's removed
+    assert cache.get('sha256:old')['size'] == 100
+    assert cache.get_evictions(100, keep=['busybox:latest']) == ['sha256:old']
+    assert cache.record('busybox:latest', 'sha256:new', 100) is None
@@ -104,7 +104,7 @@ class MockInsideBuilder(object):
         self.df_path = 'some'
         self.df_dir = 'some'
 
-        def simplegen(x, y):
+        def simplegen(x, y, compression=None):
             yield "some"
         flexmock(self.tasker, build_image_from_path=simplegen)
 
@@ -25,12 +25,18 @@ except ImportError:
     del koji
     import koji
 
-from atomic_reactor.koji_util import (koji_login, create_koji_session,
-                                      TaskWatcher, tag_koji_build)
+from atomic_reactor.koji_util import (koji_login, create_koji_session, koji_multicall,
+                                      get_koji_session, KojiSessionPool,
+                                      TaskWatcher, wait_tasks, tag_koji_build,
+                                      BuildrootCache)
 from atomic_reactor import koji_util
 from atomic_reactor.plugin import BuildCanceledException
+from tests.util import MockKojiMultiCallSession
+import base64
 import flexmock
+import os
 import pytest
+import threading
 
 
 class TestKojiLogin(object):
@@ -106,6 +112,109 @@ class TestCreateKojiSession(object):
         assert create_koji_session(url, {}) == session
 
 
+class TestKojiSessionPool(object):
+    def test_sessions_shared(self):
+        url = 'https://example.com'
+        auth_info = {'krb_principal': 'user', 'krb_keytab': '/keytab'}
+        sessions = []
+
+        def new_session(hub_url, opts=None):
+            session = flexmock()
+            session.should_receive('krb_login').once().and_return(True)
+            sessions.append(session)
+            return session
+
+        flexmock(koji_util.koji).should_receive('ClientSession').replace_with(new_session)
+
+        workflow = flexmock()
+        session = get_koji_session(workflow, url, auth_info)
+        assert get_koji_session(workflow, url, dict(auth_info)) is session
+        assert get_koji_session(workflow, url, {'krb_principal': 'other',
+                                                'krb_keytab': '/keytab'}) is not session
+        assert get_koji_session(workflow, 'https://other.example.com', auth_info) is not session
+        assert get_koji_session(flexmock(), url, auth_info) is not session
+        assert len(sessions) == 4
+
+    def test_sessions_per_thread(self):
+        flexmock(koji_util.koji).should_receive('ClientSession').replace_with(
+            lambda hub_url, opts=None: flexmock())
+        pool = KojiSessionPool()
+        session = pool.get_session('https://example.com')
+        assert pool.get_session('https://example.com') is session
+
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(pool.get_session('https://example.com')))
+        thread.start()
+        thread.join()
+        # koji sessions are not thread-safe
+        assert other[0] is not session
+
+    @pytest.mark.parametrize(('user', 'expired'), [
+        ({'name': 'user'}, False),
+        (None, True),
+        (koji.AuthExpired('session expired'), True),
+    ])
+    def test_session_expired(self, monkeypatch, user, expired):
+        sessions = []
+        checks = []
+
+        def get_logged_in_user():
+            checks.append(True)
+            if isinstance(user, Exception):
+                raise user
+            return user
+
+        def new_session(hub_url, opts=None):
+            session = flexmock(getLoggedInUser=get_logged_in_user)
+            session.should_receive('krb_login').once().and_return(True)
+            sessions.append(session)
+            return session
+
+        flexmock(koji_util.koji).should_receive('ClientSession').replace_with(new_session)
+        pool = KojiSessionPool(check_interval=60)
+        now = [1000]
+        monkeypatch.setattr(koji_util.time, 'time', lambda: now[0])
+
+        session = pool.get_session('https://example.com', {})
+        # not checked before check_interval passes
+        assert pool.get_session('https://example.com', {}) is session
+        assert not checks
+
+        now[0] += 61
+        assert (pool.get_session('https://example.com', {}) is not session) == expired
+        assert len(checks) == 1
+        assert len(sessions) == (2 if expired else 1)
+
+
+class TestKojiMultiCall(object):
+    @pytest.mark.parametrize(('count', 'batch_size', 'requests'), [
+        (0, 100, []),
+        (5, 100, [5]),
+        (5, 2, [2, 2, 1]),
+    ])
+    def test_batches(self, count, batch_size, requests):
+        session = flexmock()
+        session.should_receive('getBuild').replace_with(lambda nvr: {'nvr': nvr})
+        session = MockKojiMultiCallSession(session)
+
+        calls = [('getBuild', ('build-1.0-{}'.format(index), ), {}) for index in range(count)]
+        results = koji_multicall(session, calls, batch_size=batch_size)
+        assert results == [{'nvr': 'build-1.0-{}'.format(index)} for index in range(count)]
+        assert session.multicalls == requests
+        assert not session.multicall
+
+    def test_kwargs(self):
+        session = flexmock()
+        (session.should_receive('listArchives')
+            .with_args(buildID=1, type='maven')
+            .and_return([]))
+        session = MockKojiMultiCallSession(session)
+
+        calls = [('listArchives', (), {'buildID': 1, 'type': 'maven'})]
+        assert koji_multicall(session, calls) == [[]]
+
+
 class TestStreamTaskOutput(object):
     def test_output_as_generator(self):
         contents = 'this is the simulated file contents'
@@ -122,6 +231,89 @@ class TestStreamTaskOutput(object):
         assert ''.join(list(streamer)) == contents
 
 
+    @pytest.mark.parametrize(('contents', 'prefetch', 'requests'), [
+        (b'', 3, [3]),
+        (b'abcdefghij', 2, [2, 2]),
+        # size is a multiple of blocksize
+        (b'abcdefghijkl', 3, [3, 3]),
+        (b'abcdefghijkl', 4, [4, 4]),
+    ])
+    def test_prefetch(self, contents, prefetch, requests):
+        blocksize = 3
+
+        def call_method(method, task_id, file_name, offset=0, size=-1):
+            assert (method, task_id, file_name) == ('downloadTaskOutput', 123, 'file.ext')
+            assert size == blocksize
+            return base64.b64encode(contents[offset:offset + size])
+
+        session = MockKojiMultiCallSession(flexmock(callMethod=call_method))
+        streamer = koji_util.stream_task_output(session, 123, 'file.ext', blocksize=blocksize,
+                                                prefetch=prefetch)
+        blocks = list(streamer)
+        assert b''.join(blocks) == contents
+        assert all(len(block) == blocksize for block in blocks[:-1])
+        assert session.multicalls == requests
+
+    @pytest.mark.parametrize('prefetch', [1, 2])
+    def test_cache(self, tmpdir, prefetch):
+        contents = b'this is the simulated file contents'
+        blocksize = 4
+
+        def download(task_id, file_name, offset, size):
+            return contents[offset:offset + size]
+
+        def call_method(method, task_id, file_name, offset=0, size=-1):
+            return base64.b64encode(download(task_id, file_name, offset, size))
+
+        session = MockKojiMultiCallSession(flexmock(downloadTaskOutput=download,
+                                                    callMethod=call_method))
+        cache_path = koji_util.get_task_output_cache_path(str(tmpdir), 'https://hub', 123,
+                                                          'file.ext')
+        assert cache_path.startswith(str(tmpdir))
+        assert cache_path != koji_util.get_task_output_cache_path(str(tmpdir), 'https://hub',
+                                                                  124, 'file.ext')
+
+        # interrupted download is not cached
+        streamer = koji_util.stream_task_output(session, 123, 'file.ext', blocksize=blocksize,
+                                                prefetch=prefetch, cache_path=cache_path)
+        next(streamer)
+        streamer.close()
+        assert not os.listdir(os.path.dirname(cache_path))
+
+        streamer = koji_util.stream_task_output(session, 123, 'file.ext', blocksize=blocksize,
+                                                prefetch=prefetch, cache_path=cache_path)
+        assert b''.join(streamer) == contents
+        with open(cache_path, 'rb') as f:
+            assert f.read() == contents
+
+        session = flexmock()
+        streamer = koji_util.stream_task_output(session, 123, 'file.ext', blocksize=blocksize,
+                                                prefetch=prefetch, cache_path=cache_path)
+        assert b''.join(streamer) == contents
+
+    def test_stream_task_output_cache_eviction(self, tmpdir):
+        contents = b'spam'
+
+        def download(task_id, file_name, offset, size):
+            return contents[offset:offset + size]
+
+        session = flexmock(downloadTaskOutput=download)
+        cache_paths = []
+        for task_id in range(3):
+            cache_path = koji_util.get_task_output_cache_path(str(tmpdir), 'https://hub',
+                                                              task_id, 'file.ext')
+            streamer = koji_util.stream_task_output(session, task_id, 'file.ext',
+                                                    cache_path=cache_path,
+                                                    max_cache_size=2 * len(contents))
+            assert b''.join(streamer) == contents
+            os.utime(cache_path, (task_id, task_id))
+            cache_paths.append(cache_path)
+
+        assert not os.path.exists(cache_paths[0])
+        assert os.path.exists(cache_paths[1])
+        assert os.path.exists(cache_paths[2])
+
+
 class TestTaskWatcher(object):
     @pytest.mark.parametrize(('finished', 'info', 'exp_state', 'exp_failed'), [
         ([False, False, True],
@@ -153,6 +345,63 @@ class TestTaskWatcher(object):
         assert task.wait() == exp_state
         assert task.failed() == exp_failed
 
+    @pytest.mark.parametrize(('kwargs', 'polls', 'expected_sleeps'), [
+        ({}, 7, [1, 2, 4, 8, 16, 32]),
+        ({}, 10, [1, 2, 4, 8, 16, 32, 60, 60, 60]),
+        ({'poll_interval': 1}, 6, [0.2, 0.4, 0.8, 1.6, 3.2]),
+        ({'min_poll_interval': 3, 'max_poll_interval': 10}, 5, [3, 6, 10, 10]),
+        ({'poll_interval': 0}, 3, [0, 0]),
+    ])
+    def test_wait_backoff(self, monkeypatch, kwargs, polls, expected_sleeps):
+        session = flexmock()
+        task_id = 1234
+        task_finished = session.should_receive('taskFinished').with_args(task_id)
+        for _ in range(polls - 1):
+            task_finished = task_finished.and_return(False)
+        task_finished.and_return(True)
+        (session.should_receive('getTaskInfo')
+            .with_args(task_id, request=True)
+            .and_return({'state': koji.TASK_STATES['CLOSED']}))
+
+        sleeps = []
+        monkeypatch.setattr(koji_util.time, 'sleep', sleeps.append)
+
+        task = TaskWatcher(session, task_id, **kwargs)
+        assert task.wait() == 'CLOSED'
+        assert sleeps == pytest.approx(expected_sleeps)
+        assert task.stats['polls'] == polls
+        assert task.stats['task_id'] == task_id
+        assert task.stats['state'] == 'CLOSED'
+        assert task.stats['wait_time'] >= 0
+
+    def test_wait_tasks(self, monkeypatch):
+        finished_after = {1: 1, 2: 3, 3: 2}
+        polled = dict((task_id, 0) for task_id in finished_after)
+
+        def task_finished(task_id):
+            polled[task_id] += 1
+            return polled[task_id] >= finished_after[task_id]
+
+        def get_task_info(task_id, request=False):
+            assert request
+            state = 'FAILED' if task_id == 3 else 'CLOSED'
+            return {'state': koji.TASK_STATES[state]}
+
+        session = flexmock(taskFinished=task_finished, getTaskInfo=get_task_info)
+        session = MockKojiMultiCallSession(session)
+        monkeypatch.setattr(koji_util.time, 'sleep', lambda seconds: None)
+
+        watchers = [TaskWatcher(session, task_id) for task_id in sorted(finished_after)]
+        assert wait_tasks(watchers) == ['CLOSED', 'CLOSED', 'FAILED']
+        # finished tasks are not polled any more
+        assert polled == finished_after
+        assert [watcher.polls for watcher in watchers] == [1, 3, 2]
+        assert [watcher.failed() for watcher in watchers] == [False, False, True]
+        # three polls of fewer tasks each, then one request for task info
+        assert session.multicalls == [3, 2, 1, 3]
+
+        assert wait_tasks([]) == []
+
     def test_cancel(self):
         session = flexmock()
         task_id = 1234
@@ -206,3 +455,48 @@ class TestTagKojiBuild(object):
         else:
             build_tag = tag_koji_build(session, build_id, target_name)
             assert build_tag == tag_name
+
+
+class TestBuildrootCache(object):
+    @pytest.mark.parametrize('from_env', [True, False])
+    def test_shared_between_builds(self, tmpdir, monkeypatch, from_env):
+        path = str(tmpdir.join('cache', 'buildroot.json'))
+        if from_env:
+            monkeypatch.setenv(koji_util.BUILDROOT_CACHE_ENV, path)
+            kwargs = {}
+        else:
+            kwargs = {'path': path}
+
+        cache = BuildrootCache('sha256:123', **kwargs)
+        assert cache.get('components', lambda: [{'name': 'bash'}]) == [{'name': 'bash'}]
+        # failures aren't cached
+        assert cache.get('tools', lambda: None) is None
+
+        def compute():
+            raise AssertionError('should be cached')
+
+        cache = BuildrootCache('sha256:123', **kwargs)
+        assert cache.get('components', compute) == [{'name': 'bash'}]
+        assert cache.get('tools', lambda: ['tool']) == ['tool']
+        assert BuildrootCache('sha256:123', **kwargs).get('tools', compute) == ['tool']
+
+    def test_other_builder_image(self, tmpdir):
+        path = str(tmpdir.join('buildroot.json'))
+        BuildrootCache('sha256:1', path).get('tools', lambda: ['old'])
+        cache = BuildrootCache('sha256:2', path)
+        assert cache.get('tools', lambda: ['new']) == ['new']
+
+    @pytest.mark.parametrize('builder_image_id', [None, ''])
+    def test_unknown_builder_image(self, tmpdir, builder_image_id):
+        path = tmpdir.join('buildroot.json')
+        BuildrootCache(builder_image_id, str(path)).get('tools', lambda: ['old'])
+        assert not path.check()
+
+    @pytest.mark.parametrize('content', ['', '{broken'])
+    def test_no_cache_file(self, tmpdir, content):
+        path = tmpdir.join('buildroot.json')
+        if content:
+            path.write(content)
+        cache = BuildrootCache('sha256:123', str(path) if content else '')
+        assert cache.get('tools', lambda: ['tool']) == ['tool']
+        assert cache.get('tools', lambda: ['other']) == ['tool']
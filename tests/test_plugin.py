@@ -8,13 +8,17 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import collections
 import json
 import os
+import sys
+import threading
 
 from dockerfile_parse import DockerfileParser
 from flexmock import flexmock
 import pytest
 
+import atomic_reactor.plugin
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.build import BuildResult
 from atomic_reactor.plugin import (BuildPluginsRunner, PreBuildPluginsRunner,
@@ -22,7 +26,9 @@ from atomic_reactor.plugin import (BuildPluginsRunner, PreBuildPluginsRunner,
                                    PluginFailedException, PrePublishPluginsRunner,
                                    ExitPluginsRunner, BuildStepPluginsRunner,
                                    PluginsRunner, InappropriateBuildStepError,
-                                   BuildStepPlugin, PreBuildPlugin)
+                                   BuildStepPlugin, PreBuildPlugin, PostBuildPlugin,
+                                   PluginRegistry, get_plugin_registry, scan_plugin_file,
+                                   BuildCanceledException, KOJI_SESSION)
 from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
 from atomic_reactor.plugins.pre_add_yum_repo_by_url import AddYumRepoByUrlPlugin
 from atomic_reactor.plugins.build_docker_api import DockerApiPlugin
@@ -101,6 +107,110 @@ class X(object):
     pass
 
 
+PLUGIN_FILE_TEMPLATE = """
+from atomic_reactor.plugin import PreBuildPlugin, PostBuildPlugin
+from atomic_reactor.constants import PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
+
+MY_KEY = 'my_post'
+
+{side_effect}
+
+
+class MyPre(PreBuildPlugin):
+    key = '{prefix}_pre'
+
+
+class MyPost(PostBuildPlugin):
+    key = MY_KEY
+
+
+class MyAlias(MyPost):
+    key = MyPost.key + '_alias'
+
+
+class MyUpload(PostBuildPlugin):
+    key = PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
+"""
+
+
+def write_plugin_file(tmpdir, name, side_effect=''):
+    path = tmpdir.join(name + '.py')
+    path.write(PLUGIN_FILE_TEMPLATE.format(prefix=name, side_effect=side_effect))
+    return str(path)
+
+
+def test_scan_plugin_file(tmpdir):
+    path = write_plugin_file(tmpdir, 'scanned')
+    classes = scan_plugin_file(path)
+    assert classes == [
+        {'name': 'MyPre', 'key': 'scanned_pre', 'bases': ['PreBuildPlugin']},
+        {'name': 'MyPost', 'key': 'my_post', 'bases': ['PostBuildPlugin']},
+        # not a simple expression, the module has to be imported
+        {'name': 'MyAlias', 'key': None, 'bases': ['PostBuildPlugin']},
+        {'name': 'MyUpload', 'key': 'koji_upload', 'bases': ['PostBuildPlugin']},
+    ]
+
+
+def test_load_plugins_lazily(tmpdir):
+    # importing this file would raise an exception
+    broken = write_plugin_file(tmpdir, 'broken', side_effect='raise ImportError("imported")')
+    ok = write_plugin_file(tmpdir, 'ok')
+    registry = PluginRegistry()
+
+    classes = registry.get_plugin_classes(PreBuildPlugin, plugin_files=[broken, ok])
+    assert classes['ok_pre'].__module__ == 'ok'
+    assert 'broken' not in sys.modules
+    # module is imported only once per registry
+    assert classes['ok_pre'] is registry.get_plugin_classes(PreBuildPlugin,
+                                                            plugin_files=[ok])['ok_pre']
+
+
+def test_load_plugins_override(tmpdir):
+    ok = write_plugin_file(tmpdir, 'override')
+    registry = PluginRegistry()
+
+    classes = registry.get_plugin_classes(PostBuildPlugin, plugin_files=[ok])
+    # last file wins, even when the key is only known after import
+    assert classes['koji_upload'].__module__ == 'override'
+    assert classes['my_post_alias'].__name__ == 'MyAlias'
+    assert 'no_such_plugin' not in classes
+    with pytest.raises(KeyError):
+        classes['no_such_plugin']
+
+
+def test_plugin_index(tmpdir):
+    path = write_plugin_file(tmpdir, 'indexed')
+    index_path = str(tmpdir.join('index.json'))
+    PluginRegistry().write_index(index_path, plugin_files=[path])
+    with open(index_path) as fp:
+        index = json.load(fp)
+    assert path in index['files']
+
+    registry = PluginRegistry(index_path)
+    flexmock(atomic_reactor.plugin).should_receive('scan_plugin_file').never()
+    classes = registry.get_plugin_classes(PreBuildPlugin, plugin_files=[path])
+    assert set(classes) >= set(['indexed_pre', 'pull_base_image'])
+
+
+def test_plugin_index_stale(tmpdir):
+    path = write_plugin_file(tmpdir, 'stale')
+    index_path = str(tmpdir.join('index.json'))
+    PluginRegistry().write_index(index_path, plugin_files=[path])
+    with open(path, 'a') as fp:
+        fp.write("""
+class MyNewPre(PreBuildPlugin):
+    key = 'new_pre'
+""")
+
+    registry = PluginRegistry(index_path)
+    classes = registry.get_plugin_classes(PreBuildPlugin, plugin_files=[path])
+    assert classes['new_pre'].__name__ == 'MyNewPre'
+
+
+def test_plugin_registry_is_shared():
+    assert get_plugin_registry() is get_plugin_registry()
+
+
 def test_prebuild_plugin_failure(docker_tasker):
     workflow = DockerBuildWorkflow(SOURCE, "test-image")
     setattr(workflow, 'builder', X())
@@ -267,6 +377,198 @@ def test_fallback_to_docker_build(docker_tasker):
     assert runner.plugins_conf == [{'name': 'docker_api', 'is_allowed_to_fail': False}]
 
 
+class ConcurrentPlugin(PostBuildPlugin):
+    key = None
+    reads = ()
+    writes = ()
+    is_allowed_to_fail = False
+    # shared by all plugins of a test, arguments are deep-copied
+    run_log = None
+    events = None
+
+    def __init__(self, tasker, workflow, wait_for=None, signal=None, fail=False, exit=False):
+        super(ConcurrentPlugin, self).__init__(tasker, workflow)
+        self.wait_for = wait_for
+        self.signal = signal
+        self.fail = fail
+        self.exit = exit
+
+    def run(self):
+        self.run_log.append(('start', self.key))
+        if isinstance(threading.current_thread(), threading._MainThread):
+            self.run_log.append(('main thread', self.key))
+        if self.exit:
+            raise SystemExit(1)
+        if self.wait_for is not None:
+            assert self.events[self.wait_for].wait(5)
+        if self.signal is not None:
+            self.events[self.signal].set()
+        self.run_log.append(('end', self.key))
+        if self.fail:
+            raise RuntimeError(self.key)
+        return self.key
+
+
+def mock_concurrent_plugins(*plugins, **kwargs):
+    """
+    :param plugins: list of tuples, (key, reads, writes, is_allowed_to_fail)
+    :param handles_cancel: list of str, keys of plugins handling cancellation
+    :return: list, log of plugins starting and finishing
+    """
+    log = []
+    events = collections.defaultdict(threading.Event)
+    classes = {}
+    for key, reads, writes, allowed_to_fail in plugins:
+        classes[key] = type(str(key), (ConcurrentPlugin, ),
+                            {'key': key, 'reads': reads, 'writes': writes,
+                             'is_allowed_to_fail': allowed_to_fail,
+                             'handles_cancel': key in kwargs.get('handles_cancel', ()),
+                             'run_log': log, 'events': events})
+    flexmock(PluginsRunner, load_plugins=lambda x: classes)
+    return log
+
+
+def test_concurrent_plugins_independent(tmpdir, docker_tasker):
+    workflow = mock_workflow(tmpdir)
+    log = mock_concurrent_plugins(('first', (), (), False), ('second', (), (), False))
+    # first plugin can only finish once the second one ran
+    runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                    [{'name': 'first', 'args': {'wait_for': 'e'}},
+                                     {'name': 'second', 'args': {'signal': 'e'}}],
+                                    max_parallel_plugins=2)
+    results = runner.run()
+    assert results == {'first': 'first', 'second': 'second'}
+    assert log.index(('end', 'second')) < log.index(('end', 'first'))
+    assert set(workflow.plugins_durations) == set(['first', 'second'])
+
+
+@pytest.mark.parametrize(('second_reads', 'second_writes'), [
+    (('tag_conf', ), ()),
+    ((), ('tag_conf', )),
+    (('first', ), ()),
+    (None, None),
+])
+def test_concurrent_plugins_conflicting(tmpdir, docker_tasker, second_reads, second_writes):
+    workflow = mock_workflow(tmpdir)
+    log = mock_concurrent_plugins(('first', (), ('tag_conf', ), False),
+                                  ('second', second_reads, second_writes, False),
+                                  ('third', (), (), False))
+    runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                    [{'name': 'first'}, {'name': 'second'}, {'name': 'third'}],
+                                    max_parallel_plugins=3)
+    runner.run()
+    assert log.index(('end', 'first')) < log.index(('start', 'second'))
+    if second_writes is None:
+        # everything waits for plugin with unknown requirements
+        assert log.index(('end', 'second')) < log.index(('start', 'third'))
+
+
+def test_concurrent_plugins_koji_session(tmpdir, docker_tasker):
+    workflow = mock_workflow(tmpdir)
+    log = mock_concurrent_plugins(('first', (), (KOJI_SESSION, ), False),
+                                  ('second', (), (KOJI_SESSION, ), False))
+    runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                    [{'name': 'first'}, {'name': 'second'}],
+                                    max_parallel_plugins=2)
+    runner.run()
+    # koji sessions aren't thread-safe
+    assert log.index(('end', 'first')) < log.index(('start', 'second'))
+
+
+@pytest.mark.parametrize('keep_going', [True, False])
+def test_concurrent_plugins_failure(tmpdir, docker_tasker, keep_going):
+    workflow = mock_workflow(tmpdir)
+    log = mock_concurrent_plugins(('first', (), (), False),
+                                  ('second', (), ('tag_conf', ), False),
+                                  ('third', ('tag_conf', ), (), False),
+                                  ('allowed', (), (), True))
+    runner = ExitPluginsRunner(docker_tasker, workflow,
+                               [{'name': 'first', 'args': {'wait_for': 'e'}},
+                                {'name': 'second', 'args': {'signal': 'e', 'fail': True}},
+                                {'name': 'third'},
+                                {'name': 'allowed', 'args': {'fail': True}}],
+                               max_parallel_plugins=2)
+    with pytest.raises(PluginFailedException) as exc:
+        runner.run(keep_going=keep_going)
+
+    assert 'second' in str(exc.value)
+    assert workflow.plugin_failed
+    # plugin which was already running finished
+    assert ('end', 'first') in log
+    if keep_going:
+        assert ('end', 'third') in log
+        assert isinstance(workflow.exit_results['second'], RuntimeError)
+        assert isinstance(workflow.exit_results['allowed'], RuntimeError)
+    else:
+        assert ('start', 'third') not in log
+        assert 'second' not in workflow.exit_results
+
+
+def test_concurrent_plugins_handles_cancel(tmpdir, docker_tasker):
+    workflow = mock_workflow(tmpdir)
+    log = mock_concurrent_plugins(('first', (), (), False),
+                                  ('second', (), (), False),
+                                  ('third', (), (), False),
+                                  handles_cancel=['second'])
+    runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                   [{'name': 'first'}, {'name': 'second'}, {'name': 'third'}],
+                                   max_parallel_plugins=3)
+    runner.run()
+    # signal handlers raise BuildCanceledException in the main thread
+    assert ('main thread', 'second') in log
+    assert ('main thread', 'first') not in log
+    # nothing else runs meanwhile
+    assert log.index(('end', 'first')) < log.index(('start', 'second'))
+    assert log.index(('end', 'second')) < log.index(('start', 'third'))
+
+
+def test_concurrent_plugins_canceled(tmpdir, docker_tasker):
+    workflow = mock_workflow(tmpdir)
+    log = mock_concurrent_plugins(('first', (), ('tag_conf', ), False),
+                                  ('second', ('tag_conf', ), (), False))
+    wait_for_plugin = BuildPluginsRunner._wait_for_plugin
+
+    def cancel(finished):
+        # SIGTERM arrives while waiting for the first plugin
+        (flexmock(BuildPluginsRunner)
+            .should_receive('_wait_for_plugin')
+            .replace_with(wait_for_plugin))
+        raise BuildCanceledException('Build was canceled')
+
+    flexmock(BuildPluginsRunner).should_receive('_wait_for_plugin').replace_with(cancel)
+    runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                    [{'name': 'first'}, {'name': 'second'}],
+                                    max_parallel_plugins=2)
+    with pytest.raises(BuildCanceledException):
+        runner.run()
+
+    # the running plugin was waited for, no other was started
+    assert ('end', 'first') in log
+    assert ('start', 'second') not in log
+
+
+def test_concurrent_plugins_base_exception(tmpdir, docker_tasker):
+    workflow = mock_workflow(tmpdir)
+    mock_concurrent_plugins(('first', (), (), False))
+    runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                    [{'name': 'first', 'args': {'exit': True}}],
+                                    max_parallel_plugins=2)
+    with pytest.raises(PluginFailedException):
+        runner.run()
+
+
+def test_concurrent_plugins_missing(tmpdir, docker_tasker):
+    workflow = mock_workflow(tmpdir)
+    log = mock_concurrent_plugins(('first', (), (), False))
+    runner = PostBuildPluginsRunner(docker_tasker, workflow,
+                                    [{'name': 'first'}, {'name': 'no_such_plugin'}],
+                                    max_parallel_plugins=2)
+    with pytest.raises(PluginFailedException):
+        runner.run()
+
+    assert ('end', 'first') in log
+
+
 class TestBuildPluginsRunner(object):
 
     @pytest.mark.parametrize(('params'), [
@@ -0,0 +1,219 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import subprocess
+import tarfile
+
+import pytest
+from flexmock import flexmock
+
+from atomic_reactor import rpm_util
+from atomic_reactor.rpm_util import (RpmdbError, RpmComponentCache, extract_rpmdb_from_image,
+                                     extract_rpmdb_from_filesystem, get_image_layers_key,
+                                     parse_rpm_output, query_rpmdb)
+
+
+def make_tar(files, mode='w'):
+    """
+    :param files: list of (name, content) tuples, content None for a directory
+    :return: bytes
+    """
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as tar:
+        for name, content in files:
+            info = tarfile.TarInfo(name)
+            if content is None:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+BASE_LAYER = [
+    ('etc', None),
+    ('etc/os-release', b'fedora'),
+    ('var/lib/rpm', None),
+    ('var/lib/rpm/Packages', b'base'),
+    ('var/lib/rpm/Name', b'base'),
+    ('var/lib/rpm/__db.001', b'lock'),
+]
+TOP_LAYER = [
+    ('var/lib/rpm/Packages', b'top'),
+    ('var/lib/rpm/.wh.__db.001', b''),
+    ('usr/bin/tool', b'binary'),
+]
+
+
+def make_image(legacy=False, mode='w'):
+    files = [
+        ('top/layer.tar', make_tar(TOP_LAYER)),
+        ('base/layer.tar', make_tar(BASE_LAYER)),
+    ]
+    if legacy:
+        files.extend([
+            ('base/json', json.dumps({'id': 'base'}).encode('utf-8')),
+            ('top/json', json.dumps({'id': 'top', 'parent': 'base'}).encode('utf-8')),
+        ])
+    else:
+        manifest = [{'Config': 'config.json', 'Layers': ['base/layer.tar', 'top/layer.tar']}]
+        files.append(('manifest.json', json.dumps(manifest).encode('utf-8')))
+    return make_tar(files, mode=mode)
+
+
+def read_dir(path):
+    return dict((name, open(os.path.join(path, name), 'rb').read())
+                for name in os.listdir(path))
+
+
+@pytest.mark.parametrize('legacy', [True, False])
+@pytest.mark.parametrize('mode', ['w', 'w:gz'])
+def test_extract_rpmdb_from_image(tmpdir, legacy, mode):
+    dbpath = extract_rpmdb_from_image(io.BytesIO(make_image(legacy, mode)), str(tmpdir))
+    assert read_dir(dbpath) == {'Packages': b'top', 'Name': b'base'}
+    # nothing else is left behind
+    assert os.listdir(str(tmpdir)) == ['rpm']
+
+
+@pytest.mark.parametrize('legacy', [True, False])
+def test_extract_rpmdb_from_image_base(tmpdir, legacy):
+    base_dir = tmpdir.mkdir('base')
+    dbpath = extract_rpmdb_from_image(io.BytesIO(make_image(legacy)), str(tmpdir),
+                                      base_dest_dir=str(base_dir), base_layer_count=1)
+    assert read_dir(dbpath) == {'Packages': b'top', 'Name': b'base'}
+    assert read_dir(str(base_dir.join('rpm'))) == {'Packages': b'base', 'Name': b'base',
+                                                   '__db.001': b'lock'}
+
+
+def test_extract_rpmdb_from_image_no_layers_above_base(tmpdir):
+    base_dir = tmpdir.mkdir('base')
+    extract_rpmdb_from_image(io.BytesIO(make_image()), str(tmpdir),
+                             base_dest_dir=str(base_dir), base_layer_count=2)
+    assert not base_dir.listdir()
+
+
+def test_extract_rpmdb_from_image_opaque(tmpdir):
+    top_layer = make_tar([
+        ('var/lib/rpm/.wh..wh..opq', b''),
+        ('var/lib/rpm/Packages', b'top'),
+    ])
+    image = make_tar([
+        ('base/layer.tar', make_tar(BASE_LAYER)),
+        ('top/layer.tar', top_layer),
+        ('manifest.json', json.dumps([{'Layers': ['base/layer.tar',
+                                                  'top/layer.tar']}]).encode('utf-8')),
+    ])
+    dbpath = extract_rpmdb_from_image(io.BytesIO(image), str(tmpdir))
+    assert read_dir(dbpath) == {'Packages': b'top'}
+
+
+@pytest.mark.parametrize(('layers', 'manifest_layers'), [
+    # no rpm database at all
+    ([('base/layer.tar', make_tar([('etc/os-release', b'fedora')]))], ['base/layer.tar']),
+    # database removed by the top layer
+    ([('base/layer.tar', make_tar(BASE_LAYER)),
+      ('top/layer.tar', make_tar([('var/lib/.wh.rpm', b'')]))],
+     ['base/layer.tar', 'top/layer.tar']),
+    # layer missing
+    ([('top/layer.tar', make_tar(TOP_LAYER))], ['base/layer.tar', 'top/layer.tar']),
+])
+def test_extract_rpmdb_from_image_error(tmpdir, layers, manifest_layers):
+    image = make_tar(layers + [
+        ('manifest.json', json.dumps([{'Layers': manifest_layers}]).encode('utf-8')),
+    ])
+    with pytest.raises(RpmdbError):
+        extract_rpmdb_from_image(io.BytesIO(image), str(tmpdir))
+
+
+def test_extract_rpmdb_from_filesystem(tmpdir):
+    filesystem = make_tar([('./' + name, content) for name, content in BASE_LAYER])
+    dbpath = extract_rpmdb_from_filesystem(io.BytesIO(filesystem), str(tmpdir))
+    assert read_dir(dbpath) == {'Packages': b'base', 'Name': b'base', '__db.001': b'lock'}
+
+
+def test_query_rpmdb():
+    (flexmock(subprocess)
+        .should_receive('check_output')
+        .with_args(['rpm', '--dbpath', '/tmp/rpm', '-qa', '--qf', '%{NAME};%{VERSION}\n'])
+        .and_return(b'bash;4.4\ncoreutils;8.25\n')
+        .once())
+    assert query_rpmdb('/tmp/rpm', ['NAME', 'VERSION'], ';') == ['bash;4.4', 'coreutils;8.25']
+
+
+TAGS = ['NAME', 'VERSION', 'RELEASE', 'ARCH', 'EPOCH', 'SIGMD5', 'SIGPGP:pgpsig']
+BASE_RPMS = [
+    'bash;4.4;1;x86_64;(none);01234567;RSA/SHA256, Mon 01 Jan, Key ID 0123456789abcdef',
+    'glibc;2.24;3;x86_64;1;89abcdef;(none)',
+]
+BASE_COMPONENTS = [
+    {'type': 'rpm', 'name': 'bash', 'version': '4.4', 'release': '1', 'arch': 'x86_64',
+     'epoch': None, 'sigmd5': '01234567', 'signature': '0123456789abcdef'},
+    {'type': 'rpm', 'name': 'glibc', 'version': '2.24', 'release': '3', 'arch': 'x86_64',
+     'epoch': 1, 'sigmd5': '89abcdef', 'signature': None},
+]
+NEW_RPM = 'vim;8.0;1;x86_64;(none);aaaaaaaa;(none)'
+NEW_COMPONENT = {'type': 'rpm', 'name': 'vim', 'version': '8.0', 'release': '1',
+                 'arch': 'x86_64', 'epoch': None, 'sigmd5': 'aaaaaaaa', 'signature': None}
+
+
+def test_parse_rpm_output():
+    output = BASE_RPMS + [
+        'gpg-pubkey;qwe123;zxcasd123;(none);(none);(none);(none)',
+        'incomplete;1.0',
+    ]
+    known = {}
+    assert parse_rpm_output(output, TAGS, known=known) == BASE_COMPONENTS
+    assert len(known) == 4
+
+    # known lines are not parsed again
+    flexmock(rpm_util).should_receive('parse_rpm_line').never()
+    assert parse_rpm_output(output, TAGS, known=known) == BASE_COMPONENTS
+
+
+@pytest.mark.parametrize(('inspect', 'key'), [
+    ({'Id': 'sha256:123', 'RootFS': {'Type': 'layers', 'Layers': ['sha256:a', 'sha256:b']}},
+     hashlib.sha256(b'sha256:123\nsha256:a\nsha256:b').hexdigest()),
+    ({'Id': 'sha256:123'}, hashlib.sha256(b'sha256:123').hexdigest()),
+])
+def test_get_image_layers_key(inspect, key):
+    assert get_image_layers_key(inspect) == key
+
+
+@pytest.mark.parametrize('shared', [True, False])
+def test_rpm_component_cache(tmpdir, shared):
+    cache_dir = str(tmpdir) if shared else None
+    cache = RpmComponentCache(cache_dir)
+    assert cache.get_components(BASE_RPMS, TAGS, key='base') == BASE_COMPONENTS
+    if shared:
+        # another build on the same host
+        cache = RpmComponentCache(cache_dir)
+
+    calls = []
+    original = rpm_util.parse_rpm_line
+
+    def parse_rpm_line(line, tags, separator=';'):
+        calls.append(line)
+        return original(line, tags, separator)
+
+    flexmock(rpm_util).should_receive('parse_rpm_line').replace_with(parse_rpm_line)
+    components = cache.get_components(BASE_RPMS + [NEW_RPM], TAGS, key='image',
+                                      base_key='base')
+    assert components == BASE_COMPONENTS + [NEW_COMPONENT]
+    # only the package the base image doesn't have was parsed
+    assert calls == [NEW_RPM]
+
+    assert cache.load('image', TAGS)['lines'] == BASE_RPMS + [NEW_RPM]
+    assert cache.load('image', TAGS, separator=',') is None
+    assert cache.load('unknown', TAGS) is None
@@ -32,6 +32,25 @@ class TestPathSource(object):
         #  since second (and any subsequent) access does a bit different thing than the first one
         assert ps.get() == path
 
+    def test_copies_once(self, tmpdir):
+        tmpdir.ensure('foo', '.git', 'config')
+        tmpdir.join('foo', 'Dockerfile').write('FROM fedora\n', ensure=True)
+        tmpdir.ensure('foo', 'help.md')
+        tmpdir.join('foo', '.dockerignore').write('*.md\n')
+        ps = PathSource('path', 'file://' + os.path.join(str(tmpdir), 'foo'))
+        path = ps.path
+        # .dockerignore only applies to the context sent to docker daemon
+        assert os.path.isfile(os.path.join(path, 'help.md'))
+        assert os.path.isfile(os.path.join(path, '.git', 'config'))
+
+        # changes made by plugins are kept
+        with open(os.path.join(path, 'Dockerfile'), 'a') as dockerfile:
+            dockerfile.write('LABEL x=y\n')
+        ps.get_dockerfile_path()
+        assert ps.get() == path
+        with open(os.path.join(path, 'Dockerfile')) as dockerfile:
+            assert dockerfile.read() == 'FROM fedora\nLABEL x=y\n'
+
 
 class TestGetSourceInstanceFor(object):
     @pytest.mark.parametrize('source, expected', [
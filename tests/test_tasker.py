@@ -10,12 +10,17 @@ from __future__ import print_function, unicode_literals
 
 from tests.fixtures import temp_image_name
 
+import atomic_reactor.core
 from atomic_reactor.core import DockerTasker
-from atomic_reactor.util import ImageName, clone_git_repo
+from atomic_reactor.util import ImageName, clone_git_repo, get_checksums
 from tests.constants import LOCALHOST_REGISTRY, INPUT_IMAGE, DOCKERFILE_GIT, MOCK, COMMAND
 from tests.util import requires_internet
 
 import docker, docker.errors
+import gzip
+import io
+import os
+import tarfile
 
 from flexmock import flexmock
 import pytest
@@ -289,6 +294,30 @@ def test_build_image_from_path(tmpdir, temp_image_name):
     t.remove_image(temp_image_name)
 
 
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_build_image_from_path_streams_context(tmpdir, compression):
+    if MOCK:
+        mock_docker()
+
+    tmpdir.join('Dockerfile').write('FROM fedora\n')
+    tmpdir.join('.dockerignore').write('*.log\n')
+    tmpdir.join('debug.log').write('')
+    t = DockerTasker()
+
+    def build(fileobj, custom_context, encoding, **kwargs):
+        assert custom_context
+        assert encoding == compression
+        data = b''.join(fileobj)
+        if compression:
+            data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            assert sorted(tar.getnames()) == ['.dockerignore', 'Dockerfile']
+        return iter([])
+
+    flexmock(t.d).should_receive('build').replace_with(build).once()
+    list(t.build_image_from_path(str(tmpdir), input_image_name, compression=compression))
+
+
 @requires_internet
 def test_build_image_from_git(temp_image_name):
     if MOCK:
@@ -311,6 +340,15 @@ def test_get_info():
     assert isinstance(response, dict)
 
 
+def test_get_static_info():
+    if MOCK:
+        mock_docker()
+
+    t = DockerTasker()
+    response = t.get_static_info()
+    assert isinstance(response, dict)
+
+
 def test_get_version():
     if MOCK:
         mock_docker()
@@ -320,6 +358,28 @@ def test_get_version():
     assert isinstance(response, dict)
 
 
+@pytest.mark.parametrize('to_fileobj', [True, False])
+def test_save_image_to(tmpdir, to_fileobj):
+    if MOCK:
+        mock_docker()
+
+    t = DockerTasker()
+    path = os.path.join(str(tmpdir), 'image.tar')
+    if to_fileobj:
+        with open(path, 'wb') as fileobj:
+            metadata = t.save_image_to(input_image_name, fileobj, chunk_size=100)
+        assert 'path' not in metadata
+    else:
+        metadata = t.save_image_to(input_image_name, path, chunk_size=100)
+        assert metadata['path'] == path
+
+    assert metadata['size'] == os.path.getsize(path)
+    assert metadata['size'] > 0
+    checksums = get_checksums(path, ['md5', 'sha256'])
+    assert metadata['md5sum'] == checksums['md5sum']
+    assert metadata['sha256sum'] == checksums['sha256sum']
+
+
 @pytest.mark.parametrize(('timeout', 'expected_timeout'), [
     (None, 120),
     (60, 60),
@@ -334,3 +394,133 @@ def test_timeout(timeout, expected_timeout):
         kwargs['timeout'] = timeout
 
     t = DockerTasker(**kwargs)
+
+
+def test_inspect_image_cache():
+    if MOCK:
+        mock_docker()
+
+    base = {'Id': 'sha256:base', 'RepoTags': ['fedora:latest']}
+    other = {'Id': 'sha256:other', 'RepoTags': ['fedora:26']}
+    inspects = {'fedora': base, 'fedora:latest': base, 'sha256:base': base,
+                'fedora:26': other}
+    (flexmock(docker.Client)
+        .should_receive('inspect_image')
+        .replace_with(lambda image_id: inspects[image_id])
+        .times(6))
+    flexmock(docker.Client).should_receive('tag').and_return(True)
+    flexmock(docker.Client).should_receive('remove_image')
+
+    t = DockerTasker()
+    assert t.inspect_image(ImageName.parse('fedora')) == base
+    assert t.inspect_image('sha256:base') == base
+    assert t.inspect_image('fedora:26') == other
+    # copies are returned, callers may change them
+    t.inspect_image('fedora')['Id'] = 'changed'
+    assert t.inspect_image('fedora') == base
+
+    # fedora:latest moves to the other image, both inspections are dropped
+    t.tag_image('fedora:26', ImageName.parse('fedora:latest'))
+    assert t.inspect_image('fedora') == base
+    assert t.inspect_image('sha256:base') == base
+    assert t.inspect_image('fedora:26') == other
+
+    # all names of the removed image are forgotten
+    t.remove_image('sha256:base')
+    assert t._inspect_cache.keys() == set(['fedora:26'])
+
+
+def test_inspect_image_no_cache():
+    if MOCK:
+        mock_docker()
+
+    (flexmock(docker.Client)
+        .should_receive('inspect_image')
+        .and_return({'Id': 'sha256:base'})
+        .twice())
+    t = DockerTasker(cache=False)
+    t.inspect_image('fedora')
+    t.inspect_image('fedora')
+
+
+@pytest.mark.parametrize(('method', 'getter', 'result'), [
+    ('info', 'static_info', {'Architecture': 'x86_64'}),
+    ('version', 'version', {'Arch': 'amd64'}),
+])
+def test_get_info_version_cache(method, getter, result):
+    if MOCK:
+        mock_docker()
+
+    flexmock(docker.Client).should_receive(method).and_return(result).once()
+    t = DockerTasker()
+    get = getattr(t, 'get_' + getter)
+    assert get() == result
+    get().clear()
+    assert get() == result
+
+
+def test_get_info_cache_static_fields():
+    if MOCK:
+        mock_docker()
+
+    info = {'Name': 'builder.example.com', 'OperatingSystem': 'Fedora', 'Containers': 3}
+    flexmock(docker.Client).should_receive('info').and_return(info).twice()
+    t = DockerTasker()
+    static_info = {'Name': 'builder.example.com', 'OperatingSystem': 'Fedora'}
+    assert t.get_static_info() == static_info
+    assert t.get_static_info() == static_info
+    # counters change, full info isn't served from cache
+    assert t.get_info() == info
+
+
+def test_image_exists_not_cached():
+    if MOCK:
+        mock_docker()
+
+    (flexmock(docker.Client)
+        .should_receive('inspect_image')
+        .and_return({'Id': 'sha256:123'})
+        .and_return(None)
+        .times(2))
+    t = DockerTasker()
+    assert t.image_exists('sha256:123')
+    assert not t.image_exists('sha256:123')
+
+
+def test_get_image_info_by_id_inspects():
+    if MOCK:
+        mock_docker()
+
+    flexmock(docker.Client).should_receive('images').never()
+    (flexmock(docker.Client)
+        .should_receive('inspect_image')
+        .and_return({'Id': 'sha256:base', 'Parent': 'sha256:parent',
+                     'RepoTags': ['fedora:latest'], 'Created': '2017-01-01T00:00:00Z',
+                     'Size': 1, 'VirtualSize': 2}))
+    t = DockerTasker()
+    assert t.get_image_info_by_image_id('sha256:base') == {
+        'Created': '2017-01-01T00:00:00Z',
+        'Id': 'sha256:base',
+        'ParentId': 'sha256:parent',
+        'RepoTags': ['fedora:latest'],
+        'Size': 1,
+        'VirtualSize': 2,
+    }
+
+
+@pytest.mark.parametrize(('shared_client', 'env', 'shared'), [
+    (None, '', False),
+    (None, '1', True),
+    (True, '', True),
+    (False, '1', False),
+])
+def test_shared_client(monkeypatch, shared_client, env, shared):
+    if MOCK:
+        mock_docker()
+
+    monkeypatch.setenv(atomic_reactor.core.SHARED_DOCKER_CLIENT_ENV, env)
+    first = DockerTasker(shared_client=shared_client)
+    second = DockerTasker(shared_client=shared_client)
+    assert (first.d is second.d) == shared
+    # differently configured tasker doesn't get the same client
+    assert DockerTasker(timeout=1, shared_client=shared_client).d is not first.d
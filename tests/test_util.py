@@ -8,15 +8,19 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import hashlib
 import json
 import os
 import tempfile
 import pytest
+import requests
 import responses
 import six
+import subprocess
 
 from tempfile import mkdtemp
 from textwrap import dedent
+from dockerfile_parse import DockerfileParser
 from flexmock import flexmock
 
 from collections import OrderedDict
@@ -30,7 +34,12 @@ from atomic_reactor.util import (ImageName, wait_for_command, clone_git_repo,
                                  human_size, CommandResult,
                                  get_manifest_digests, ManifestDigest,
                                  get_build_json, is_scratch_build, df_parser,
-                                 are_plugins_in_order)
+                                 CachedDockerfileParser,
+                                 are_plugins_in_order, StreamChecksums,
+                                 ChecksumWriter, get_exported_image_metadata,
+                                 ChecksumCache, RegistrySession, get_registry_session,
+                                 get_dockercfg_credentials, parse_www_authenticate,
+                                 get_remote_manifest_digest)
 from atomic_reactor import util
 from tests.constants import DOCKERFILE_GIT, INPUT_IMAGE, MOCK, DOCKERFILE_SHA1, MOCK_SOURCE
 from atomic_reactor.constants import INSPECT_CONFIG
@@ -124,6 +133,88 @@ def test_clone_git_repo_by_sha1(tmpdir):
     assert os.path.isdir(os.path.join(tmpdir_path, '.git'))
 
 
+def make_git_repo(path):
+    """
+    create git repo with two commits on master and one on a branch
+
+    :return: dict, name -> SHA-1 of commits
+    """
+    def git(*args):
+        cmd = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+        return subprocess.check_output(cmd + list(args), cwd=path).strip().decode('ascii')
+
+    os.makedirs(path)
+    git('init', '-q')
+    git('checkout', '-q', '-b', 'master')
+    commits = {}
+    for name in ('first', 'second'):
+        with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+            f.write('FROM {}\n'.format(name))
+        git('add', 'Dockerfile')
+        git('commit', '-q', '-m', name)
+        commits[name] = git('rev-parse', 'HEAD')
+    git('checkout', '-q', '-b', 'branch', commits['first'])
+    git('commit', '-q', '--allow-empty', '-m', 'branch')
+    commits['branch'] = git('rev-parse', 'HEAD')
+    git('checkout', '-q', 'master')
+    return commits
+
+
+@pytest.mark.parametrize(('ref', 'expected'), [
+    (None, 'second'),
+    ('master', 'second'),
+    ('branch', 'branch'),
+    ('first', 'first'),
+])
+@pytest.mark.parametrize('from_env', [True, False])
+def test_clone_git_repo_cached(tmpdir, monkeypatch, ref, expected, from_env):
+    repo_path = os.path.join(str(tmpdir), 'repo')
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    commits = make_git_repo(repo_path)
+    if ref == 'first':
+        # SHA-1 not pointed to by any ref
+        ref = commits['first']
+    if from_env:
+        monkeypatch.setenv(util.GIT_CACHE_ENV, cache_dir)
+        kwargs = {}
+    else:
+        kwargs = {'cache_dir': cache_dir}
+
+    target_dir = os.path.join(str(tmpdir), 'target')
+    commit_id = clone_git_repo(repo_path, target_dir, ref, **kwargs)
+    assert commit_id.decode('ascii') == commits[expected]
+    assert os.path.isdir(os.path.join(target_dir, '.git'))
+    assert os.path.isdir(util.get_git_mirror_path(cache_dir, repo_path))
+
+    origin = subprocess.check_output(['git', 'config', 'remote.origin.url'], cwd=target_dir)
+    assert origin.strip().decode('utf-8') == repo_path
+    # the clone doesn't borrow objects from the mirror
+    assert not os.path.exists(os.path.join(target_dir, '.git', 'objects', 'info', 'alternates'))
+
+
+def test_git_mirror_update(tmpdir):
+    repo_path = os.path.join(str(tmpdir), 'repo')
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    make_git_repo(repo_path)
+
+    mirror_path, first_head = util.update_git_mirror(repo_path, cache_dir, 'master')
+    subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                           'commit', '-q', '--allow-empty', '-m', 'third'], cwd=repo_path)
+    third = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_path)
+
+    # the existing mirror is fetched into on each update, new commits are found
+    (flexmock(subprocess)
+        .should_call('check_call')
+        .with_args(['git', '--git-dir', mirror_path, 'fetch', '--prune', 'origin'])
+        .twice())
+    assert util.update_git_mirror(repo_path, cache_dir, 'master') == (
+        mirror_path, third.strip().decode('ascii'))
+    assert len(os.listdir(os.path.dirname(mirror_path))) == 2  # mirror and lock file
+
+    with pytest.raises(subprocess.CalledProcessError):
+        util.update_git_mirror(repo_path, cache_dir, 'unknown')
+
+
 @requires_internet
 def test_figure_out_dockerfile(tmpdir):
     tmpdir_path = str(tmpdir.realpath())
@@ -209,6 +300,113 @@ def test_get_hexdigests(tmpdir, content, algorithms, expected):
         assert checksums == expected
 
 
+@pytest.mark.parametrize('content, algorithms, expected', [
+    ([b'a', b'', b'bc'], ('md5', 'sha256'),
+     {'md5sum': '900150983cd24fb0d6963f7d28e17f72',
+      'sha256sum': 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'}),
+    ([b'abc'], ('md5',), {'md5sum': '900150983cd24fb0d6963f7d28e17f72'}),
+    ([], (), {}),
+])
+def test_stream_checksums(tmpdir, content, algorithms, expected):
+    stream_checksums = StreamChecksums(algorithms)
+    path = os.path.join(str(tmpdir), 'out')
+    with open(path, 'wb') as fp:
+        writer = ChecksumWriter(fp, algorithms)
+        for chunk in content:
+            stream_checksums.update(chunk)
+            writer.write(chunk)
+        writer.flush()
+        assert writer.tell() == len(b''.join(content))
+
+    assert stream_checksums.size == len(b''.join(content))
+    assert stream_checksums.checksums == expected
+    assert writer.checksums == expected
+    assert get_checksums(path, algorithms) == expected
+
+
+def test_checksum_cache(tmpdir):
+    cache_path = os.path.join(str(tmpdir), 'cache.json')
+    path = os.path.join(str(tmpdir), 'file')
+    with open(path, 'wb') as fp:
+        fp.write(b'abc')
+
+    cache = ChecksumCache(cache_path)
+    assert cache.get(path) == {}
+    cache.update(path, {'md5sum': 'md5', 'size': 3})
+    assert cache.get(path) == {'md5sum': 'md5'}
+
+    # loaded from file by another instance
+    cache = ChecksumCache(cache_path)
+    assert cache.get(path) == {'md5sum': 'md5'}
+
+    # entry is not used once the file changes
+    with open(path, 'wb') as fp:
+        fp.write(b'abcd')
+    assert cache.get(path) == {}
+
+
+def test_get_checksums_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr(util, '_checksum_cache', ChecksumCache())
+    path = os.path.join(str(tmpdir), 'file')
+    with open(path, 'wb') as fp:
+        fp.write(b'abc')
+
+    md5 = {'md5sum': '900150983cd24fb0d6963f7d28e17f72'}
+    sha256 = {'sha256sum': 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'}
+    (flexmock(util)
+        .should_call('_compute_checksums')
+        .with_args(path, ['md5'])
+        .once())
+    assert get_checksums(path, ['md5']) == md5
+
+    # only the missing checksum is computed
+    (flexmock(util)
+        .should_call('_compute_checksums')
+        .with_args(path, ['sha256'])
+        .once())
+    expected = dict(md5)
+    expected.update(sha256)
+    assert get_checksums(path, ['md5', 'sha256']) == expected
+    assert get_checksums(path, ['sha256']) == sha256
+
+
+def test_get_checksums_blocks(tmpdir, monkeypatch):
+    monkeypatch.setattr(util, '_checksum_cache', ChecksumCache())
+    monkeypatch.setattr(util, 'CHECKSUM_BLOCK_SIZE', 1000)
+    path = os.path.join(str(tmpdir), 'file')
+    with open(path, 'wb') as fp:
+        fp.write(b'abc' * 10000)
+
+    expected = {
+        'md5sum': hashlib.md5(b'abc' * 10000).hexdigest(),
+        'sha256sum': hashlib.sha256(b'abc' * 10000).hexdigest(),
+    }
+    assert get_checksums(path, ['md5', 'sha256']) == expected
+
+
+@pytest.mark.parametrize('known', [True, False])
+def test_get_exported_image_metadata(tmpdir, known):
+    path = os.path.join(str(tmpdir), 'image.tar')
+    with open(path, 'wb') as fp:
+        fp.write(b'abc')
+
+    checksums = None
+    if known:
+        checksums = {'md5sum': 'known-md5', 'sha256sum': 'known-sha256'}
+        (flexmock(util)
+            .should_receive('_compute_checksums')
+            .never())
+
+    metadata = get_exported_image_metadata(path, checksums=checksums)
+    assert metadata['path'] == path
+    assert metadata['size'] == 3
+    if known:
+        assert metadata['md5sum'] == 'known-md5'
+        assert metadata['sha256sum'] == 'known-sha256'
+    else:
+        assert metadata['md5sum'] == '900150983cd24fb0d6963f7d28e17f72'
+
+
 def test_get_versions_of_tools():
     response = get_version_of_tools()
     assert isinstance(response, list)
@@ -401,6 +599,108 @@ def test_get_manifest_digests_missing(tmpdir, v1_digest, v2_digest):
         assert actual_digests.v2 is None
 
 
+@pytest.mark.parametrize('header, expected', [
+    ('Bearer realm="https://auth.example.com/token",service="registry.example.com",'
+     'scope="repository:spam:pull"',
+     {'realm': 'https://auth.example.com/token', 'service': 'registry.example.com',
+      'scope': 'repository:spam:pull'}),
+    ('Basic realm="registry"', None),
+    ('', None),
+])
+def test_parse_www_authenticate(header, expected):
+    assert parse_www_authenticate(header) == expected
+
+
+@responses.activate
+def test_registry_session_bearer_token(tmpdir):
+    temp_dir = mkdtemp(dir=str(tmpdir))
+    with open(os.path.join(temp_dir, '.dockercfg'), 'w+') as dockerconfig:
+        dockerconfig.write(json.dumps({
+            'registry.example.com': {'username': 'user', 'password': 'pass'}
+        }))
+
+    url = 'https://registry.example.com/v2/spam/manifests/latest'
+    token_url = 'https://auth.example.com/token'
+    challenge = ('Bearer realm="{}",service="registry.example.com",'
+                 'scope="repository:spam:pull"'.format(token_url))
+
+    def manifest_callback(request):
+        if request.headers.get('Authorization') == 'Bearer spam-token':
+            return (200, {}, '{}')
+        return (401, {'WWW-Authenticate': challenge}, '')
+
+    def token_callback(request):
+        assert request.headers['Authorization'].startswith('Basic ')
+        assert 'scope=repository%3Aspam%3Apull' in request.url
+        return (200, {}, json.dumps({'token': 'spam-token'}))
+
+    responses.add_callback(responses.GET, url, callback=manifest_callback)
+    responses.add_callback(responses.GET, token_url, callback=token_callback,
+                           match_querystring=False)
+
+    session = RegistrySession('registry.example.com', dockercfg_path=temp_dir)
+    for _ in range(3):
+        response = session.get('/v2/spam/manifests/latest', repository='spam')
+        assert response.status_code == 200
+
+    # token is requested once and reused
+    requested = [call.request.url.split('?')[0] for call in responses.calls]
+    assert requested.count(token_url) == 1
+    assert len(responses.calls) == 5
+
+
+def test_get_registry_session(tmpdir):
+    temp_dir = mkdtemp(dir=str(tmpdir))
+    with open(os.path.join(temp_dir, '.dockercfg'), 'w+') as dockerconfig:
+        dockerconfig.write(json.dumps({
+            'registry.example.com': {'username': 'user', 'password': 'pass'}
+        }))
+
+    (flexmock(util.Dockercfg)
+        .should_call('__init__')
+        .once())
+    session = get_registry_session('registry.example.com', dockercfg_path=temp_dir)
+    assert session.registry == 'https://registry.example.com'
+    assert session.auth is not None
+    assert get_registry_session('registry.example.com', dockercfg_path=temp_dir) is session
+    assert get_registry_session('registry.example.com', insecure=True,
+                                dockercfg_path=temp_dir) is not session
+    assert get_dockercfg_credentials(temp_dir, 'registry.example.com') == {
+        'username': 'user', 'password': 'pass'
+    }
+
+
+@pytest.mark.parametrize(('status', 'expected'), [
+    (200, 'sha256:spam'),
+    (404, None),
+])
+@responses.activate
+def test_get_remote_manifest_digest(status, expected):
+    url = 'https://registry.example.com/v2/library/spam/manifests/1.0'
+
+    def request_callback(request):
+        accepted = request.headers['Accept'].split(', ')
+        assert accepted[0] == 'application/vnd.docker.distribution.manifest.list.v2+json'
+        assert 'application/vnd.docker.distribution.manifest.v2+json' in accepted
+        return (status, {'Docker-Content-Digest': 'sha256:spam'}, '')
+
+    responses.add_callback(responses.HEAD, url, callback=request_callback)
+
+    image = ImageName.parse('registry.example.com/library/spam:1.0')
+    assert get_remote_manifest_digest(image, image.registry) == expected
+    assert len(responses.calls) == 1
+    assert responses.calls[0].request.method == 'HEAD'
+
+
+@responses.activate
+def test_get_remote_manifest_digest_error():
+    url = 'https://registry.example.com/v2/spam/manifests/latest'
+    responses.add(responses.HEAD, url, status=500)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        get_remote_manifest_digest(ImageName.parse('spam'), 'registry.example.com')
+
+
 @pytest.mark.parametrize('v1,v2,default', [
     ('v1-digest', 'v2-digest', 'v2-digest'),
     ('v1-digest', None, 'v1-digest'),
@@ -498,6 +798,74 @@ def test_df_parser_parent_env_wf(tmpdir, caplog, env_arg):
         assert df.labels.get('label') == 'foobar ' + env_arg[0].split('=', 1)[1]
 
 
+def test_cached_df_parser(tmpdir, monkeypatch):
+    tmpdir.join('Dockerfile').write(dedent("""\
+        FROM fedora
+        ENV foo=bar
+        LABEL label="$foo $parent"
+        """))
+    df = CachedDockerfileParser(str(tmpdir), parent_env={'parent': 'env'})
+    assert df.baseimage == 'fedora'
+    assert df.labels == {'label': 'bar env'}
+
+    # unchanged Dockerfile is neither read nor parsed again
+    def fail(self):
+        raise AssertionError('Dockerfile read or parsed again')
+    monkeypatch.setattr(DockerfileParser, 'content',
+                        property(fail, DockerfileParser.content.fset))
+    monkeypatch.setattr(DockerfileParser, 'structure', property(fail))
+    assert df.labels == {'label': 'bar env'}
+    assert df.envs == {'foo': 'bar'}
+    assert [instruction['instruction'] for instruction in df.structure] == [
+        'FROM', 'ENV', 'LABEL']
+
+    # callers get copies
+    df.structure[0]['value'] = 'changed'
+    dict.__setitem__(df.labels, 'label', 'changed')
+    assert df.structure[0]['value'] == 'fedora'
+    assert df.labels == {'label': 'bar env'}
+
+
+def test_cached_df_parser_changes(tmpdir):
+    dockerfile = tmpdir.join('Dockerfile')
+    dockerfile.write('FROM fedora\n')
+    df = CachedDockerfileParser(str(tmpdir))
+    assert df.labels == {}
+
+    # writes through the parser
+    df.labels['label'] = 'value'
+    assert df.labels == {'label': 'value'}
+    df.baseimage = 'centos'
+    assert df.baseimage == 'centos'
+    assert DockerfileParser(str(tmpdir)).labels == {'label': 'value'}
+
+    # writes by anybody else
+    dockerfile.write('FROM fedora:26\nLABEL label="$parent"\n')
+    assert df.baseimage == 'fedora:26'
+    assert df.labels == {'label': ''}
+
+    df.parent_env = {'parent': 'env'}
+    assert df.labels == {'label': 'env'}
+
+
+def test_df_parser_workflow_shared(tmpdir):
+    tmpdir.join('Dockerfile').write('FROM fedora\nLABEL label="$test_env"\n')
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    flexmock(workflow, base_image_inspect={INSPECT_CONFIG: {'Env': ['test_env=first']}})
+
+    df = df_parser(str(tmpdir), workflow=workflow)
+    assert df is df_parser(str(tmpdir), workflow=workflow)
+    assert df.labels == {'label': 'first'}
+
+    # base image inspected again, e.g. after it was changed
+    flexmock(workflow, base_image_inspect={INSPECT_CONFIG: {'Env': ['test_env=second']}})
+    assert df_parser(str(tmpdir), workflow=workflow).labels == {'label': 'second'}
+
+    # no caching requested explicitly
+    assert df_parser(str(tmpdir), workflow=workflow, cache_content=True) is not df
+    assert df_parser(str(tmpdir), workflow=workflow, env_replace=False) is not df
+
+
 @pytest.mark.parametrize(('available', 'requested', 'result'), (
     (['spam', 'bacon', 'eggs'], ['spam'], True),
     (['spam', 'bacon', 'eggs'], ['spam', 'bacon'], True),
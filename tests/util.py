@@ -35,3 +35,35 @@ def has_connection():
 
 # In case we run tests in an environment without internet connection.
 requires_internet = pytest.mark.skipif(not has_connection(), reason="requires internet connection")
+
+
+class MockKojiMultiCallSession(object):
+    """
+    Wraps a mocked koji session to emulate multicall: while the multicall
+    attribute is set, results of calls are kept and multiCall() returns them
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.multicall = False
+        self.results = []
+        self.multicalls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self.session, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if not self.multicall:
+                return result
+            self.results.append([result])
+
+        return call
+
+    def multiCall(self, strict=False):
+        results, self.results = self.results, []
+        self.multicall = False
+        self.multicalls.append(len(results))
+        return results